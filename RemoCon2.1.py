@@ -8,9 +8,18 @@ import webbrowser
 import netifaces  # 用于局域网搜索
 import queue
 import json
-import concurrent.futures  # 用于并行扫描
-from PIL import Image, ImageTk, UnidentifiedImageError  # 用于图像处理和错误捕获
+import concurrent.futures  # 用于并行扫描和请求回复
+import itertools
+import collections
+import math
+import mmap
+from PIL import Image, ImageDraw, ImageTk, UnidentifiedImageError  # 用于图像处理和错误捕获
 import io
+import struct
+try:
+    import av  # 可选的 H.264 视频解码（PyAV/libav）
+except ImportError:  # 没有 PyAV 时只能使用 JPEG 画面
+    av = None
 
 # 软件介绍和链接设置
 SOFTWARE_INFO = """
@@ -58,8 +67,935 @@ DEFAULT_RESOLUTION_INDEX = 3  # 默认使用1280x720
 DEFAULT_FPS = 10
 DEFAULT_QUALITY = 50  # 中等质量（0-100）
 DEFAULT_DELAY = 0.5
-IMAGE_MAGIC_NUMBER = b"IMGB"  # 图像数据开头的魔术数字，用于识别
 MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 最大图像大小限制（10MB）
+MESSAGE_SEPARATOR = "|||__SEP__|||"  # 命令参数分隔符（与 client2.1.py 保持一致）
+RECV_BUFFER_SIZE = 64 * 1024  # 单次接收缓冲区大小
+SOCKET_TIMEOUT = 10  # 套接字收发超时（秒），消息读到一半超时视为连接异常
+FILE_CHUNK_SIZE = 64 * 1024  # 文件数据块大小
+
+# 消息帧格式（与 client2.1.py 保持一致）：
+# 通道(1字节) + 类型(1字节) + 请求ID(4字节) + 负载长度(4字节) + 负载，整数均为大端
+# 回复携带与请求相同的请求ID，主动推送的数据（如屏幕画面）请求ID为0
+MESSAGE_HEADER = struct.Struct("!BBII")
+
+# 逻辑通道：同一连接上的控制、命令输出、屏幕画面和文件数据互不阻塞，回复沿请求所在通道返回
+CHANNEL_CONTROL = 0
+CHANNEL_OUTPUT = 1
+CHANNEL_SCREEN = 2
+CHANNEL_FILE = 3
+SCREEN_QUEUE_SIZE = 5  # 画面通道只保留最新的几帧，防止内存溢出
+DISPLAY_RESAMPLE = Image.BILINEAR  # 监控画面缩放到窗口尺寸的方式（在解码线程中执行，每帧都要缩放，不用 LANCZOS）
+RESIZE_DEBOUNCE_MS = 400  # 窗口停止调整大小多久后再向被控端请求匹配的画面尺寸（毫秒）
+VIEWPORT_TOLERANCE = 0.1  # 画面尺寸与显示区域相差超过此比例才重新请求
+MIN_REGION_DRAG = 8  # 框选区域的最小边长（显示像素），更小的视为误点击
+CLOCK_SYNC_INTERVAL = 5  # 校准与被控端时钟偏差的间隔（秒），用于计算端到端延迟
+CLOCK_SYNC_SAMPLES = 8  # 保留最近几次校准结果，取往返时间最短的一次
+STATS_REFRESH_MS = 500  # 监控窗口中延迟统计的刷新间隔（毫秒）
+STATS_SMOOTHING = 0.2  # 各阶段耗时的指数平滑系数
+DISPLAY_FPS_WINDOW = 2  # 统计实际显示帧率的时间窗口（秒）
+FEEDBACK_INTERVAL = 1.0  # 向被控端回报丢帧数和解码耗时的间隔（秒），用于自适应调整画面参数
+
+# 监控墙：每台设备以低分辨率、低帧率发送缩略画面，由共享的解码线程池解码
+WALL_THUMB_SIZE = (320, 180)
+WALL_FPS = 2
+WALL_QUALITY = 40
+WALL_DECODE_WORKERS = 2
+WALL_REFRESH_MS = 200
+WALL_CONNECT_TIMEOUT = 3  # 连接各设备的超时（秒），离线设备不拖慢监控墙
+H264_KEYFRAME_NAL_TYPES = (5, 7)  # IDR 图像和 SPS，收到后解码器可以从这一帧开始解码
+
+# 请求等待回复的超时时间（秒）
+REQUEST_TIMEOUT = 10
+COMMAND_TIMEOUT = 35  # 被控端命令执行超时为30秒，留出传输余量
+POPUP_TIMEOUT = 5
+FILE_REPLY_TIMEOUT = 30  # 文件数据发送完毕后等待确认的时间
+
+MSG_COMMAND = 0x01     # 系统命令
+MSG_CONTROL = 0x02     # 控制命令（__START_MONITOR__ 等）
+MSG_TEXT = 0x03        # 文本回复
+MSG_IMAGE = 0x04       # 屏幕图像数据
+MSG_FILE_BEGIN = 0x05  # 文件传输开始（文件名|文件大小）
+MSG_FILE_DATA = 0x06   # 文件数据块
+MSG_FILE_END = 0x07    # 文件传输结束
+MSG_TILES = 0x08       # 屏幕增量画面（仅包含变化的块）
+MAX_MESSAGE_SIZE = MAX_IMAGE_SIZE + 1024  # 单条消息最大长度
+
+# 画面头（与 client2.1.py 保持一致），位于 MSG_IMAGE / MSG_TILES 负载开头：
+# 版本(1字节) + 编码方式(1字节) + 序号(4字节) + 捕获时间(8字节) + 发送时间(8字节)
+# + 捕获耗时(4字节，微秒) + 编码耗时(4字节，微秒)；时间为被控端时钟的 Unix 时间戳
+FRAME_HEADER = struct.Struct("!BBIddII")
+FRAME_VERSION = 1
+CODEC_NONE = 0  # 心跳：画面没有变化，只有画面头，没有图像数据
+CODEC_JPEG = 1
+CODEC_H264 = 2  # H.264 帧间编码，负载为 Annex B 格式的一帧码流
+CODEC_PNG = 3  # 调色板 PNG，用于文字、表格等颜色少的画面
+CODEC_MIXED = 4  # 增量画面：每块各自选择编码方式，见块头
+IMAGE_CODECS = (CODEC_JPEG, CODEC_PNG)  # 可由 PIL 直接解码的编码方式
+
+# 增量画面负载（与 client2.1.py 保持一致），位于画面头之后：
+# 画面宽(2字节) + 画面高(2字节) + 块数(2字节)，随后每块为 x, y, 宽, 高(各2字节) + 编码方式(1字节)
+# + 数据长度(4字节) + 数据
+TILES_HEADER = struct.Struct("!HHH")
+TILE_HEADER = struct.Struct("!HHHHBI")
+
+# 录像：已编码的画面原样写入分段文件，索引文件中每帧一条定长记录，回放时按时间二分查找
+# 索引记录：接收时间、分段编号、分段内偏移、长度、消息类型、编码方式、是否可独立解码
+RECORD_INDEX = struct.Struct("!dIIIBBB")
+RECORDINGS_DIR = "recordings"  # 录像保存目录，每次录制一个子目录
+RECORD_INDEX_FILE = "index.bin"
+RECORD_SEGMENT_FILE = "segment_{:04d}.bin"
+RECORD_SEGMENT_SIZE = 64 * 1024 * 1024  # 分段文件超过此长度后写入新的分段
+RECORD_QUEUE_SIZE = 120  # 等待写盘的画面数上限，磁盘跟不上时丢弃画面直到下一个完整画面
+
+
+def pack_message(channel, msg_type, payload=b"", request_id=0):
+    """按帧格式打包一条消息"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    return MESSAGE_HEADER.pack(channel, msg_type, request_id, len(payload)) + payload
+
+
+def h264_is_keyframe(data):
+    """判断一帧 H.264 码流（Annex B 格式）是否可以独立解码"""
+    data = bytes(data[:1024])  # SPS/PPS/IDR 起始位于码流开头
+    index = data.find(b"\x00\x00\x01")
+    while 0 <= index < len(data) - 3:
+        if (data[index + 3] & 0x1F) in H264_KEYFRAME_NAL_TYPES:
+            return True
+        index = data.find(b"\x00\x00\x01", index + 3)
+    return False
+
+
+def frame_is_keyframe(msg_type, payload):
+    """判断一条画面消息（画面头 + 数据）能否不依赖前一帧单独解码"""
+    codec = payload[1]
+    if codec == CODEC_H264:
+        return h264_is_keyframe(payload[FRAME_HEADER.size:])
+    return msg_type == MSG_IMAGE and codec in IMAGE_CODECS
+
+
+def paste_tiles(frame, data):
+    """把增量画面中的各变化块按原始坐标粘贴到 frame 上，返回变化块数"""
+    count = TILES_HEADER.unpack_from(data, 0)[2]
+    offset = TILES_HEADER.size
+    for _ in range(count):
+        x, y, w, h, codec, length = TILE_HEADER.unpack_from(data, offset)
+        offset += TILE_HEADER.size
+        if codec not in IMAGE_CODECS:
+            raise ValueError(f"不支持的画面块编码: {codec}")
+        tile = Image.open(MemoryViewReader(data[offset:offset + length]))
+        frame.paste(tile, (x, y))
+        offset += length
+    return count
+
+
+class FrameBufferPool:
+    """复用的画面接收缓冲区，避免每帧重新分配和拼接
+
+    读线程取一个空闲缓冲区接收一帧，缓冲区随画面交给消费者；消费者处理完这一帧、
+    或画面在队列中被丢弃时调用 release 归还。空闲缓冲区用完（消费者积压）时新分配一个，
+    仍在使用的缓冲区不会被覆盖。缓冲区按帧长度增长后不再缩小，最多保留 count 个空闲缓冲区。
+    """
+
+    def __init__(self, count=SCREEN_QUEUE_SIZE + 2):
+        self.count = count
+        self.free = [bytearray() for _ in range(count)]
+        self.lock = threading.Lock()  # 读线程取用，解码线程归还
+
+    def acquire(self, length):
+        """取一个空闲缓冲区，返回长度为 length 的可写 memoryview"""
+        with self.lock:
+            buffer = self.free.pop() if self.free else bytearray()
+        if len(buffer) < length:
+            # 按 64KB 对齐增长，帧大小小幅波动时不必反复扩容
+            size = -(-length // RECV_BUFFER_SIZE) * RECV_BUFFER_SIZE
+            try:
+                buffer.extend(bytes(size - len(buffer)))
+            except BufferError:
+                buffer = bytearray(size)  # 上一帧的解码结果仍引用着旧缓冲区，不能扩容
+        return memoryview(buffer)[:length]
+
+    def release(self, view):
+        """归还 acquire 取出的缓冲区，每帧只能归还一次"""
+        with self.lock:
+            if len(self.free) < self.count:
+                self.free.append(view.obj)
+
+
+class MemoryViewReader(io.RawIOBase):
+    """基于 memoryview 的只读文件对象，解码器直接读取接收缓冲区，不复制整帧"""
+
+    def __init__(self, view):
+        super().__init__()
+        self.view = view
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self.view) - self.pos))
+        b[:n] = self.view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.pos = max(0, offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+class MessageReader:
+    """阻塞式消息读取器
+
+    小消息在接收缓冲区中批量解析（一次 recv 可得到多条消息）；屏幕图像等
+    大负载读取长度头后用 recv_into 直接写入预分配的缓冲区，不做拼接复制。
+    """
+
+    def __init__(self, sock, max_size=MAX_MESSAGE_SIZE):
+        self.sock = sock
+        self.max_size = max_size
+        self.buffer = bytearray(RECV_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # 未处理数据的起点
+        self.end = 0    # 已接收数据的终点
+        self.frame_pool = FrameBufferPool()
+
+    def fill(self):
+        """接收更多数据到缓冲区尾部；连接关闭时抛出 EOFError"""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            # 把未处理的残余数据移到缓冲区开头（不超过一个消息头或一条小消息）
+            remaining = self.end - self.start
+            self.buffer[:remaining] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, remaining
+        n = self.sock.recv_into(self.view[self.end:])
+        if n == 0:
+            raise EOFError("连接已被远程关闭")
+        self.end += n
+
+    def read_into(self, target):
+        """把一条消息的负载完整读入 target（memoryview）"""
+        buffered = min(self.end - self.start, len(target))
+        target[:buffered] = self.view[self.start:self.start + buffered]
+        self.start += buffered
+        received = buffered
+        try:
+            while received < len(target):
+                n = self.sock.recv_into(target[received:])
+                if n == 0:
+                    raise EOFError("连接已被远程关闭")
+                received += n
+        except socket.timeout:
+            # 消息读到一半超时，后续数据已无法对齐
+            raise ConnectionError(f"接收消息超时，已接收 {received}/{len(target)} 字节")
+
+    def read_message(self):
+        """读取一条消息，返回 (通道, 类型, 请求ID, 负载)
+
+        消息边界处的接收超时以 socket.timeout 抛出，调用方可直接重试。
+        图像负载是缓冲池中的 memoryview，处理完后须调用 release_frame 归还，其余负载为 bytes。
+        """
+        header_size = MESSAGE_HEADER.size
+        while self.end - self.start < header_size:
+            self.fill()
+        channel, msg_type, request_id, length = MESSAGE_HEADER.unpack_from(self.buffer, self.start)
+        if length > self.max_size:
+            raise ValueError(f"消息长度超出限制: {length} > {self.max_size}")
+        
+        if msg_type in (MSG_IMAGE, MSG_TILES):
+            self.start += header_size
+            payload = self.frame_pool.acquire(length)
+            self.read_into(payload)
+        elif header_size + length <= len(self.buffer):
+            # 小消息：等整条消息到齐再消费，超时重试时状态不变
+            while self.end - self.start < header_size + length:
+                self.fill()
+            self.start += header_size
+            payload = bytes(self.view[self.start:self.start + length])
+            self.start += length
+        else:
+            self.start += header_size
+            payload = bytearray(length)
+            self.read_into(memoryview(payload))
+            payload = bytes(payload)
+        return channel, msg_type, request_id, payload
+
+    def release_frame(self, payload):
+        """归还图像负载的接收缓冲区"""
+        self.frame_pool.release(payload)
+
+
+class AgentConnection:
+    """与被控端的一条连接：由唯一的读线程按通道解复用，消息放入各通道自己的队列"""
+
+    def __init__(self, ip, port, connect_timeout=SOCKET_TIMEOUT):
+        self.address = (ip, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(connect_timeout)
+        self.sock.connect(self.address)
+        self.sock.settimeout(SOCKET_TIMEOUT)
+        self.send_lock = threading.Lock()  # 保证每条消息完整写入，不同通道的消息只在消息边界交错
+        self.channels = {
+            CHANNEL_CONTROL: queue.Queue(),
+            CHANNEL_OUTPUT: queue.Queue(),
+            CHANNEL_FILE: queue.Queue(),
+            CHANNEL_SCREEN: queue.Queue(maxsize=SCREEN_QUEUE_SIZE),
+        }
+        self.screen_dropped = 0  # 画面通道因积压丢弃的帧数，增量画面据此判断是否需要完整画面
+        self.closed = threading.Event()
+        self.error = None  # 连接异常关闭的原因
+        self.recorder = None  # 录制画面时由界面设置（ScreenRecorder），读线程把收到的画面交给它
+        # 等待回复的请求表：请求ID -> [Future, 截止时间]，允许多个请求同时在途
+        self.request_ids = itertools.count(1)
+        self.pending_lock = threading.Lock()
+        self.pending_requests = {}
+        self.reader = MessageReader(self.sock)
+        self.reader_thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader_thread.start()
+
+    def send(self, channel, msg_type, payload=b"", request_id=0):
+        """在指定通道上发送一条完整消息"""
+        data = pack_message(channel, msg_type, payload, request_id)
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def new_request_id(self):
+        """分配新的请求ID"""
+        return next(self.request_ids)
+
+    def expect_reply(self, request_id, timeout=REQUEST_TIMEOUT):
+        """登记等待回复的请求并返回 Future；timeout 为 None 时暂不计时"""
+        future = concurrent.futures.Future()
+        future.request_id = request_id
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.pending_lock:
+            self.pending_requests[request_id] = [future, deadline]
+        return future
+
+    def set_deadline(self, request_id, timeout):
+        """为已登记的请求开始计时"""
+        with self.pending_lock:
+            entry = self.pending_requests.get(request_id)
+            if entry:
+                entry[1] = time.monotonic() + timeout
+
+    def request(self, channel, msg_type, payload=b"", timeout=REQUEST_TIMEOUT):
+        """发送请求，返回在收到回复、超时或连接断开时完成的 Future"""
+        request_id = self.new_request_id()
+        future = self.expect_reply(request_id, timeout)
+        try:
+            self.send(channel, msg_type, payload, request_id)
+        except Exception:
+            with self.pending_lock:
+                self.pending_requests.pop(request_id, None)
+            raise
+        return future
+
+    def expire_requests(self):
+        """让已超时的请求以 TimeoutError 结束"""
+        now = time.monotonic()
+        expired = []
+        with self.pending_lock:
+            for request_id, (future, deadline) in list(self.pending_requests.items()):
+                if deadline is not None and now >= deadline:
+                    del self.pending_requests[request_id]
+                    expired.append(future)
+        for future in expired:
+            future.set_exception(concurrent.futures.TimeoutError("等待回复超时"))
+
+    def fail_pending_requests(self, reason):
+        """连接断开时结束所有等待中的请求"""
+        with self.pending_lock:
+            pending = list(self.pending_requests.values())
+            self.pending_requests.clear()
+        for future, _ in pending:
+            future.set_exception(ConnectionError(reason))
+
+    def read_loop(self):
+        """读线程：接收所有数据并分发到各通道队列"""
+        reader = self.reader
+        try:
+            while not self.closed.is_set():
+                try:
+                    channel, msg_type, request_id, payload = reader.read_message()
+                except socket.timeout:
+                    continue  # 空闲时没有消息，继续等待
+                self.dispatch(channel, msg_type, request_id, payload)
+        except EOFError as e:
+            self.error = str(e)
+        except ValueError as e:
+            self.error = f"消息格式错误，断开连接: {str(e)}"
+        except Exception as e:
+            if not self.closed.is_set():  # 主动断开时不报告错误
+                self.error = f"接收数据出错: {str(e)}"
+        finally:
+            self.fail_pending_requests(self.error or "连接已关闭")
+            self.closed.set()
+
+    def dispatch(self, channel, msg_type, request_id, payload):
+        """回复交给等待中的请求，其他消息放入所属通道的队列"""
+        if request_id:
+            with self.pending_lock:
+                entry = self.pending_requests.pop(request_id, None)
+            if entry:
+                entry[0].set_result((msg_type, payload))
+                return
+            # 已超时或无人等待的回复，仍按通道显示
+        channel_queue = self.channels.get(channel)
+        if channel_queue is None:
+            return  # 未知通道，忽略
+        if channel != CHANNEL_SCREEN:
+            channel_queue.put((msg_type, payload))
+            return
+        # 画面通道满时丢弃最旧的帧，只保留最新的；记录接收时间用于统计延迟
+        received = time.time()
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.add(msg_type, payload, received)  # 在丢帧之前录制，录像不受界面解码速度影响
+        while True:
+            try:
+                channel_queue.put_nowait((msg_type, payload, received))
+                return
+            except queue.Full:
+                try:
+                    self.release_frame(channel_queue.get_nowait()[1])
+                    self.screen_dropped += 1
+                except queue.Empty:
+                    pass
+
+    def release_frame(self, payload):
+        """画面通道中的一帧处理完后归还其接收缓冲区（画面数据不能再被引用）"""
+        self.reader.release_frame(payload)
+
+    def discard_frames(self):
+        """丢弃画面通道中积压的所有画面"""
+        screen_queue = self.channels[CHANNEL_SCREEN]
+        while True:
+            try:
+                self.release_frame(screen_queue.get_nowait()[1])
+            except queue.Empty:
+                return
+
+    def close(self):
+        """关闭连接，读线程随之退出"""
+        self.closed.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class ScreenDecoder:
+    """画面解码线程：在界面线程之外解码、合成和缩放画面，只保留最新的一帧等待显示
+
+    队列中已有更新的完整画面时跳过旧帧；增量画面依赖前一帧，必须按顺序合成。
+    非增量模式下用 JPEG draft 模式直接按接近显示尺寸的比例解码，减少解码量。
+    同时根据画面头统计各阶段耗时、丢帧数和捕获到显示的端到端延迟。
+    """
+
+    def __init__(self, connection, delta_mode, display_size):
+        self.connection = connection
+        self.delta_mode = delta_mode
+        self.display_size = display_size  # 显示尺寸，窗口缩放时由界面线程更新
+        self.frame = None  # 当前完整画面，增量画面块合成到其上
+        self.video_decoder = None  # H.264 解码器，收到第一帧视频时创建
+        self.video_frame = None  # 已解码但尚未转换显示的视频帧
+        self.waiting_keyframe = False  # 增量画面缺失，等待完整画面
+        self.dirty = False  # 画面已更新但尚未交给界面
+        self.latest = None  # 等待界面显示的最新一帧
+        self.latest_lock = threading.Lock()
+        self.messages = queue.Queue()  # 需要在结果区显示的提示，由界面线程取出
+        self.stopped = threading.Event()
+        # 回报给被控端的画面处理统计
+        self.screen_dropped = connection.screen_dropped
+        self.feedback_dropped = connection.screen_dropped
+        self.skipped = 0
+        self.decode_time = 0.0
+        self.decode_count = 0
+        self.last_feedback_time = time.monotonic()
+        # 延迟统计：各阶段平滑后的耗时（毫秒）、按序号统计的丢帧、与被控端的时钟偏差
+        self.stage_ms = {}
+        self.latency_ms = None
+        self.last_seq = None
+        self.lost_frames = 0
+        self.skipped_frames = 0
+        self.display_times = collections.deque()  # 最近显示各帧的时间（单调时钟），统计实际显示帧率
+        self.unsupported_reported = False
+        self.clock_samples = collections.deque(maxlen=CLOCK_SYNC_SAMPLES)  # (往返时间, 偏差)
+        self.clock_offset = None  # 被控端时钟减本机时钟（秒）
+        self.clock_error = None
+        self.last_clock_sync = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def take_frame(self):
+        """取出最新一帧，返回 (已缩放到显示尺寸的画面, 捕获时间, 交给界面的时间)，没有新画面时返回 None"""
+        with self.latest_lock:
+            frame, self.latest = self.latest, None
+        return frame
+
+    def run(self):
+        screen_queue = self.connection.channels[CHANNEL_SCREEN]
+        for _ in range(3):  # 开始时多校准几次，尽快得到可用的时钟偏差
+            self.sync_clock()
+        while not self.stopped.is_set() and not self.connection.closed.is_set():
+            if time.monotonic() - self.last_clock_sync >= CLOCK_SYNC_INTERVAL:
+                self.sync_clock()
+            try:
+                msg_type, payload, received = screen_queue.get(timeout=0.2)
+            except queue.Empty:
+                self.send_feedback()
+                continue
+            try:
+                self.process_frame(screen_queue, msg_type, payload, received)
+            finally:
+                self.connection.release_frame(payload)  # 解码结果不引用接收缓冲区，可以复用
+
+    def process_frame(self, screen_queue, msg_type, payload, received):
+        """解码一帧画面并在需要时交给界面，同时记录各阶段耗时"""
+        version, codec, seq, capture_time, send_time, capture_us, encode_us = FRAME_HEADER.unpack_from(payload, 0)
+        if msg_type == MSG_TILES:
+            supported = codec == CODEC_MIXED
+        else:
+            supported = (codec in IMAGE_CODECS or codec == CODEC_NONE
+                         or (codec == CODEC_H264 and av is not None))
+        if version != FRAME_VERSION or not supported:
+            if not self.unsupported_reported:
+                self.unsupported_reported = True
+                self.messages.put(f"不支持的画面格式（版本 {version}，编码 {codec}），请更新被控端")
+            return
+        data = payload[FRAME_HEADER.size:]
+        if self.last_seq is not None and seq > self.last_seq + 1:
+            self.lost_frames += seq - self.last_seq - 1
+            if codec == CODEC_H264:
+                # 被控端丢弃视频帧后会自动发送完整画面，在此之前的帧缺少参考，不能解码
+                self.waiting_keyframe = True
+            elif (self.delta_mode and not self.waiting_keyframe
+                  and not (msg_type == MSG_IMAGE and codec in IMAGE_CODECS)):
+                # 缺失的可能是完整画面或增量画面，之后的增量画面没有正确的基准，等待并请求完整画面
+                self.request_keyframe()
+        self.last_seq = seq
+        
+        # 队列中有帧被丢弃时，后续增量画面或视频帧缺少基准，需要等待完整画面
+        if self.connection.screen_dropped != self.screen_dropped:
+            self.screen_dropped = self.connection.screen_dropped
+            if self.delta_mode or codec == CODEC_H264:
+                self.request_keyframe()
+        
+        # 画面静止时被控端只发送心跳，当前画面保持不变
+        if codec == CODEC_NONE:
+            self.send_feedback()
+            return
+        
+        # 视频帧依赖前一帧，每帧都要解码；完整画面在有更新画面时可以跳过
+        if codec in IMAGE_CODECS and not self.delta_mode and not screen_queue.empty():
+            self.skipped += 1  # 已有更新的画面，不解码这一帧
+            self.skipped_frames += 1
+            return
+        
+        decode_start = time.perf_counter()
+        waited = time.time() - received
+        try:
+            if codec == CODEC_H264:
+                self.dirty = self.decode_video(data) or self.dirty
+            elif msg_type == MSG_TILES:
+                self.dirty = self.apply_tiles(data) or self.dirty
+            else:
+                self.decode_keyframe(data)
+                self.dirty = True
+            # 队列已取空时才缩放并交给界面，积压的增量画面只合成不缩放
+            if self.dirty and screen_queue.empty():
+                self.publish(capture_time)
+        except UnidentifiedImageError:
+            self.messages.put("无法识别图像数据，跳过此帧")
+        except Exception as e:
+            self.messages.put(f"处理图像数据失败: {str(e)}")
+        decode_seconds = time.perf_counter() - decode_start
+        self.decode_time += decode_seconds
+        self.decode_count += 1
+        
+        # 各阶段耗时：被控端的捕获、编码、发送排队来自画面头，网络耗时需要换算到同一时钟
+        capture_ms = capture_us / 1000
+        encode_ms = encode_us / 1000
+        self.record_stage("捕获", capture_ms)
+        self.record_stage("编码", encode_ms)
+        self.record_stage("发送排队", max(0.0, (send_time - capture_time) * 1000 - capture_ms - encode_ms))
+        if self.clock_offset is not None:
+            self.record_stage("网络", max(0.0, (received + self.clock_offset - send_time) * 1000))
+        self.record_stage("接收排队", waited * 1000)
+        self.record_stage("解码", decode_seconds * 1000)
+        self.send_feedback()
+
+    def decode_keyframe(self, data):
+        """完整画面（JPEG 或调色板 PNG）：替换当前画面（load 后不再引用接收缓冲区）"""
+        img = Image.open(MemoryViewReader(data))
+        if not self.delta_mode:
+            # 增量画面块按原始坐标合成，只有非增量模式才能降低解码尺寸（只对 JPEG 有效）
+            img.draft('RGB', self.display_size)
+        img.load()
+        self.frame = img.convert('RGB') if img.mode != 'RGB' else img
+        self.waiting_keyframe = False
+
+    def decode_video(self, data):
+        """解码一帧 H.264 码流，返回是否得到新画面（颜色转换和缩放留到显示前）"""
+        if self.waiting_keyframe or self.video_decoder is None:
+            if not h264_is_keyframe(data):
+                return False
+            self.waiting_keyframe = False
+        if self.video_decoder is None:
+            self.video_decoder = av.CodecContext.create("h264", "r")
+        try:
+            frames = self.video_decoder.decode(av.Packet(bytes(data)))
+        except av.error.FFmpegError as e:
+            self.messages.put(f"视频解码失败，请求完整画面: {str(e)}")
+            self.request_keyframe()
+            return False
+        if not frames:
+            return False
+        self.video_frame = frames[-1]
+        return True
+
+    def apply_tiles(self, data):
+        """把增量画面中的变化块合成到当前画面上，返回画面是否有更新"""
+        if self.frame is None or self.waiting_keyframe:
+            return False
+        width, height, count = TILES_HEADER.unpack_from(data, 0)
+        if (width, height) != self.frame.size:
+            # 分辨率已变化，旧画面不能作为基准
+            self.request_keyframe()
+            return False
+        return paste_tiles(self.frame, data) > 0
+
+    def fit_display_size(self, width, height):
+        """画面按原宽高比缩放到显示区域内的尺寸（区域传输的画面宽高比与显示区域不同）"""
+        display_width, display_height = self.display_size
+        scale = min(display_width / width, display_height / height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def publish(self, capture_time):
+        """把当前画面缩放到显示尺寸，替换等待显示的帧"""
+        if self.video_frame is not None:
+            # 视频帧在转换为 RGB 的同时缩放到显示尺寸
+            width, height = self.fit_display_size(self.video_frame.width, self.video_frame.height)
+            self.frame = self.video_frame.to_image(width=width, height=height)
+            self.video_frame = None
+        frame = self.frame
+        size = self.fit_display_size(*frame.size)
+        if frame.size != size:
+            # 按设定分辨率和窗口缩放比例显示（被控端自适应降低分辨率时在此放大）
+            frame = frame.resize(size, DISPLAY_RESAMPLE, reducing_gap=2.0)
+        elif self.delta_mode:
+            frame = frame.copy()  # 增量模式会继续修改当前画面，交给界面的必须是副本
+        with self.latest_lock:
+            self.latest = (frame, capture_time, time.time())
+        self.dirty = False
+
+    def record_stage(self, stage, value):
+        """记录一个阶段的耗时（毫秒），指数平滑后用于显示"""
+        previous = self.stage_ms.get(stage)
+        self.stage_ms[stage] = value if previous is None else previous + (value - previous) * STATS_SMOOTHING
+
+    def record_display(self, capture_time, published):
+        """界面显示一帧后调用，记录显示耗时和捕获到显示的端到端延迟"""
+        now = time.time()
+        self.record_stage("显示", (now - published) * 1000)
+        self.display_times.append(time.monotonic())
+        if self.clock_offset is not None:
+            latency = (now + self.clock_offset - capture_time) * 1000
+            previous = self.latency_ms
+            self.latency_ms = latency if previous is None else previous + (latency - previous) * STATS_SMOOTHING
+
+    def display_fps(self):
+        """最近一段时间内实际显示的帧率（画面静止时被控端不发送新画面，帧率随之降低）"""
+        now = time.monotonic()
+        while self.display_times and now - self.display_times[0] > DISPLAY_FPS_WINDOW:
+            self.display_times.popleft()
+        return len(self.display_times) / DISPLAY_FPS_WINDOW
+
+    def stats_text(self, target_fps):
+        """监控窗口中显示的延迟和帧率统计"""
+        if self.latency_ms is None:
+            lines = ["端到端延迟: 时钟校准中"]
+        else:
+            lines = [f"端到端延迟: {self.latency_ms:.0f}ms (±{self.clock_error * 1000:.0f}ms)"]
+        for stage in ("捕获", "编码", "发送排队", "网络", "接收排队", "解码", "显示"):
+            if stage in self.stage_ms:
+                lines.append(f"{stage}: {self.stage_ms[stage]:.1f}ms")
+        lines.append(f"丢帧: {self.lost_frames}  跳过: {self.skipped_frames}")
+        lines.append(f"显示帧率: {self.display_fps():.1f} / {target_fps} FPS")
+        return "\n".join(lines)
+
+    def sync_clock(self):
+        """发送一次时间校准请求，回复由读线程通过回调处理，不阻塞解码"""
+        self.last_clock_sync = time.monotonic()
+        sent = time.time()
+        try:
+            future = self.connection.request(CHANNEL_CONTROL, MSG_CONTROL, "__TIME_SYNC__")
+        except Exception as e:
+            self.messages.put(f"时钟校准失败: {str(e)}")
+            return
+        future.add_done_callback(lambda future: self.on_clock_reply(future, sent))
+
+    def on_clock_reply(self, future, sent):
+        """按 NTP 的方式估计时钟偏差：假设往返路径对称，误差不超过往返时间的一半"""
+        received = time.time()
+        if future.exception() is not None:
+            return
+        try:
+            remote_time = float(future.result()[1].decode('utf-8'))
+        except ValueError:
+            return
+        round_trip = received - sent
+        self.clock_samples.append((round_trip, remote_time - (sent + received) / 2))
+        round_trip, offset = min(self.clock_samples)
+        self.clock_error = round_trip / 2
+        self.clock_offset = offset
+
+    def request_keyframe(self):
+        """丢弃增量画面直到收到完整画面，并请求被控端立即发送完整画面"""
+        self.waiting_keyframe = True
+        try:
+            # 无需回复，请求ID为0
+            self.connection.send(CHANNEL_CONTROL, MSG_CONTROL, "__REQUEST_KEYFRAME__")
+        except Exception as e:
+            self.messages.put(f"请求完整画面失败: {str(e)}")
+
+    def send_feedback(self):
+        """定期向被控端回报丢帧数和平均每帧处理耗时，供其调整画面质量、分辨率和帧率"""
+        now = time.monotonic()
+        if now - self.last_feedback_time < FEEDBACK_INTERVAL:
+            return
+        # 读线程丢弃的帧和解码时跳过的帧都说明主控端跟不上
+        dropped = self.connection.screen_dropped - self.feedback_dropped + self.skipped
+        decode_ms = self.decode_time / self.decode_count * 1000 if self.decode_count else 0
+        self.feedback_dropped = self.connection.screen_dropped
+        self.skipped = 0
+        self.decode_time = 0.0
+        self.decode_count = 0
+        self.last_feedback_time = now
+        try:
+            # 无需回复，请求ID为0
+            self.connection.send(CHANNEL_CONTROL, MSG_CONTROL,
+                                 f"__STREAM_FEEDBACK__{MESSAGE_SEPARATOR}{dropped}{MESSAGE_SEPARATOR}{decode_ms:.1f}")
+        except Exception as e:
+            self.messages.put(f"发送画面回报失败: {str(e)}")
+
+
+class ScreenRecorder:
+    """把收到的已编码画面原样写入分段文件，同时为每帧写一条索引记录（时间 → 分段和偏移）
+
+    读线程只复制画面数据放入队列，写盘在单独的线程中进行，不解码也不重新编码，
+    不增加实时画面的处理开销。录像从第一个完整画面开始；画面序号不连续或写盘跟不上
+    而丢弃画面后，丢弃之后的增量画面和视频帧直到下一个完整画面，保证录像中每帧都能解码。
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.queue = queue.Queue(maxsize=RECORD_QUEUE_SIZE)
+        self.waiting_keyframe = True
+        self.last_seq = None
+        self.frames = 0  # 已写入的画面数
+        self.bytes = 0
+        self.dropped = 0  # 未能录制的画面数
+        self.error = None  # 写盘失败的原因
+        self.closing = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, msg_type, payload, received):
+        """读线程收到画面时调用：复制数据放入写盘队列（接收缓冲区会被复用）"""
+        codec = payload[1]
+        seq = FRAME_HEADER.unpack_from(payload, 0)[2]
+        if self.last_seq is not None and seq != self.last_seq + 1:
+            self.waiting_keyframe = True
+        self.last_seq = seq  # 心跳也占用序号，先记录再跳过，否则下一帧会被误判为缺帧
+        if codec == CODEC_NONE:
+            return  # 心跳没有画面数据，回放时保持上一帧即可
+        keyframe = frame_is_keyframe(msg_type, payload)
+        if self.waiting_keyframe and not keyframe:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait((received, msg_type, codec, keyframe, bytes(payload)))
+            self.waiting_keyframe = False
+        except queue.Full:
+            self.dropped += 1
+            self.waiting_keyframe = True
+
+    def run(self):
+        segment = None
+        segment_number = -1
+        offset = 0
+        try:
+            with open(os.path.join(self.directory, RECORD_INDEX_FILE), "wb") as index:
+                while True:
+                    try:
+                        received, msg_type, codec, keyframe, data = self.queue.get(timeout=0.5)
+                    except queue.Empty:
+                        if self.closing:
+                            break
+                        continue
+                    if segment is None or offset + len(data) > RECORD_SEGMENT_SIZE:
+                        if segment is not None:
+                            segment.close()
+                        segment_number += 1
+                        segment = open(os.path.join(self.directory, RECORD_SEGMENT_FILE.format(segment_number)), "wb")
+                        offset = 0
+                    segment.write(data)
+                    index.write(RECORD_INDEX.pack(received, segment_number, offset, len(data), msg_type, codec, keyframe))
+                    offset += len(data)
+                    self.frames += 1
+                    self.bytes += len(data)
+                    if self.queue.empty():
+                        # 积压写完后再刷新，回放正在录制的录像时能读到最近的画面；先写数据再写索引
+                        segment.flush()
+                        index.flush()
+        except OSError as e:
+            self.error = str(e)
+        finally:
+            if segment is not None:
+                segment.close()
+
+    def close(self):
+        """写完队列中剩余的画面后关闭文件（调用前先让读线程停止交入新画面）"""
+        self.closing = True
+        self.thread.join()
+
+
+class RecordingPlayer:
+    """录像回放：用内存映射读取索引和分段文件，按时间二分查找到目标帧
+
+    定位时从目标帧之前最近的完整画面开始解码：完整画面录像直接解码目标帧；增量画面和视频帧
+    最多解码一个完整画面间隔（被控端定期发送完整画面）。顺序播放时从上一次解码的位置继续。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = {}  # 分段编号 -> mmap，按需打开
+        with open(os.path.join(directory, RECORD_INDEX_FILE), "rb") as f:
+            count = os.fstat(f.fileno()).st_size // RECORD_INDEX.size
+            if count == 0:
+                raise ValueError("录像中没有画面")
+            self.index = mmap.mmap(f.fileno(), count * RECORD_INDEX.size, access=mmap.ACCESS_READ)
+        # 正在录制或异常中断的录像，索引末尾可能指向尚未写入的数据
+        sizes = {}
+        while count > 0:
+            segment, offset, length = self.entry_at(count - 1)[1:4]
+            if segment not in sizes:
+                path = os.path.join(directory, RECORD_SEGMENT_FILE.format(segment))
+                sizes[segment] = os.path.getsize(path) if os.path.exists(path) else 0
+            if offset + length <= sizes[segment]:
+                break
+            count -= 1
+        if count == 0:
+            raise ValueError("录像数据不完整")
+        self.count = count
+        self.start_time = self.entry_at(0)[0]
+        self.duration = self.entry_at(count - 1)[0] - self.start_time
+        self.frame = None
+        self.video_decoder = None
+        self.position = None  # 当前画面对应的帧序号
+
+    def entry_at(self, number):
+        """第 number 帧的索引记录"""
+        return RECORD_INDEX.unpack_from(self.index, number * RECORD_INDEX.size)
+
+    def time_at(self, number):
+        """第 number 帧相对录像开始的时间（秒）"""
+        return self.entry_at(number)[0] - self.start_time
+
+    def find(self, seconds):
+        """录像开始后 seconds 秒时正在显示的帧序号"""
+        low, high = 0, self.count - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.time_at(middle) <= seconds:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def segment(self, number):
+        mapped = self.segments.get(number)
+        if mapped is None:
+            with open(os.path.join(self.directory, RECORD_SEGMENT_FILE.format(number)), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.segments[number] = mapped
+        return mapped
+
+    def frame_at(self, number):
+        """解码到第 number 帧，返回该帧画面（PIL Image，之后的解码会修改它）"""
+        start = number
+        while start > 0 and not self.entry_at(start)[6]:
+            start -= 1
+        if self.position is not None and start <= self.position <= number:
+            start = self.position + 1  # 与上一次解码位于同一段，继续向后解码
+        else:
+            self.video_decoder = None
+        for current in range(start, number + 1):
+            self.decode(current)
+        self.position = number
+        return self.frame
+
+    def decode(self, number):
+        received, segment, offset, length, msg_type, codec, keyframe = self.entry_at(number)
+        data = memoryview(self.segment(segment))[offset + FRAME_HEADER.size:offset + length]
+        if codec == CODEC_H264:
+            if av is None:
+                raise ValueError("回放 H.264 录像需要安装 PyAV")
+            if self.video_decoder is None:
+                self.video_decoder = av.CodecContext.create("h264", "r")
+            frames = self.video_decoder.decode(av.Packet(bytes(data)))
+            if frames:
+                self.frame = frames[-1].to_image()
+        elif msg_type == MSG_TILES:
+            if self.frame is not None and self.frame.size == tuple(TILES_HEADER.unpack_from(data, 0)[:2]):
+                paste_tiles(self.frame, data)
+        else:
+            img = Image.open(MemoryViewReader(data))
+            img.load()
+            self.frame = img.convert('RGB') if img.mode != 'RGB' else img
+
+    def close(self):
+        for mapped in [self.index, *self.segments.values()]:
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # 仍有画面引用映射内存，由垃圾回收释放
+        self.segments = {}
+
+
+class WallSession:
+    """监控墙中一台设备的独立连接和画面状态"""
+
+    def __init__(self, device):
+        self.device = device
+        self.connection = None  # 监控墙专用连接，与主界面的连接互不影响
+        self.status = "连接中..."
+        self.decoding = False  # 共享解码线程池中是否有这台设备的任务
+        self.latest = None  # 已解码、等待显示的缩略图
+        self.promoted = False  # 已提升为全分辨率画面
+        self.visible = True  # 已通知被控端的画面可见状态
+        self.photo = None
+        self.image_label = None
+        self.status_label = None
+
 
 class RemoteController:
     def __init__(self, root):
@@ -68,11 +1004,13 @@ class RemoteController:
         self.root.geometry("1100x700")
         self.root.resizable(True, True)
         
-        self.client_socket = None
+        self.connection = None  # 当前连接（AgentConnection）
+        self.completed_requests = queue.Queue()  # 已完成的请求，由UI线程显示结果
+        self.background_results = queue.Queue()  # 后台线程产生的提示，由UI线程显示
         self.connected = False
         self.target_ip = tk.StringVar(value="127.0.0.1")
         self.target_port = tk.StringVar(value="9999")
-        self.MESSAGE_SEPARATOR = "|||__SEP__|||"
+        self.MESSAGE_SEPARATOR = MESSAGE_SEPARATOR
         
         # 多设备管理相关变量
         self.devices = []  # 存储设备信息的列表
@@ -84,12 +1022,32 @@ class RemoteController:
         # 屏幕监控相关变量
         self.monitoring = False
         self.monitor_window = None
-        self.image_queue = queue.Queue(maxsize=5)  # 限制队列大小为5，防止内存溢出
         self.screen_width, self.screen_height = RESOLUTION_PRESETS[DEFAULT_RESOLUTION_INDEX]
         self.fps = DEFAULT_FPS
         self.quality = DEFAULT_QUALITY
         self.delay = DEFAULT_DELAY
         self.window_scale = 1.0  # 窗口缩放比例
+        self.delta_mode = False  # 增量传输：被控端只发送变化的画面块
+        self.video_codec = False  # H.264 视频编码，需要两端都安装 PyAV
+        self.screen_decoder = None  # 画面解码线程（ScreenDecoder）
+        self.monitor_photo = None  # 监控窗口中复用的 PhotoImage
+        self.capture_size = None  # 向被控端请求的画面尺寸，随窗口大小调整
+        self.resize_job = None  # 窗口调整大小的防抖定时器
+        self.stream_visible = True  # 已通知被控端的监控画面可见状态
+        self.stream_region = None  # 只传输的屏幕区域 (x, y, 宽, 高)，占整个屏幕的比例；None 为整个屏幕
+        self.region_selecting = False  # 正在监控画面上框选区域
+        self.region_drag = None  # 框选中的矩形（监控画面上的像素坐标）
+        self.monitor_frame = None  # 最近显示的一帧，框选时在其上绘制选框
+        self.stream_display = 0  # 监控的显示器编号，0 为主显示器
+        self.agent_displays = []  # 被控端各显示器的 (左, 上, 宽, 高)
+        self.display_viewers = []  # 在单独窗口中查看其他显示器的画面（各自使用独立连接）
+        self.obscured_windows = set()  # 被其他窗口完全遮挡的窗口（只有部分平台产生遮挡事件）
+        self.recorder = None  # 正在录制监控画面（ScreenRecorder）
+        
+        # 监控墙相关变量
+        self.wall_window = None
+        self.wall_sessions = []  # 监控墙中每台设备的会话（WallSession）
+        self.wall_decode_pool = None
         
         # 加载保存的设备
         self.load_devices()
@@ -177,6 +1135,8 @@ class RemoteController:
         tk.Button(conn_row2, text="全量扫描", command=self.full_scan).pack(side=tk.LEFT, padx=5, pady=2)
         
         tk.Button(conn_row2, text="开始监控", command=self.start_screen_monitor).pack(side=tk.LEFT, padx=5, pady=2)
+        tk.Button(conn_row2, text="监控墙", command=self.open_monitor_wall).pack(side=tk.LEFT, padx=5, pady=2)
+        tk.Button(conn_row2, text="回放录像", command=self.open_recording).pack(side=tk.LEFT, padx=5, pady=2)
         tk.Button(conn_row2, text="关于", command=self.show_about_window).pack(side=tk.LEFT, padx=5, pady=2)
         
         # 命令输入区域
@@ -724,7 +1684,7 @@ class RemoteController:
     # 屏幕监控窗口
     def start_screen_monitor(self):
         """打开屏幕监控窗口"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.connection:
             messagebox.showwarning("警告", "请先建立连接")
             return
             
@@ -744,6 +1704,7 @@ class RemoteController:
         
         # 绑定窗口大小变化事件
         self.monitor_window.bind("<Configure>", self.on_window_resize)
+        self.monitor_window.bind("<Visibility>", self.on_window_visibility)
         
         # 参数设置区域
         params_frame = tk.LabelFrame(self.monitor_window, text="监控参数")
@@ -783,6 +1744,17 @@ class RemoteController:
                              variable=self.delay_var, length=150)
         self.delay_scale.pack(fill=tk.X, padx=5, pady=2)
         
+        # 增量传输设置
+        self.delta_var = tk.BooleanVar(value=self.delta_mode)
+        tk.Checkbutton(params_frame, text="增量传输(仅发送变化区域)", 
+                       variable=self.delta_var).pack(anchor=tk.W, padx=5, pady=2)
+        
+        # 视频编码设置（本机没有 PyAV 时不可选）
+        self.video_codec_var = tk.BooleanVar(value=self.video_codec and av is not None)
+        tk.Checkbutton(params_frame, text="H.264视频编码" if av is not None else "H.264视频编码(需要PyAV)",
+                       variable=self.video_codec_var,
+                       state=tk.NORMAL if av is not None else tk.DISABLED).pack(anchor=tk.W, padx=5, pady=2)
+        
         # 应用按钮
         def apply_settings():
             try:
@@ -809,30 +1781,64 @@ class RemoteController:
                 self.fps = fps
                 self.quality = quality
                 self.delay = delay
+                self.delta_mode = self.delta_var.get()
+                self.video_codec = self.video_codec_var.get()
                 
                 # 重置窗口缩放比例
                 self.window_scale = 1.0
                 
-                # 如果正在监控，重新启动以应用新参数
+                # 如果正在监控，在当前连接上更新参数，不关闭窗口也不中断画面
                 if self.monitoring:
-                    self.stop_screen_monitor(restart=True)
+                    self.screen_decoder.delta_mode = self.delta_mode
+                    self.screen_decoder.display_size = self.get_display_size()
+                    self.capture_size = self.get_capture_size()
+                    self.monitor_window.geometry(f"{width + 200}x{height + 100}")
+                    self.window_size_label.config(text=f"窗口大小: {width}x{height}")
+                    self.send_update_monitor_command()
                 
             except ValueError as e:
                 messagebox.showerror("错误", f"参数无效: {str(e)}")
         
         tk.Button(params_frame, text="应用设置", command=apply_settings).pack(pady=10)
+        
+        # 传输区域：框选或选择窗口后只传输该区域，区域不大时按原始像素显示，可看清小字
+        region_frame = tk.Frame(params_frame)
+        region_frame.pack(fill=tk.X, padx=5, pady=2)
+        tk.Button(region_frame, text="框选区域", command=self.begin_region_select).pack(side=tk.LEFT, padx=2)
+        tk.Button(region_frame, text="选择窗口", command=self.request_window_list).pack(side=tk.LEFT, padx=2)
+        tk.Button(region_frame, text="整个屏幕", command=lambda: self.set_stream_region(None)).pack(side=tk.LEFT, padx=2)
+        
+        # 显示器选择：被控端有多个显示器时只传输所选的一个，也可在新窗口中同时查看另一个
+        tk.Label(params_frame, text="显示器:").pack(anchor=tk.W, padx=5, pady=2)
+        self.display_var = tk.StringVar(value=self.describe_display(0))
+        self.display_menu = tk.OptionMenu(params_frame, self.display_var, self.describe_display(0))
+        self.display_menu.pack(fill=tk.X, padx=5, pady=2)
+        tk.Button(params_frame, text="在新窗口中查看所选显示器",
+                  command=self.open_display_viewer).pack(fill=tk.X, padx=5, pady=2)
+        # 录制：收到的已编码画面原样写入磁盘，不重新编码
+        self.record_btn = tk.Button(params_frame, text="开始录制", command=self.toggle_recording)
+        self.record_btn.pack(fill=tk.X, padx=5, pady=2)
         tk.Button(params_frame, text="停止监控", command=self.stop_screen_monitor).pack(pady=5)
         
         # 当前窗口大小显示
         self.window_size_label = tk.Label(params_frame, text=f"窗口大小: {self.screen_width}x{self.screen_height}")
         self.window_size_label.pack(pady=10)
         
+        # 延迟和各阶段耗时统计
+        self.stream_stats_label = tk.Label(params_frame, text="", justify=tk.LEFT, anchor=tk.W)
+        self.stream_stats_label.pack(fill=tk.X, padx=5, pady=5)
+        self.last_stats_refresh = 0
+        self.display_deadline = None  # 下一次刷新监控画面的截止时间（单调时钟）
+        
         # 监控画面区域
         monitor_frame = tk.Frame(self.monitor_window)
         monitor_frame.pack(side=tk.LEFT, padx=10, pady=10, fill=tk.BOTH, expand=True)
         
         self.monitor_label = tk.Label(monitor_frame)
         self.monitor_label.pack(fill=tk.BOTH, expand=True)
+        self.monitor_label.bind("<ButtonPress-1>", self.on_region_press)
+        self.monitor_label.bind("<B1-Motion>", self.on_region_drag)
+        self.monitor_label.bind("<ButtonRelease-1>", self.on_region_release)
         
         # 创建初始空白图像
         self.blank_image = Image.new('RGB', (self.screen_width, self.screen_height), color='black')
@@ -840,13 +1846,22 @@ class RemoteController:
         self.monitor_label.config(image=self.blank_photo)
         self.monitor_label.image = self.blank_photo  # 保持引用
         
+        # 丢弃上次监控残留的画面，图像数据由连接的读线程放入画面通道
+        self.connection.discard_frames()
+        self.monitor_photo = None
+        self.screen_decoder = ScreenDecoder(self.connection, self.delta_mode, self.get_display_size())
+        
         # 启动监控
         self.monitoring = True
+        self.stream_visible = True
+        self.stream_region = None
+        self.region_selecting = False
+        self.region_drag = None
+        self.monitor_frame = None
+        self.stream_display = 0
+        self.agent_displays = []
         self.send_start_monitor_command()
-        
-        # 启动画面更新线程
-        self.receive_thread = threading.Thread(target=self.receive_screen_data, daemon=True)
-        self.receive_thread.start()
+        self.request_screen_info()
         self.update_monitor_display()
     
     def on_window_resize(self, event):
@@ -869,196 +1884,817 @@ class RemoteController:
             scaled_width = int(self.screen_width * self.window_scale)
             scaled_height = int(self.screen_height * self.window_scale)
             self.window_size_label.config(text=f"窗口大小: {scaled_width}x{scaled_height}")
+            if self.screen_decoder:
+                self.screen_decoder.display_size = self.get_display_size()
+            
+            # 拖动过程中会连续触发，停止调整后再请求与显示区域匹配的画面尺寸
+            if self.resize_job:
+                self.monitor_window.after_cancel(self.resize_job)
+            self.resize_job = self.monitor_window.after(RESIZE_DEBOUNCE_MS, self.request_viewport_size)
+    
+    def request_viewport_size(self):
+        """请求被控端按显示区域大小发送画面，避免传输随后被缩小丢弃的像素"""
+        self.resize_job = None
+        if not self.monitoring or not self.connection:
+            return
+        width, height = self.get_capture_size()
+        if self.capture_size:
+            current_width, current_height = self.capture_size
+            if (abs(width - current_width) <= current_width * VIEWPORT_TOLERANCE
+                    and abs(height - current_height) <= current_height * VIEWPORT_TOLERANCE):
+                return  # 差别不大，本地缩放即可
+        self.capture_size = (width, height)
+        self.send_update_monitor_command()
+    
+    def get_capture_size(self):
+        """向被控端请求的画面尺寸：与显示区域一致，但不超过设定的分辨率"""
+        scale = min(1.0, self.window_scale)
+        return (max(2, int(self.screen_width * scale) // 2 * 2),
+                max(2, int(self.screen_height * scale) // 2 * 2))
+    
+    def get_display_size(self):
+        """按设定分辨率和窗口缩放比例计算画面显示尺寸"""
+        return (max(1, int(self.screen_width * self.window_scale)),
+                max(1, int(self.screen_height * self.window_scale)))
+    
+    def build_monitor_command(self, name):
+        """生成带监控参数的控制命令（开始监控和更新参数格式相同）"""
+        width, height = self.capture_size
+        codec = "h264" if self.video_codec and av is not None else "jpeg"
+        region = ",".join(f"{value:.5f}" for value in self.stream_region) if self.stream_region else "full"
+        # 最后一个参数表示尺寸按显示区域计算，被控端不再按宽高比重置
+        params = [name, width, height, self.fps, self.quality, self.delay, int(self.delta_mode), codec, region,
+                  self.stream_display, 1]
+        return self.MESSAGE_SEPARATOR.join(str(param) for param in params)
+    
+    def describe_stream_mode(self):
+        """结果区中显示的画面传输方式"""
+        text = f", 显示器{self.stream_display + 1}" if self.stream_display else ""
+        text += ", 区域传输" if self.stream_region else ""
+        if self.video_codec and av is not None:
+            return text + ", H.264视频编码"
+        return text + (", 增量传输" if self.delta_mode else "")
+    
+    def send_update_monitor_command(self):
+        """监控过程中更新参数，被控端在下一帧生效"""
+        try:
+            command = self.build_monitor_command("__UPDATE_MONITOR__")
+            future = self.connection.request(CHANNEL_CONTROL, MSG_CONTROL, command)
+            self.track_request(future, "更新监控参数")
+            width, height = self.capture_size
+            self.append_result(f"已发送监控参数更新: {width}x{height}, {self.fps}FPS, 质量{self.quality}, 延迟{self.delay}s"
+                               + self.describe_stream_mode())
+        except Exception as e:
+            self.append_result(f"发送监控参数更新失败: {str(e)}")
     
     def send_start_monitor_command(self):
         """发送开始监控命令"""
         try:
-            command = f"__START_MONITOR__{self.MESSAGE_SEPARATOR}{self.screen_width}{self.MESSAGE_SEPARATOR}{self.screen_height}{self.MESSAGE_SEPARATOR}{self.fps}{self.MESSAGE_SEPARATOR}{self.quality}{self.MESSAGE_SEPARATOR}{self.delay}"
-            self.client_socket.sendall(command.encode('utf-8'))
-            self.append_result(f"已发送开始监控命令，参数: {self.screen_width}x{self.screen_height}, {self.fps}FPS, 质量{self.quality}, 延迟{self.delay}s")
+            self.capture_size = self.get_capture_size()
+            command = self.build_monitor_command("__START_MONITOR__")
+            future = self.connection.request(CHANNEL_CONTROL, MSG_CONTROL, command)
+            self.track_request(future, "开始监控")
+            self.append_result(f"已发送开始监控命令，参数: {self.screen_width}x{self.screen_height}, {self.fps}FPS, 质量{self.quality}, 延迟{self.delay}s"
+                               + self.describe_stream_mode())
         except Exception as e:
             self.append_result(f"发送监控命令失败: {str(e)}")
             self.stop_screen_monitor()
     
-    def receive_screen_data(self):
-        """接收屏幕数据"""
-        while self.monitoring and self.connected and self.client_socket:
-            try:
-                # 设置非阻塞模式
-                self.client_socket.setblocking(False)
-                
-                # 尝试接收魔术数字以识别是否为图像数据
-                magic = b""
-                while len(magic) < len(IMAGE_MAGIC_NUMBER):
-                    try:
-                        chunk = self.client_socket.recv(len(IMAGE_MAGIC_NUMBER) - len(magic))
-                        if not chunk:
-                            break
-                        magic += chunk
-                    except socket.error as e:
-                        # 处理非阻塞错误
-                        if e.errno == 10035:  # WSAEWOULDBLOCK
-                            time.sleep(0.01)  # 短暂等待后重试
-                            continue
-                        else:
-                            raise
-                
-                if not magic:
-                    continue
-                    
-                # 检查是否为图像数据
-                if magic == IMAGE_MAGIC_NUMBER:
-                    # 接收数据长度（4字节）
-                    length_data = b""
-                    while len(length_data) < 4:
-                        try:
-                            chunk = self.client_socket.recv(4 - len(length_data))
-                            if not chunk:
-                                break
-                            length_data += chunk
-                        except socket.error as e:
-                            if e.errno == 10035:  # WSAEWOULDBLOCK
-                                time.sleep(0.01)
-                                continue
-                            else:
-                                raise
-                    
-                    if not length_data or len(length_data) != 4:
-                        self.append_result("接收图像长度失败")
-                        continue
-                        
-                    data_length = int.from_bytes(length_data, byteorder='big')
-                    
-                    # 验证数据长度是否合理
-                    if data_length <= 0 or data_length > MAX_IMAGE_SIZE:
-                        self.append_result(f"无效的图像数据长度: {data_length}，跳过此帧")
-                        # 尝试跳过无效数据
-                        remaining = data_length
-                        while remaining > 0:
-                            try:
-                                skip = self.client_socket.recv(min(4096, remaining))
-                                if not skip:
-                                    break
-                                remaining -= len(skip)
-                            except socket.error as e:
-                                if e.errno == 10035:
-                                    time.sleep(0.01)
-                                    continue
-                                else:
-                                    break
-                        continue
-                    
-                    # 接收图像数据
-                    img_data = b''
-                    while len(img_data) < data_length:
-                        try:
-                            chunk_size = min(4096, data_length - len(img_data))
-                            chunk = self.client_socket.recv(chunk_size)
-                            if not chunk:
-                                break
-                            img_data += chunk
-                        except socket.error as e:
-                            if e.errno == 10035:  # WSAEWOULDBLOCK
-                                time.sleep(0.01)
-                                continue
-                            else:
-                                raise
-                    
-                    if len(img_data) == data_length:
-                        # 清空队列中旧的图像数据，只保留最新的
-                        while self.image_queue.full():
-                            self.image_queue.get()
-                        self.image_queue.put(img_data)
-                    else:
-                        self.append_result(f"图像数据接收不完整，预期 {data_length} 字节，实际 {len(img_data)} 字节，跳过此帧")
-                
-                else:
-                    # 不是图像数据，尝试解析为文本响应
-                    try:
-                        # 把魔术数字部分也包含进去一起解码
-                        text_data = magic
-                        while True:
-                            try:
-                                chunk = self.client_socket.recv(4096)
-                                if not chunk:
-                                    break
-                                text_data += chunk
-                            except socket.error as e:
-                                if e.errno == 10035:  # WSAEWOULDBLOCK
-                                    break
-                                else:
-                                    raise
-                        
-                        text = text_data.decode('utf-8', errors='ignore')
-                        if text:
-                            self.append_result(f"收到: {text}")
-                    except Exception as e:
-                        self.append_result(f"解析文本数据失败: {str(e)}")
-                
-            except Exception as e:
-                if self.monitoring:  # 只有在监控状态下才显示错误
-                    if "10035" in str(e):
-                        # 处理非阻塞错误，不中断线程
-                        time.sleep(0.1)
-                        continue
-                    self.append_result(f"接收屏幕数据错误: {str(e)}")
-                break
-            finally:
-                # 恢复为阻塞模式
-                try:
-                    self.client_socket.setblocking(True)
-                except:
-                    pass
-    
     def update_monitor_display(self):
-        """更新监控画面显示（支持窗口缩放）"""
-        if not self.monitoring or not self.monitor_window:
+        """更新监控画面显示
+
+        解码、合成和缩放都在解码线程中完成，这里只把最新一帧粘贴到复用的 PhotoImage，
+        界面线程的开销与画面分辨率和帧率无关。
+        """
+        if not self.monitoring or not self.monitor_window or not self.connection:
             return
             
         try:
-            while not self.image_queue.empty():
-                img_data = self.image_queue.get()
-                try:
-                    # 尝试打开图像
-                    img = Image.open(io.BytesIO(img_data))
-                    
-                    # 根据窗口缩放比例调整图像大小
-                    if self.window_scale != 1.0:
-                        new_width = int(img.width * self.window_scale)
-                        new_height = int(img.height * self.window_scale)
-                        img = img.resize((new_width, new_height), Image.LANCZOS)
-                    
-                    photo = ImageTk.PhotoImage(image=img)
+            decoder = self.screen_decoder
+            while not decoder.messages.empty():
+                self.append_result(decoder.messages.get_nowait())
+            
+            latest = decoder.take_frame()
+            if latest is not None:
+                frame, capture_time, published = latest
+                self.monitor_frame = frame
+                if self.region_drag:
+                    frame = self.draw_region_drag(frame)
+                photo = self.monitor_photo
+                if photo is None or (photo.width(), photo.height()) != frame.size:
+                    # 首帧或显示尺寸改变时才新建 PhotoImage
+                    photo = ImageTk.PhotoImage(image=frame)
+                    self.monitor_photo = photo
                     self.monitor_label.config(image=photo)
                     self.monitor_label.image = photo  # 保持引用
-                except UnidentifiedImageError:
-                    self.append_result("无法识别图像数据，跳过此帧")
-                except Exception as e:
-                    self.append_result(f"处理图像数据失败: {str(e)}")
+                else:
+                    photo.paste(frame)
+                decoder.record_display(capture_time, published)
+            
+            # 窗口最小化或被遮挡时通知被控端暂停编码
+            self.stream_visible = self.report_stream_visibility(
+                self.connection, self.is_viewport_visible(self.monitor_window, self.monitor_label), self.stream_visible)
+            
+            # 定期刷新延迟统计
+            now = time.monotonic()
+            if now - self.last_stats_refresh >= STATS_REFRESH_MS / 1000:
+                self.last_stats_refresh = now
+                self.stream_stats_label.config(text=decoder.stats_text(self.fps))
         except Exception as e:
             self.append_result(f"更新监控画面错误: {str(e)}")
         
         if self.monitoring and self.monitor_window:
-            # 计算下一帧的更新时间
-            self.monitor_window.after(int(1000/self.fps), self.update_monitor_display)
+            self.display_deadline = self.schedule_refresh(
+                self.monitor_window, self.display_deadline, self.update_monitor_display)
+    
+    def schedule_refresh(self, window, deadline, callback):
+        """按单调时钟的绝对截止时间安排下一次画面刷新，返回新的截止时间
+
+        截止时间在上一次的基础上加一个帧间隔，刷新本身的耗时不会累积成帧率下降；
+        落后超过一帧时不连续补刷，从现在重新计时。
+        """
+        now = time.monotonic()
+        deadline = (deadline or now) + 1 / self.fps
+        if deadline < now:
+            deadline = now
+        window.after(max(1, round((deadline - now) * 1000)), callback)
+        return deadline
+    
+    def begin_region_select(self):
+        """开始在监控画面上拖动框选要传输的区域"""
+        self.region_selecting = True
+        self.monitor_label.config(cursor="crosshair")
+        self.append_result("请在监控画面上拖动框选区域")
+    
+    def displayed_image_offset(self):
+        """监控画面在显示控件中的左上角位置（画面居中显示）"""
+        photo = self.monitor_photo
+        return ((self.monitor_label.winfo_width() - photo.width()) // 2,
+                (self.monitor_label.winfo_height() - photo.height()) // 2)
+    
+    def on_region_press(self, event):
+        if not self.region_selecting or self.monitor_photo is None:
+            return
+        x, y = self.displayed_image_offset()
+        self.region_drag = [event.x - x, event.y - y, event.x - x, event.y - y]
+    
+    def on_region_drag(self, event):
+        if not self.region_drag:
+            return
+        x, y = self.displayed_image_offset()
+        self.region_drag[2:] = [event.x - x, event.y - y]
+        # 画面静止时没有新帧，在最近一帧上重绘选框
+        if self.monitor_frame is not None and self.monitor_frame.size == (self.monitor_photo.width(),
+                                                                          self.monitor_photo.height()):
+            self.monitor_photo.paste(self.draw_region_drag(self.monitor_frame))
+    
+    def draw_region_drag(self, frame):
+        """在画面副本上绘制选框"""
+        x0, y0, x1, y1 = self.region_drag
+        frame = frame.copy()
+        ImageDraw.Draw(frame).rectangle([min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)],
+                                        outline=(255, 0, 0), width=2)
+        return frame
+    
+    def on_region_release(self, event):
+        """框选结束：把选框换算为占整个屏幕的比例（在已选区域内框选时相对当前区域），更新传输区域"""
+        if not self.region_drag:
+            return
+        x0, y0, x1, y1 = self.region_drag
+        self.region_drag = None
+        self.region_selecting = False
+        self.monitor_label.config(cursor="")
+        if self.monitor_frame is not None and self.monitor_frame.size == (self.monitor_photo.width(),
+                                                                          self.monitor_photo.height()):
+            self.monitor_photo.paste(self.monitor_frame)  # 去掉选框
+        width, height = self.monitor_photo.width(), self.monitor_photo.height()
+        left, right = sorted(min(max(value / width, 0.0), 1.0) for value in (x0, x1))
+        top, bottom = sorted(min(max(value / height, 0.0), 1.0) for value in (y0, y1))
+        if (right - left) * width < MIN_REGION_DRAG or (bottom - top) * height < MIN_REGION_DRAG:
+            self.append_result("选择的区域太小，已取消")
+            return
+        base_x, base_y, base_width, base_height = self.stream_region or (0.0, 0.0, 1.0, 1.0)
+        self.set_stream_region((base_x + left * base_width, base_y + top * base_height,
+                                (right - left) * base_width, (bottom - top) * base_height))
+    
+    def set_stream_region(self, region):
+        """更新只传输的屏幕区域（None 为整个屏幕），不中断画面"""
+        if not self.monitoring or region == self.stream_region:
+            return
+        self.stream_region = region
+        self.send_update_monitor_command()
+    
+    def request_window_list(self):
+        """向被控端请求顶层窗口列表，收到后选择只传输其中一个窗口"""
+        if self.stream_display != 0:
+            self.append_result("选择窗口只支持主显示器")
+            return
+        try:
+            future = self.connection.request(CHANNEL_CONTROL, MSG_CONTROL, "__LIST_WINDOWS__")
+            self.track_request(future, "获取窗口列表", on_result=self.show_window_picker)
+        except Exception as e:
+            self.append_result(f"获取窗口列表失败: {str(e)}")
+    
+    def show_window_picker(self, text):
+        """显示被控端的窗口列表，选中后只传输该窗口所在的区域"""
+        windows = []
+        for line in text.splitlines():
+            region, _, title = line.partition(MESSAGE_SEPARATOR)
+            try:
+                windows.append((tuple(float(value) for value in region.split(",")), title))
+            except ValueError:
+                self.append_result(f"获取窗口列表回复: {text[:200]}")
+                return
+        if not windows:
+            self.append_result("被控端没有可选择的窗口")
+            return
+        if not self.monitoring:
+            return
+        
+        dialog = tk.Toplevel(self.monitor_window)
+        dialog.title("选择要传输的窗口")
+        dialog.transient(self.monitor_window)
+        listbox = tk.Listbox(dialog, width=60, height=min(len(windows), 20))
+        listbox.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        for _, title in windows:
+            listbox.insert(tk.END, title)
+        
+        def choose(event=None):
+            selection = listbox.curselection()
+            if selection:
+                self.set_stream_region(windows[selection[0]][0])
+            dialog.destroy()
+        listbox.bind("<Double-Button-1>", choose)
+        tk.Button(dialog, text="确定", command=choose).pack(pady=5)
+    
+    def describe_display(self, index):
+        """显示器选择菜单中的名称"""
+        if index >= len(self.agent_displays):
+            return f"显示器{index + 1}"
+        left, top, width, height = self.agent_displays[index]
+        return f"显示器{index + 1} ({width}x{height}{', 主显示器' if index == 0 else ''})"
+    
+    def request_screen_info(self):
+        """请求被控端的显示器布局，用于显示器选择"""
+        try:
+            future = self.connection.request(CHANNEL_CONTROL, MSG_CONTROL, "__SCREEN_INFO__")
+            self.track_request(future, "获取显示器布局", on_result=self.update_display_menu)
+        except Exception as e:
+            self.append_result(f"获取显示器布局失败: {str(e)}")
+    
+    def update_display_menu(self, text):
+        """按被控端回复的显示器布局（每行 左,上,宽,高）更新显示器选择菜单"""
+        try:
+            displays = [tuple(int(value) for value in line.split(",")) for line in text.splitlines()]
+        except ValueError:
+            # 旧版被控端不支持多显示器，只能监控主显示器
+            self.append_result(f"获取显示器布局回复: {text[:200]}")
+            return
+        if not self.monitoring or not displays:
+            return
+        self.agent_displays = displays
+        menu = self.display_menu["menu"]
+        menu.delete(0, tk.END)
+        for index in range(len(displays)):
+            menu.add_command(label=self.describe_display(index), command=lambda index=index: self.set_stream_display(index))
+        self.display_var.set(self.describe_display(self.stream_display))
+        if len(displays) > 1:
+            self.append_result(f"被控端有 {len(displays)} 个显示器: "
+                               + ", ".join(self.describe_display(index) for index in range(len(displays))))
+    
+    def set_stream_display(self, display):
+        """切换监控的显示器，不中断画面；区域是相对显示器的，切换后恢复为整个显示器"""
+        self.display_var.set(self.describe_display(display))
+        if not self.monitoring or display == self.stream_display:
+            return
+        self.stream_display = display
+        self.stream_region = None
+        self.send_update_monitor_command()
+    
+    def selected_display(self):
+        """显示器选择菜单中当前选中的显示器编号"""
+        labels = [self.describe_display(index) for index in range(max(1, len(self.agent_displays)))]
+        value = self.display_var.get()
+        return labels.index(value) if value in labels else 0
+    
+    def open_display_viewer(self):
+        """在新窗口中查看所选显示器：使用独立连接，与监控窗口的画面同时传输、互不影响"""
+        if not self.connection:
+            return
+        display = self.selected_display()
+        ip, port = self.connection.address
+        width, height = self.screen_width, self.screen_height
+        window = tk.Toplevel(self.root)
+        window.title(f"{ip} - {self.describe_display(display)}")
+        window.geometry(f"{width + 20}x{height + 20}")
+        label = tk.Label(window, text="连接中...")
+        label.pack(fill=tk.BOTH, expand=True)
+        view = {"window": window, "label": label, "display": display, "connection": None, "decoder": None,
+                "photo": None, "visible": True, "message": None, "closed": False, "deadline": None}
+        window.protocol("WM_DELETE_WINDOW", lambda: self.close_display_viewer(view))
+        window.bind("<Visibility>", self.on_window_visibility)
+        self.display_viewers.append(view)
+        threading.Thread(target=self.connect_display_viewer, args=(view, ip, port, width, height), daemon=True).start()
+        self.update_display_viewer(view)
+    
+    def connect_display_viewer(self, view, ip, port, width, height):
+        """为显示器查看窗口建立连接并开始监控（在后台线程中执行）"""
+        connection = None
+        try:
+            connection = AgentConnection(ip, port)
+            codec = "h264" if self.video_codec and av is not None else "jpeg"
+            command = MESSAGE_SEPARATOR.join(str(param) for param in [
+                "__START_MONITOR__", width, height, self.fps, self.quality, self.delay, 0, codec, "full", view["display"]])
+            msg_type, payload = connection.request(CHANNEL_CONTROL, MSG_CONTROL, command).result(timeout=REQUEST_TIMEOUT)
+            view["message"] = f"{self.describe_display(view['display'])}: {payload.decode('utf-8', errors='ignore')}"
+            view["decoder"] = ScreenDecoder(connection, False, (width, height))
+            view["connection"] = connection
+        except Exception as e:
+            view["message"] = f"查看{self.describe_display(view['display'])}失败: {str(e)}"
+            if connection:
+                connection.close()
+            return
+        if view["closed"]:
+            self.stop_display_viewer(view)
+    
+    def update_display_viewer(self, view):
+        """刷新显示器查看窗口"""
+        if view["closed"]:
+            return
+        if view["message"]:
+            self.append_result(view["message"])
+            view["message"] = None
+        decoder = view["decoder"]
+        if decoder is not None:
+            while not decoder.messages.empty():
+                self.append_result(f"[{self.describe_display(view['display'])}] {decoder.messages.get_nowait()}")
+            latest = decoder.take_frame()
+            if latest is not None:
+                frame = latest[0]
+                photo = view["photo"]
+                if photo is None or (photo.width(), photo.height()) != frame.size:
+                    photo = ImageTk.PhotoImage(image=frame)
+                    view["photo"] = photo
+                    view["label"].config(image=photo, text="")
+                    view["label"].image = photo  # 保持引用
+                else:
+                    photo.paste(frame)
+                decoder.record_display(latest[1], latest[2])
+            view["visible"] = self.report_stream_visibility(
+                view["connection"], self.is_viewport_visible(view["window"], view["label"]), view["visible"])
+        view["deadline"] = self.schedule_refresh(
+            view["window"], view["deadline"], lambda: self.update_display_viewer(view))
+    
+    def stop_display_viewer(self, view):
+        """停止显示器查看窗口的画面并断开其连接"""
+        if view["decoder"] is not None:
+            view["decoder"].stop()
+        connection = view["connection"]
+        if connection is not None:
+            try:
+                connection.send(CHANNEL_CONTROL, MSG_CONTROL, "__STOP_MONITOR__")
+            except Exception:
+                pass
+            connection.close()
+    
+    def close_display_viewer(self, view):
+        """关闭显示器查看窗口"""
+        view["closed"] = True
+        self.stop_display_viewer(view)
+        if view in self.display_viewers:
+            self.display_viewers.remove(view)
+        self.obscured_windows.discard(view["window"])
+        view["window"].destroy()
+    
+    def poll_display_viewers(self):
+        """处理显示器查看窗口各自连接上的超时请求和其他通道的消息，连接断开时关闭窗口"""
+        for view in list(self.display_viewers):
+            connection = view["connection"]
+            if connection is None:
+                continue
+            connection.expire_requests()
+            # 查看窗口只接收画面，其他通道的消息直接丢弃，避免积压
+            for channel in (CHANNEL_CONTROL, CHANNEL_OUTPUT, CHANNEL_FILE):
+                channel_queue = connection.channels[channel]
+                while not channel_queue.empty():
+                    channel_queue.get_nowait()
+            if connection.closed.is_set():
+                self.append_result(
+                    f"查看{self.describe_display(view['display'])}的连接已断开: {connection.error or '连接已关闭'}")
+                self.close_display_viewer(view)
+    
+    def on_window_visibility(self, event):
+        """记录监控窗口是否被其他窗口完全遮挡（子控件的同名事件忽略）"""
+        if event.widget is not event.widget.winfo_toplevel():
+            return
+        if event.state == "VisibilityFullyObscured":
+            self.obscured_windows.add(event.widget)
+        else:
+            self.obscured_windows.discard(event.widget)
+    
+    def is_viewport_visible(self, window, widget):
+        """画面控件是否可能被看到：窗口没有最小化、隐藏或被完全遮挡，且控件在窗口的显示区域内"""
+        try:
+            if (window.state() not in ("normal", "zoomed") or not widget.winfo_viewable()
+                    or window in self.obscured_windows):
+                return False
+            # 窗口小于网格时，超出显示区域的缩略图被裁掉
+            x = widget.winfo_rootx() - window.winfo_rootx()
+            y = widget.winfo_rooty() - window.winfo_rooty()
+            return (x < window.winfo_width() and y < window.winfo_height()
+                    and x + widget.winfo_width() > 0 and y + widget.winfo_height() > 0)
+        except tk.TclError:
+            return False  # 窗口已关闭
+    
+    def report_stream_visibility(self, connection, visible, reported):
+        """可见状态与上次通知的不同时通知被控端（无需回复），返回被控端已知的状态"""
+        if visible == reported:
+            return reported
+        try:
+            connection.send(CHANNEL_CONTROL, MSG_CONTROL, f"__STREAM_VISIBILITY__{MESSAGE_SEPARATOR}{int(visible)}")
+        except Exception as e:
+            self.append_result(f"发送画面可见状态失败: {str(e)}")
+            return reported
+        return visible
     
-    def stop_screen_monitor(self, restart=False):
+    def toggle_recording(self):
+        """开始或停止把监控画面录制到磁盘"""
+        if self.recorder:
+            self.stop_recording()
+            return
+        if not self.connection:
+            return
+        directory = os.path.join(
+            RECORDINGS_DIR, f"{self.connection.address[0]}_{time.strftime('%Y%m%d_%H%M%S')}")
+        try:
+            self.recorder = ScreenRecorder(directory)
+        except OSError as e:
+            self.append_result(f"开始录制失败: {str(e)}")
+            return
+        self.connection.recorder = self.recorder
+        self.record_btn.config(text="停止录制")
+        self.append_result(f"开始录制到 {directory}")
+        if self.delta_mode or self.video_codec:
+            # 录像从完整画面开始，请求一次，不必等到被控端定期发送完整画面
+            try:
+                self.connection.send(CHANNEL_CONTROL, MSG_CONTROL, "__REQUEST_KEYFRAME__")
+            except Exception as e:
+                self.append_result(f"请求完整画面失败: {str(e)}")
+    
+    def stop_recording(self):
+        """停止录制，写完已收到的画面后关闭录像文件"""
+        recorder, self.recorder = self.recorder, None
+        if recorder is None:
+            return
+        if self.connection:
+            self.connection.recorder = None
+        recorder.close()
+        if self.monitor_window:
+            self.record_btn.config(text="开始录制")
+        result = (f"录像已保存: {recorder.directory}（{recorder.frames}帧, {recorder.bytes / 1024 / 1024:.1f}MB, "
+                  f"未录制{recorder.dropped}帧）")
+        if recorder.error:
+            result += f"，写入失败: {recorder.error}"
+        self.append_result(result)
+    
+    def open_recording(self):
+        """选择录像目录，在新窗口中回放"""
+        directory = filedialog.askdirectory(
+            title="选择录像目录", initialdir=RECORDINGS_DIR if os.path.isdir(RECORDINGS_DIR) else None)
+        if not directory:
+            return
+        try:
+            player = RecordingPlayer(directory)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("错误", f"无法打开录像: {str(e)}")
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title(f"录像回放 - {os.path.basename(directory)}")
+        window.geometry(f"{self.screen_width + 20}x{self.screen_height + 80}")
+        label = tk.Label(window, bg="black")
+        label.pack(fill=tk.BOTH, expand=True)
+        controls = tk.Frame(window)
+        controls.pack(fill=tk.X, padx=5, pady=5)
+        view = {"window": window, "label": label, "player": player, "photo": None, "shown": None,
+                "playing": False, "position": 0.0, "play_start": None, "job": None}
+        view["play_btn"] = tk.Button(controls, text="播放", width=6, command=lambda: self.toggle_playback(view))
+        view["play_btn"].pack(side=tk.LEFT)
+        view["time_label"] = tk.Label(controls, width=16)
+        view["time_label"].pack(side=tk.RIGHT)
+        # 拖动进度条即可定位：按索引二分查找，从最近的完整画面解码
+        view["scale"] = tk.Scale(controls, from_=0, to=player.duration, resolution=0.1, orient=tk.HORIZONTAL,
+                                 showvalue=False, command=lambda value: self.seek_recording(view, float(value)))
+        view["scale"].pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        
+        def close():
+            if view["job"]:
+                window.after_cancel(view["job"])
+            player.close()
+            window.destroy()
+        window.protocol("WM_DELETE_WINDOW", close)
+        self.show_recording_frame(view)
+    
+    def toggle_playback(self, view):
+        """播放或暂停录像，播放到结尾后从头开始"""
+        if view["playing"]:
+            view["playing"] = False
+            view["play_btn"].config(text="播放")
+            if view["job"]:
+                view["window"].after_cancel(view["job"])
+                view["job"] = None
+            return
+        if view["position"] >= view["player"].duration:
+            view["position"] = 0.0
+        view["playing"] = True
+        view["play_start"] = time.monotonic() - view["position"]
+        view["play_btn"].config(text="暂停")
+        self.update_playback(view)
+    
+    def seek_recording(self, view, position):
+        """进度条被拖动时定位（播放中更新进度条也会触发，位置相同时忽略）"""
+        if abs(position - view["position"]) < 0.1:
+            return
+        view["position"] = position
+        if view["playing"]:
+            view["play_start"] = time.monotonic() - position
+        self.show_recording_frame(view)
+    
+    def update_playback(self, view):
+        """按录像中的时间顺序播放，在下一帧的时间再刷新"""
+        view["job"] = None
+        if not view["playing"]:
+            return
+        player = view["player"]
+        view["position"] = min(time.monotonic() - view["play_start"], player.duration)
+        number = self.show_recording_frame(view)
+        view["scale"].set(view["position"])
+        if number + 1 >= player.count:
+            view["playing"] = False
+            view["play_btn"].config(text="播放")
+            return
+        delay = player.time_at(number + 1) - view["position"]
+        view["job"] = view["window"].after(max(1, round(delay * 1000)), lambda: self.update_playback(view))
+    
+    def show_recording_frame(self, view):
+        """显示当前位置的画面（帧未变化时不重新解码），返回帧序号"""
+        player = view["player"]
+        number = player.find(view["position"])
+        view["time_label"].config(text=f"{view['position']:.1f} / {player.duration:.1f}s")
+        if number == view["shown"]:
+            return number
+        try:
+            frame = player.frame_at(number)
+        except Exception as e:
+            self.append_result(f"回放录像失败: {str(e)}")
+            view["playing"] = False
+            view["play_btn"].config(text="播放")
+            return number
+        view["shown"] = number
+        if frame is None:
+            return number
+        label = view["label"]
+        width, height = label.winfo_width(), label.winfo_height()
+        if width <= 1 or height <= 1:
+            width, height = self.screen_width, self.screen_height  # 窗口尚未显示
+        scale = min(width / frame.width, height / frame.height)
+        size = (max(1, round(frame.width * scale)), max(1, round(frame.height * scale)))
+        if frame.size != size:
+            frame = frame.resize(size, DISPLAY_RESAMPLE, reducing_gap=2.0)
+        photo = view["photo"]
+        if photo is None or (photo.width(), photo.height()) != frame.size:
+            photo = ImageTk.PhotoImage(image=frame)
+            view["photo"] = photo
+            label.config(image=photo)
+            label.image = photo  # 保持引用
+        else:
+            photo.paste(frame)
+        return number
+    
+    def stop_screen_monitor(self):
         """停止屏幕监控"""
         self.monitoring = False
+        self.stop_recording()
+        if self.screen_decoder:
+            self.screen_decoder.stop()
+            self.screen_decoder = None
+        self.monitor_photo = None
+        self.resize_job = None
         try:
-            if self.connected and self.client_socket:
-                self.client_socket.sendall("__STOP_MONITOR__".encode('utf-8'))
+            if self.connected and self.connection:
+                future = self.connection.request(CHANNEL_CONTROL, MSG_CONTROL, "__STOP_MONITOR__")
+                self.track_request(future, "停止监控")
                 self.append_result("已发送停止监控命令")
         except Exception as e:
             self.append_result(f"发送停止监控命令失败: {str(e)}")
         
         if self.monitor_window:
+            self.obscured_windows.discard(self.monitor_window)
             self.monitor_window.destroy()
             self.monitor_window = None
+    
+    # 监控墙：同时查看一个分组内所有设备的缩略画面
+    def open_monitor_wall(self):
+        """打开监控墙，为当前分组的每台设备建立独立连接并接收缩略画面"""
+        if self.wall_window:
+            self.wall_window.lift()
+            return
+        group_device_ids = self.device_groups.get(self.current_group.get(), [])
+        devices = [device for device in self.devices if device['id'] in group_device_ids]
+        if not devices:
+            messagebox.showinfo("提示", "当前分组没有设备")
+            return
         
-        # 如果需要重启监控
-        if restart:
-            self.start_screen_monitor()
+        self.wall_window = tk.Toplevel(self.root)
+        self.wall_window.title(f"监控墙 - {self.current_group.get()}")
+        self.wall_window.protocol("WM_DELETE_WINDOW", self.close_monitor_wall)
+        self.wall_window.bind("<Visibility>", self.on_window_visibility)
+        # 所有设备共用的解码线程池，设备再多 CPU 和内存占用也有上限
+        self.wall_decode_pool = concurrent.futures.ThreadPoolExecutor(max_workers=WALL_DECODE_WORKERS)
+        self.wall_sessions = []
+        
+        columns = max(1, math.ceil(math.sqrt(len(devices))))
+        thumb_width, thumb_height = WALL_THUMB_SIZE
+        blank_image = Image.new('RGB', WALL_THUMB_SIZE, color='black')
+        for index, device in enumerate(devices):
+            session = WallSession(device)
+            tile = tk.Frame(self.wall_window, bd=1, relief=tk.SOLID)
+            tile.grid(row=index // columns, column=index % columns, padx=3, pady=3)
+            session.photo = ImageTk.PhotoImage(image=blank_image)
+            session.image_label = tk.Label(tile, image=session.photo, width=thumb_width, height=thumb_height, cursor="hand2")
+            session.image_label.pack()
+            session.status_label = tk.Label(tile, text=f"{device['name']} - {session.status}")
+            session.status_label.pack(fill=tk.X)
+            # 点击缩略图提升为全分辨率画面
+            session.image_label.bind("<Button-1>", lambda event, s=session: self.promote_wall_session(s))
+            self.wall_sessions.append(session)
+            threading.Thread(target=self.connect_wall_session, args=(session,), daemon=True).start()
+        
+        self.update_monitor_wall()
+    
+    def connect_wall_session(self, session):
+        """连接一台设备并以缩略图参数开始监控（在后台线程中执行）"""
+        device = session.device
+        try:
+            session.connection = AgentConnection(device['ip'], int(device['port']), connect_timeout=WALL_CONNECT_TIMEOUT)
+            width, height = WALL_THUMB_SIZE
+            command = MESSAGE_SEPARATOR.join(
+                str(param) for param in ["__START_MONITOR__", width, height, WALL_FPS, WALL_QUALITY, DEFAULT_DELAY, 0])
+            session.connection.request(CHANNEL_CONTROL, MSG_CONTROL, command).result(timeout=REQUEST_TIMEOUT)
+            session.status = "在线"
+        except Exception as e:
+            session.status = f"离线 ({str(e)[:30]})"
+            if session.connection:
+                session.connection.close()
+                session.connection = None
+    
+    def update_monitor_wall(self):
+        """刷新监控墙：把各设备的最新画面交给解码线程池，显示已解码的缩略图"""
+        if not self.wall_window:
+            return
+        for session in self.wall_sessions:
+            connection = session.connection
+            if connection:
+                connection.expire_requests()
+                # 监控墙只接收画面，其他通道的消息直接丢弃，避免积压
+                for channel in (CHANNEL_CONTROL, CHANNEL_OUTPUT, CHANNEL_FILE):
+                    channel_queue = connection.channels[channel]
+                    while not channel_queue.empty():
+                        channel_queue.get_nowait()
+                if connection.closed.is_set():
+                    session.status = f"已断开 ({connection.error or '连接已关闭'})"
+                    session.connection = None
+                elif not session.promoted:
+                    # 监控墙最小化、被遮挡或缩略图在窗口显示区域之外时，被控端暂停编码
+                    session.visible = self.report_stream_visibility(
+                        connection, self.is_viewport_visible(self.wall_window, session.image_label), session.visible)
+                    if not session.decoding:
+                        # 只解码最新的一帧，积压的旧帧直接丢弃；心跳没有画面，不替换之前的画面
+                        newest = None
+                        screen_queue = connection.channels[CHANNEL_SCREEN]
+                        while not screen_queue.empty():
+                            message = screen_queue.get_nowait()
+                            if message[1][1] == CODEC_NONE:
+                                connection.release_frame(message[1])
+                                continue
+                            if newest is not None:
+                                connection.release_frame(newest[1])
+                            newest = message
+                        if newest is not None:
+                            session.decoding = True
+                            self.wall_decode_pool.submit(self.decode_wall_frame, session, connection, newest[0], newest[1])
+            
+            latest, session.latest = session.latest, None
+            if latest is not None:
+                session.photo.paste(latest)
+            session.status_label.config(text=f"{session.device['name']} - {session.status}")
+        
+        self.wall_window.after(WALL_REFRESH_MS, self.update_monitor_wall)
+    
+    def decode_wall_frame(self, session, connection, msg_type, payload):
+        """把一帧画面解码为缩略图（在共享解码线程池中执行）"""
+        try:
+            version, codec = FRAME_HEADER.unpack_from(payload, 0)[:2]
+            if msg_type != MSG_IMAGE or version != FRAME_VERSION or codec not in IMAGE_CODECS:
+                return
+            img = Image.open(MemoryViewReader(payload[FRAME_HEADER.size:]))
+            img.draft('RGB', WALL_THUMB_SIZE)  # 按接近缩略图的比例解码
+            img.load()
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            if img.size != WALL_THUMB_SIZE:
+                img = img.resize(WALL_THUMB_SIZE, DISPLAY_RESAMPLE, reducing_gap=2.0)
+            session.latest = img
+        except Exception as e:
+            session.status = f"画面错误 ({str(e)[:30]})"
+        finally:
+            connection.release_frame(payload)
+            session.decoding = False
+    
+    def send_wall_params(self, session, width, height, fps, quality):
+        """更新监控墙中某台设备的画面参数，不中断画面"""
+        command = MESSAGE_SEPARATOR.join(
+            str(param) for param in ["__UPDATE_MONITOR__", width, height, fps, quality, DEFAULT_DELAY, 0])
+        session.connection.request(CHANNEL_CONTROL, MSG_CONTROL, command)
+    
+    def promote_wall_session(self, session):
+        """把监控墙中的一台设备提升为全分辨率画面，在单独窗口中查看"""
+        if session.promoted or not session.connection:
+            return
+        try:
+            self.send_wall_params(session, self.screen_width, self.screen_height, self.fps, self.quality)
+        except Exception as e:
+            session.status = f"切换失败 ({str(e)[:30]})"
+            return
+        session.promoted = True
+        
+        window = tk.Toplevel(self.wall_window)
+        window.title(f"{session.device['name']} ({session.device['ip']}) - 全分辨率")
+        window.geometry(f"{self.screen_width + 20}x{self.screen_height + 20}")
+        window.bind("<Visibility>", self.on_window_visibility)
+        label = tk.Label(window)
+        label.pack(fill=tk.BOTH, expand=True)
+        decoder = ScreenDecoder(session.connection, False, (self.screen_width, self.screen_height))
+        view = {"window": window, "label": label, "decoder": decoder, "photo": None, "deadline": None}
+        window.protocol("WM_DELETE_WINDOW", lambda: self.demote_wall_session(session, view))
+        self.update_wall_focus(session, view)
+    
+    def update_wall_focus(self, session, view):
+        """刷新全分辨率查看窗口"""
+        if not session.promoted:
+            return
+        decoder = view["decoder"]
+        while not decoder.messages.empty():
+            self.append_result(f"[{session.device['name']}] {decoder.messages.get_nowait()}")
+        latest = decoder.take_frame()
+        if latest is not None:
+            frame = latest[0]
+            photo = view["photo"]
+            if photo is None or (photo.width(), photo.height()) != frame.size:
+                photo = ImageTk.PhotoImage(image=frame)
+                view["photo"] = photo
+                view["label"].config(image=photo)
+                view["label"].image = photo  # 保持引用
+            else:
+                photo.paste(frame)
+            decoder.record_display(latest[1], latest[2])
+        session.visible = self.report_stream_visibility(
+            session.connection, self.is_viewport_visible(view["window"], view["label"]), session.visible)
+        view["deadline"] = self.schedule_refresh(
+            view["window"], view["deadline"], lambda: self.update_wall_focus(session, view))
+    
+    def demote_wall_session(self, session, view):
+        """关闭全分辨率窗口，设备恢复为缩略画面"""
+        session.promoted = False
+        view["decoder"].stop()
+        self.obscured_windows.discard(view["window"])
+        view["window"].destroy()
+        if session.connection:
+            try:
+                width, height = WALL_THUMB_SIZE
+                self.send_wall_params(session, width, height, WALL_FPS, WALL_QUALITY)
+            except Exception as e:
+                session.status = f"切换失败 ({str(e)[:30]})"
+    
+    def close_monitor_wall(self):
+        """关闭监控墙，停止所有设备的画面并断开监控墙的连接"""
+        for session in self.wall_sessions:
+            session.promoted = False
+            if session.connection:
+                try:
+                    session.connection.send(CHANNEL_CONTROL, MSG_CONTROL, "__STOP_MONITOR__")
+                except Exception:
+                    pass
+                session.connection.close()
+                session.connection = None
+        self.wall_sessions = []
+        if self.wall_decode_pool:
+            self.wall_decode_pool.shutdown(wait=False)
+            self.wall_decode_pool = None
+        if self.wall_window:
+            self.obscured_windows.discard(self.wall_window)
+            self.wall_window.destroy()
+            self.wall_window = None
     
     def show_about_window(self):
         """显示关于窗口"""
@@ -1104,8 +2740,7 @@ class RemoteController:
             ip = self.target_ip.get()
             port = int(self.target_port.get())
             
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((ip, port))
+            self.connection = AgentConnection(ip, port)
             
             self.connected = True
             self.connect_btn.config(text="断开连接")
@@ -1117,9 +2752,8 @@ class RemoteController:
                     device['online'] = True
             self.refresh_device_list()
             
-            # 启动接收线程
-            self.receive_thread = threading.Thread(target=self.receive_data, daemon=True)
-            self.receive_thread.start()
+            # 定时处理各通道收到的消息
+            self.poll_channels()
             
         except Exception as e:
             self.append_result(f"连接失败: {str(e)}")
@@ -1128,45 +2762,97 @@ class RemoteController:
                 if device['ip'] == ip and str(device['port']) == str(port):
                     device['online'] = False
             self.refresh_device_list()
-            self.client_socket = None
+            self.connection = None
     
     def disconnect(self):
         """断开与被控端的连接"""
-        if self.connected and self.client_socket:
+        if self.connected and self.connection:
             try:
-                self.client_socket.close()
+                self.connection.close()
             except Exception as e:
                 self.append_result(f"断开连接时出错: {str(e)}")
             
             self.connected = False
             self.connect_btn.config(text="连接")
             self.append_result("已断开连接")
+            self.stop_recording()
+            
+            # 显示器查看窗口使用各自的连接，随主连接一起关闭
+            for view in list(self.display_viewers):
+                self.close_display_viewer(view)
             
             # 更新设备在线状态
             if self.current_device:
                 self.current_device['online'] = False
                 self.refresh_device_list()
                 
-            self.client_socket = None
+            self.connection = None
     
-    def receive_data(self):
-        """接收被控端返回的文本数据"""
-        while self.connected and self.client_socket:
-            try:
-                data = self.client_socket.recv(4096).decode('utf-8', errors='ignore')
-                if not data:
-                    self.append_result("连接已被远程关闭")
-                    self.disconnect()
+    def poll_channels(self):
+        """在UI线程中定时处理控制、命令输出和文件通道的消息"""
+        connection = self.connection
+        if not connection:
+            return
+        
+        channel_labels = [
+            (CHANNEL_CONTROL, "收到"),
+            (CHANNEL_OUTPUT, "命令输出"),
+            (CHANNEL_FILE, "文件传输")
+        ]
+        for channel, label in channel_labels:
+            channel_queue = connection.channels[channel]
+            while True:
+                try:
+                    msg_type, payload = channel_queue.get_nowait()
+                except queue.Empty:
                     break
-                self.append_result(f"收到: {data}")
-            except Exception as e:
-                if self.connected:  # 只有在仍然连接的情况下才显示错误
-                    self.append_result(f"接收数据出错: {str(e)}")
+                if msg_type == MSG_TEXT:
+                    self.append_result(f"{label}: {payload.decode('utf-8', errors='ignore')}")
+        while True:
+            try:
+                self.append_result(self.background_results.get_nowait())
+            except queue.Empty:
                 break
+        
+        # 处理超时和已完成的请求
+        connection.expire_requests()
+        self.poll_display_viewers()
+        while True:
+            try:
+                label, future, on_result = self.completed_requests.get_nowait()
+            except queue.Empty:
+                break
+            self.show_request_result(label, future, on_result)
+        
+        if connection.closed.is_set():
+            # 连接被远程关闭或出错（主动断开时 self.connection 已被替换）
+            if connection is self.connection and self.connected:
+                self.append_result(connection.error or "连接已关闭")
+                self.disconnect()
+            return
+        
+        self.root.after(50, self.poll_channels)
+    
+    def track_request(self, future, label, on_result=None):
+        """请求完成（回复、超时或失败）后交给UI线程显示结果；指定 on_result 时回复文本交给它处理"""
+        future.add_done_callback(lambda f: self.completed_requests.put((label, f, on_result)))
+    
+    def show_request_result(self, label, future, on_result=None):
+        """显示请求结果，通过请求ID与发出的请求对应"""
+        try:
+            msg_type, payload = future.result()
+            if on_result is not None:
+                on_result(payload.decode('utf-8', errors='ignore'))
+                return
+            self.append_result(f"{label} #{future.request_id} 回复: {payload.decode('utf-8', errors='ignore')}")
+        except concurrent.futures.TimeoutError:
+            self.append_result(f"{label} #{future.request_id} 超时未收到回复")
+        except Exception as e:
+            self.append_result(f"{label} #{future.request_id} 失败: {str(e)}")
     
     def send_command(self):
         """发送命令到被控端"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.connection:
             messagebox.showwarning("警告", "请先建立连接")
             return
         
@@ -1175,8 +2861,9 @@ class RemoteController:
             return
         
         try:
-            self.client_socket.sendall(cmd.encode('utf-8'))
-            self.append_result(f"已发送命令: {cmd}")
+            future = self.connection.request(CHANNEL_OUTPUT, MSG_COMMAND, cmd, timeout=COMMAND_TIMEOUT)
+            self.track_request(future, f"命令 [{cmd}]")
+            self.append_result(f"已发送命令 #{future.request_id}: {cmd}")
             self.cmd_entry.delete(0, tk.END)
         except Exception as e:
             self.append_result(f"发送命令失败: {str(e)}")
@@ -1184,7 +2871,7 @@ class RemoteController:
     
     def send_preset_command(self, cmd):
         """发送预设命令"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.connection:
             messagebox.showwarning("警告", "请先建立连接")
             return
             
@@ -1193,28 +2880,30 @@ class RemoteController:
         self.cmd_entry.insert(0, cmd)
         
         try:
-            self.client_socket.sendall(cmd.encode('utf-8'))
-            self.append_result(f"已发送预设命令: {cmd}")
+            future = self.connection.request(CHANNEL_OUTPUT, MSG_COMMAND, cmd, timeout=COMMAND_TIMEOUT)
+            self.track_request(future, f"预设命令 [{cmd}]")
+            self.append_result(f"已发送预设命令 #{future.request_id}: {cmd}")
         except Exception as e:
             self.append_result(f"发送预设命令失败: {str(e)}")
             self.disconnect()
     
     def send_special_command(self, command):
         """发送特殊控制命令"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.connection:
             messagebox.showwarning("警告", "请先建立连接")
             return
         
         try:
-            self.client_socket.sendall(command.encode('utf-8'))
-            self.append_result(f"已发送特殊命令: {command}")
+            future = self.connection.request(CHANNEL_CONTROL, MSG_CONTROL, command)
+            self.track_request(future, f"特殊命令 [{command}]")
+            self.append_result(f"已发送特殊命令 #{future.request_id}: {command}")
         except Exception as e:
             self.append_result(f"发送命令失败: {str(e)}")
             self.disconnect()
     
     def send_popup(self):
         """发送弹窗消息"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.connection:
             messagebox.showwarning("警告", "请先建立连接")
             return
         
@@ -1223,33 +2912,17 @@ class RemoteController:
             try:
                 # 使用特殊分隔符，避免与消息内容中的|冲突
                 command = f"__POPUP_MESSAGE__{self.MESSAGE_SEPARATOR}{msg}"
-                self.client_socket.sendall(command.encode('utf-8'))
-                
-                # 等待确认消息
-                timeout = 5
-                start_time = time.time()
-                self.client_socket.settimeout(1)
-                
-                while time.time() - start_time < timeout:
-                    try:
-                        response = self.client_socket.recv(1024).decode('utf-8')
-                        if response:
-                            self.append_result(f"弹窗响应: {response}")
-                            return
-                    except socket.timeout:
-                        continue
-                
-                self.append_result(f"弹窗消息已发送，但未收到确认")
-                
+                # 不阻塞界面等待确认，确认或超时由 track_request 显示
+                future = self.connection.request(CHANNEL_CONTROL, MSG_CONTROL, command, timeout=POPUP_TIMEOUT)
+                self.track_request(future, "弹窗消息")
+                self.append_result(f"已发送弹窗消息 #{future.request_id}，内容长度: {len(msg)} 字符")
             except Exception as e:
                 self.append_result(f"发送弹窗消息失败: {str(e)}")
                 self.disconnect()
-            finally:
-                self.client_socket.settimeout(None)
     
     def send_file(self):
         """发送文件到被控端"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.connection:
             messagebox.showwarning("警告", "请先建立连接")
             return
         
@@ -1257,32 +2930,41 @@ class RemoteController:
         if not file_path:
             return
         
+        # 在后台线程中上传，文件数据与命令、屏幕画面在同一连接上交错传输
+        threading.Thread(target=self.upload_file, args=(self.connection, file_path), daemon=True).start()
+    
+    def upload_file(self, connection, file_path):
+        """上传文件（后台线程）"""
         try:
             file_name = os.path.basename(file_path)
             file_size = os.path.getsize(file_path)
+            self.background_results.put(f"开始发送文件 {file_name}，大小: {file_size} 字节")
             
-            # 发送文件信息
-            command = f"__SEND_FILE__|{file_name}|{file_size}"
-            self.client_socket.sendall(command.encode('utf-8'))
+            # 整个传输使用同一个请求ID，多个文件可以同时上传
+            request_id = connection.new_request_id()
+            future = connection.expect_reply(request_id, timeout=None)
+            self.track_request(future, f"文件 {file_name}")
             
-            # 等待被控端准备好
-            time.sleep(1)
+            # 文件信息、数据块和结束标记依次作为独立消息发送，无需等待被控端就绪
+            connection.send(CHANNEL_FILE, MSG_FILE_BEGIN, f"{file_name}|{file_size}", request_id)
             
-            # 发送文件内容
             with open(file_path, 'rb') as f:
-                bytes_sent = 0
-                while bytes_sent < file_size:
-                    chunk = f.read(1024)
+                # 被控端提前回复说明接收已失败，停止发送
+                while not connection.closed.is_set() and not future.done():
+                    chunk = f.read(FILE_CHUNK_SIZE)
                     if not chunk:
                         break
-                    self.client_socket.sendall(chunk)
-                    bytes_sent += len(chunk)
+                    connection.send(CHANNEL_FILE, MSG_FILE_DATA, chunk, request_id)
             
-            self.append_result(f"文件 {file_name} 发送完成，大小: {file_size} 字节")
+            if not future.done():
+                connection.send(CHANNEL_FILE, MSG_FILE_END, b"", request_id)
+                connection.set_deadline(request_id, FILE_REPLY_TIMEOUT)
+                self.background_results.put(f"文件 {file_name} 数据发送完成，大小: {file_size} 字节，等待被控端确认")
             
         except Exception as e:
-            self.append_result(f"发送文件失败: {str(e)}")
-            self.disconnect()
+            self.background_results.put(f"发送文件失败: {str(e)}")
+            # 关闭连接，由 poll_channels 在UI线程中完成断开处理
+            connection.close()
     
     def append_result(self, text):
         """在结果区域添加文本"""
@@ -0,0 +1,675 @@
+"""RemoCon 屏幕传输性能基准测试（本机回环，无需 Windows 环境）
+
+用法:
+    python benchmark.py recv    # 画面接收：逐块拼接 vs recv_into 预分配缓冲区
+    python benchmark.py send    # 画面发送：三次 sendall + 4KB 切片 vs 整条消息一次写出
+    python benchmark.py pipeline  # 屏幕流：捕获、编码、发送串行执行 vs 三段流水线
+    python benchmark.py capture   # 各屏幕捕获后端的单帧耗时
+    python benchmark.py resize    # 1920x1080 画面缩放到各预设分辨率的单帧耗时（按缩放方式）
+    python benchmark.py simulcast # 多个主控端同时监控：捕获、编码次数随编码层数而不是连接数增长
+    python benchmark.py codec     # 各合成场景下 JPEG、JPEG 增量传输、H.264 的码率和编码 CPU 耗时
+    python benchmark.py jpeg      # 本机可用的各 JPEG 编码方式、色度抽样的单帧耗时和大小（用于选择 REMOCON_JPEG）
+    python benchmark.py static    # 画面静止时开关静止画面检测的捕获、编码次数、码率和 CPU 占用
+    python benchmark.py record    # 录像：夹杂心跳的增量画面流能否完整录制，以及回放时随机定位的耗时
+"""
+import asyncio
+import importlib.util
+import io
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageDraw
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FRAME_SIZES = [(1280, 720), (1920, 1080)]
+
+
+def load_module(name, filename):
+    """按文件路径加载脚本（文件名含版本号，无法直接 import）"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_desktop_image(width, height, seed=0):
+    """生成类似办公桌面的测试画面：窗口、文字行和少量图片区域"""
+    rng = random.Random(seed)
+    img = Image.new('RGB', (width, height), (0, 90, 160))
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x, y = rng.randrange(width // 2), rng.randrange(height // 2)
+        w, h = rng.randrange(width // 4, width // 2), rng.randrange(height // 4, height // 2)
+        draw.rectangle([x, y, x + w, y + h], fill=(240, 240, 240), outline=(60, 60, 60))
+        draw.rectangle([x, y, x + w, y + 24], fill=(30, 30, 120))
+        for line_y in range(y + 32, y + h - 12, 16):
+            draw.text((x + 8, line_y), "".join(rng.choice("abcdefghij 0123456789") for _ in range(w // 8)), fill=(0, 0, 0))
+    photo = Image.effect_noise((width // 4, height // 4), 60).convert('RGB')
+    img.paste(photo, (width - width // 4 - 20, height - height // 4 - 60))
+    return img
+
+
+def encode_jpeg(img, quality=50):
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def loopback_pair():
+    """建立一对本机 TCP 连接"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sender = socket.create_connection(listener.getsockname())
+    receiver, _ = listener.accept()
+    listener.close()
+    return sender, receiver
+
+
+def run_loopback(message, count, receive):
+    """发送 count 条相同消息，返回接收端吞吐量（MB/s）"""
+    sender, receiver = loopback_pair()
+
+    def send_all():
+        for _ in range(count):
+            sender.sendall(message)
+
+    thread = threading.Thread(target=send_all, daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    receive(receiver, count)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return len(message) * count / elapsed / (1024 * 1024)
+
+
+def legacy_receive(sock, count):
+    """旧版 receive_screen_data 的接收方式：4096 字节 recv + bytes 拼接"""
+    for _ in range(count):
+        magic = b""
+        while len(magic) < 4:
+            magic += sock.recv(4 - len(magic))
+        length_data = b""
+        while len(length_data) < 4:
+            length_data += sock.recv(4 - len(length_data))
+        data_length = int.from_bytes(length_data, byteorder='big')
+        img_data = b''
+        while len(img_data) < data_length:
+            img_data += sock.recv(min(4096, data_length - len(img_data)))
+
+
+def bench_recv():
+    controller = load_module("remocon", "RemoCon2.1.py")
+
+    def reader_receive(sock, count):
+        reader = controller.MessageReader(sock)
+        for _ in range(count):
+            reader.release_frame(reader.read_message()[3])
+
+    print(f"{'分辨率':<12}{'帧大小':>10}{'逐块拼接 MB/s':>16}{'recv_into MB/s':>18}")
+    for width, height in FRAME_SIZES:
+        frame = encode_jpeg(make_desktop_image(width, height))
+        count = max(50, (200 * 1024 * 1024) // len(frame) // 4)
+        legacy_message = b"IMGB" + len(frame).to_bytes(4, byteorder='big') + frame
+        new_message = controller.pack_message(controller.CHANNEL_SCREEN, controller.MSG_IMAGE, frame)
+        before = run_loopback(legacy_message, count, legacy_receive)
+        after = run_loopback(new_message, count, reader_receive)
+        print(f"{f'{width}x{height}':<12}{len(frame) // 1024:>8}KB{before:>16.1f}{after:>18.1f}")
+
+
+class CountingSocket(socket.socket):
+    """统计发送调用次数的套接字（每次调用至少对应一次系统调用）"""
+
+    send_calls = 0
+
+    def send(self, *args):
+        self.send_calls += 1
+        return super().send(*args)
+
+    def sendall(self, *args):
+        self.send_calls += 1
+        return super().sendall(*args)
+
+
+def drain_socket(sock):
+    """接收并丢弃数据直到连接关闭"""
+    buffer = bytearray(1024 * 1024)
+    while sock.recv_into(buffer):
+        pass
+
+
+def measure_sender(send):
+    """在独立线程中运行发送函数，返回 (线程CPU时间, 发送调用次数)"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sender = CountingSocket(socket.AF_INET, socket.SOCK_STREAM)
+    sender.connect(listener.getsockname())
+    receiver, _ = listener.accept()
+    listener.close()
+    drain_thread = threading.Thread(target=drain_socket, args=(receiver,), daemon=True)
+    drain_thread.start()
+    result = {}
+
+    def run():
+        start = time.thread_time()
+        send(sender)
+        result['cpu'] = time.thread_time() - start
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    calls = sender.send_calls
+    sender.close()
+    drain_thread.join()
+    receiver.close()
+    return result['cpu'], calls
+
+
+def bench_send():
+    agent = load_module("client", "client2.1.py")
+    header_size = agent.MESSAGE_HEADER.size
+
+    print(f"{'分辨率':<12}{'帧大小':>10}{'旧: CPU ms/帧':>16}{'调用/帧':>10}{'新: CPU ms/帧':>16}{'调用/帧':>10}")
+    for width, height in FRAME_SIZES:
+        message, payload_length = agent.encode_image_message(make_desktop_image(width, height), 50)
+        img_data = bytes(message[header_size:])
+        count = 300
+
+        def legacy_send(sock):
+            # 旧版 capture_and_send_screen：魔术数字、长度、4KB 切片分别 sendall
+            for _ in range(count):
+                sock.sendall(b"IMGB")
+                sock.sendall(len(img_data).to_bytes(4, byteorder='big'))
+                sent = 0
+                while sent < len(img_data):
+                    chunk_size = min(4096, len(img_data) - sent)
+                    sock.sendall(img_data[sent:sent + chunk_size])
+                    sent += chunk_size
+
+        def message_send(sock):
+            # 新版：asyncio 传输层一次写入整条消息，drain 提供背压
+            async def run():
+                _, writer = await asyncio.open_connection(sock=sock)
+                for _ in range(count):
+                    writer.write(message)
+                    await writer.drain()
+                writer.transport.abort()
+            asyncio.run(run())
+
+        old_cpu, old_calls = measure_sender(legacy_send)
+        new_cpu, new_calls = measure_sender(message_send)
+        print(f"{f'{width}x{height}':<12}{payload_length // 1024:>8}KB"
+              f"{old_cpu / count * 1000:>16.3f}{old_calls / count:>10.1f}"
+              f"{new_cpu / count * 1000:>16.3f}{new_calls / count:>10.1f}")
+
+
+CAPTURE_COST = 0.03  # 模拟一次屏幕捕获的耗时（秒），捕获期间不占用 GIL
+PIPELINE_SECONDS = 5
+
+
+def make_stream_agent(agent, width, height, capture_backend):
+    """构造只用于屏幕流的被控端对象（不启动界面、不设置自启动）"""
+    import concurrent.futures
+    server = agent.ClientServer.__new__(agent.ClientServer)
+    server.capture_backend = capture_backend
+    server.monitoring = True
+    server.monitor_task = None
+    server.subscribers = {}
+    server.layers = {}
+    server.background_tasks = set()
+    server.capture_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    server.encode_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    server.pipeline_stats = {}
+    server.capture_wakeup = None
+    server.jpeg_encoder = agent.create_jpeg_encoder("auto", log=lambda message: None)
+    server.log = lambda message: None
+    return server
+
+
+def stream_params(width, height, fps=100, quality=50, delta=False, codec=1):
+    """与 parse_monitor_params 返回格式相同的监控参数（codec 为画面头中的编码方式）"""
+    return {"width": width, "height": height, "fps": fps, "quality": quality, "delay": 0.5,
+            "delta_requested": delta, "delta": delta, "h264_requested": codec == 2, "codec": codec, "region": None,
+            "display": 0}
+
+
+def subscribe_stream(server, params):
+    """返回一个屏幕流函数：把连接加入被控端的画面订阅，直到被取消"""
+    async def stream(writer):
+        server.add_screen_subscriber(writer, params)
+        await server.monitor_task
+    return stream
+
+
+def count_frames(sock, controller, counter):
+    """接收端：读取完整消息并计数"""
+    reader = controller.MessageReader(sock)
+    try:
+        while True:
+            _, msg_type, _, payload = reader.read_message()
+            if msg_type in (controller.MSG_IMAGE, controller.MSG_TILES):
+                reader.release_frame(payload)
+            counter[0] += 1
+    except (EOFError, OSError):
+        pass
+
+
+def run_stream(controller, server, stream):
+    """运行 PIPELINE_SECONDS 秒屏幕流，返回接收端帧率"""
+    sender, receiver = loopback_pair()
+    counter = [0]
+    thread = threading.Thread(target=count_frames, args=(receiver, controller, counter), daemon=True)
+    thread.start()
+
+    async def run():
+        _, writer = await asyncio.open_connection(sock=sender)
+        task = asyncio.ensure_future(stream(writer))
+        await asyncio.sleep(PIPELINE_SECONDS)
+        server.stop_screen_stream()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        writer.transport.abort()
+    asyncio.run(run())
+    thread.join()
+    receiver.close()
+    return counter[0] / PIPELINE_SECONDS
+
+
+def bench_pipeline():
+    agent = load_module("client", "client2.1.py")
+    controller = load_module("remocon", "RemoCon2.1.py")
+    # 比较的是每帧都编码时的吞吐量，关闭静止画面检测（合成画面大部分时间不变）
+    agent.STATIC_CHECK = False
+    print(f"模拟捕获耗时 {CAPTURE_COST * 1000:.0f}ms，CPU 核数 {os.cpu_count()}")
+    print(f"{'分辨率':<12}{'串行 FPS':>10}{'流水线 FPS':>12}{'捕获 ms':>10}{'编码 ms':>10}{'发送 ms':>10}{'上限 FPS':>10}")
+
+    class SimulatedCapture(agent.SyntheticCapture):
+        """在合成画面上模拟真实捕获的耗时"""
+
+        def grab(self, display=0):
+            time.sleep(CAPTURE_COST)
+            return super().grab(display)
+
+    for width, height in FRAME_SIZES:
+        server = make_stream_agent(agent, width, height, SimulatedCapture(1920, 1080, scene="static"))
+
+        async def serial_stream(writer):
+            # 旧版 capture_and_send_screen：一帧的捕获、编码、发送依次完成后才开始下一帧
+            loop = asyncio.get_running_loop()
+            layer = agent.StreamLayer((width, height, 100, 50, False, agent.CODEC_JPEG, None, 0))
+            while server.monitoring:
+                screenshot = await loop.run_in_executor(server.capture_executor, server.capture_backend.grab)
+                message = await loop.run_in_executor(server.capture_executor, server.encode_screen_frame,
+                                                     screenshot, layer)
+                writer.write(message)
+                await writer.drain()
+
+        serial_fps = run_stream(controller, server, serial_stream)
+        server.monitoring = True
+        pipeline_fps = run_stream(controller, server, subscribe_stream(server, stream_params(width, height)))
+        stages = [server.pipeline_stats[stage] for stage in ("捕获", "编码", "发送")]
+        averages = [stats.total / stats.count * 1000 if stats.count else 0 for stats in stages]
+        print(f"{f'{width}x{height}':<12}{serial_fps:>10.1f}{pipeline_fps:>12.1f}"
+              + "".join(f"{average:>10.1f}" for average in averages)
+              + f"{1000 / max(averages):>10.1f}")
+
+
+def bench_capture():
+    agent = load_module("client", "client2.1.py")
+    backends = [(name, backend_class) for name, backend_class in agent.CAPTURE_BACKENDS.items()
+                if name != agent.SyntheticCapture.name]
+    for scene in agent.SyntheticCapture.SCENES:
+        backends.append((f"synthetic:{scene}", lambda scene=scene: agent.SyntheticCapture(scene=scene)))
+    count = 30
+
+    print(f"{'捕获方式':<20}{'画面':>12}{'ms/帧':>10}")
+    for name, factory in backends:
+        try:
+            if hasattr(factory, "available") and not factory.available():
+                raise RuntimeError("缺少依赖")
+            backend = factory()
+            frame = backend.grab()
+            start = time.perf_counter()
+            for _ in range(count):
+                backend.grab()
+            elapsed = (time.perf_counter() - start) / count
+            backend.close()
+        except Exception as e:
+            print(f"{name:<20}{'不可用':>12}  {str(e)[:60]}")
+            continue
+        print(f"{name:<20}{f'{frame.width}x{frame.height}':>12}{elapsed * 1000:>10.2f}")
+
+
+def bench_resize():
+    agent = load_module("client", "client2.1.py")
+    controller = load_module("remocon", "RemoCon2.1.py")
+    source = make_desktop_image(1920, 1080)
+    sizes = controller.RESOLUTION_PRESETS
+    strategies = [
+        ("NEAREST", dict(resample=Image.NEAREST)),
+        ("BOX", dict(resample=Image.BOX)),
+        ("BOX gap=2", dict(resample=Image.BOX, reducing_gap=2.0)),  # 推流默认使用的方式
+        ("BILINEAR", dict(resample=Image.BILINEAR)),
+        ("BILINEAR gap=2", dict(resample=Image.BILINEAR, reducing_gap=2.0)),
+        ("BICUBIC", dict(resample=Image.BICUBIC)),
+        ("LANCZOS", dict(resample=Image.LANCZOS)),
+        ("LANCZOS gap=2", dict(resample=Image.LANCZOS, reducing_gap=2.0)),
+    ]
+    count = 10
+
+    print(f"源画面 1920x1080，单位 ms/帧；推流缩放方式: {Image.Resampling(agent.STREAM_RESAMPLE).name}, "
+          f"reducing_gap={agent.STREAM_REDUCING_GAP}")
+    print(f"{'缩放方式':<16}" + "".join(f"{f'{w}x{h}':>11}" for w, h in sizes))
+
+    def timed(func):
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        return (time.perf_counter() - start) / count * 1000
+
+    for name, options in strategies:
+        row = [timed(lambda size=size: source.resize(size, **options)) for size in sizes]
+        print(f"{name:<16}" + "".join(f"{value:>11.2f}" for value in row))
+    # 推流实际使用的 resize_frame（尺寸相同时跳过、整数倍时用 reduce）
+    row = [timed(lambda size=size: agent.resize_frame(source, size)) for size in sizes]
+    print(f"{'resize_frame':<16}" + "".join(f"{value:>11.2f}" for value in row))
+
+
+SIMULCAST_FPS = 10
+SIMULCAST_CASES = [
+    ("1个全尺寸", [(1280, 720)]),
+    ("3个全尺寸", [(1280, 720)] * 3),
+    ("缩略图+全尺寸", [(320, 180), (1280, 720)]),
+    ("4个缩略图+全尺寸", [(320, 180)] * 4 + [(1280, 720)]),
+]
+
+
+def bench_simulcast():
+    agent = load_module("client", "client2.1.py")
+    controller = load_module("remocon", "RemoCon2.1.py")
+    print(f"合成画面 1920x1080，每个连接 {SIMULCAST_FPS}FPS，运行 {PIPELINE_SECONDS} 秒")
+    print(f"{'连接':<16}{'捕获次数':>10}{'编码次数':>10}{'编码层':>8}  各连接 FPS")
+    for name, sizes in SIMULCAST_CASES:
+        server = make_stream_agent(agent, 1920, 1080, agent.SyntheticCapture(1920, 1080, scene="scroll"))
+        pairs = [loopback_pair() for _ in sizes]
+        counters = [[0] for _ in sizes]
+        threads = [threading.Thread(target=count_frames, args=(receiver, controller, counter), daemon=True)
+                   for (_, receiver), counter in zip(pairs, counters)]
+        for thread in threads:
+            thread.start()
+
+        async def run():
+            writers = []
+            for (sender, _), (width, height) in zip(pairs, sizes):
+                _, writer = await asyncio.open_connection(sock=sender)
+                server.add_screen_subscriber(writer, stream_params(width, height, fps=SIMULCAST_FPS))
+                writers.append(writer)
+            await asyncio.sleep(PIPELINE_SECONDS)
+            layers = len(server.layers)
+            server.stop_screen_stream()
+            await asyncio.sleep(0)
+            for writer in writers:
+                writer.transport.abort()
+            return layers
+        layers = asyncio.run(run())
+        for thread in threads:
+            thread.join()
+        for _, receiver in pairs:
+            receiver.close()
+        rates = "/".join(f"{counter[0] / PIPELINE_SECONDS:.1f}" for counter in counters)
+        print(f"{name:<16}{server.pipeline_stats['捕获'].count:>10}{server.pipeline_stats['编码'].count:>10}"
+              f"{layers:>8}  {rates}")
+
+
+CODEC_FRAMES = 50
+CODEC_FPS = 10
+CODEC_SIZES = [(1280, 720), (1920, 1080)]  # 缩放后（文字边缘出现过渡色）和原始分辨率
+CODEC_ERROR_SAMPLE = 10  # 每隔几帧解码一次完整画面，统计与原画面的平均误差
+
+
+def decode_error(agent, message, frame):
+    """解码完整画面消息，返回与原画面逐像素的平均绝对误差；不是 JPEG/PNG 完整画面时返回 None"""
+    import numpy as np
+    offset = agent.MESSAGE_HEADER.size
+    codec = message[offset + 1]
+    if message[1] != agent.MSG_IMAGE or codec not in (agent.CODEC_JPEG, agent.CODEC_PNG):
+        return None
+    image = Image.open(io.BytesIO(bytes(message[offset + agent.FRAME_HEADER.size:]))).convert('RGB')
+    return float(np.abs(np.asarray(image, dtype=np.int16) - np.asarray(frame, dtype=np.int16)).mean())
+
+
+def bench_codec():
+    agent = load_module("client", "client2.1.py")
+    # (名称, 增量传输, 编码方式, 按内容选择 PNG)
+    modes = [
+        ("JPEG", False, agent.CODEC_JPEG, False),
+        ("JPEG/PNG", False, agent.CODEC_JPEG, True),
+        ("JPEG增量", True, agent.CODEC_JPEG, False),
+        ("JPEG/PNG增量", True, agent.CODEC_JPEG, True),
+    ]
+    if agent.H264_AVAILABLE:
+        modes.append(("H.264", False, agent.CODEC_H264, False))
+    else:
+        print("未安装 PyAV 或不支持 libx264，跳过 H.264")
+    print(f"合成画面 1920x1080，质量 50，每种组合编码 {CODEC_FRAMES} 帧，码率按 {CODEC_FPS}FPS 计算；"
+          f"误差为完整画面解码后与原画面的平均像素差")
+    print(f"{'分辨率':<12}{'场景':<8}{'编码方式':<14}{'码率 KB/s':>12}{'最大帧 KB':>12}{'CPU ms/帧':>12}{'误差':>8}")
+    for scene in agent.SyntheticCapture.SCENES:
+        capture = agent.SyntheticCapture(1920, 1080, scene=scene)
+        frames = [capture.grab() for _ in range(CODEC_FRAMES)]
+        for width, height in CODEC_SIZES:
+            for name, delta, codec, content in modes:
+                server = make_stream_agent(agent, 1920, 1080, capture)
+                layer = agent.StreamLayer((width, height, CODEC_FPS, 50, delta, codec, None, 0))
+                agent.CONTENT_CODEC = content
+                sizes = []
+                errors = []
+                cpu = 0.0
+                for index, frame in enumerate(frames):
+                    start = time.process_time()  # 含 libx264 等编码线程的 CPU 时间
+                    message = server.encode_screen_frame(frame, layer)
+                    cpu += time.process_time() - start
+                    sizes.append(len(message) if message is not None else 0)
+                    if message is not None and index % CODEC_ERROR_SAMPLE == 0:
+                        error = decode_error(agent, message, agent.resize_frame(frame, (width, height)))
+                        if error is not None:
+                            errors.append(error)
+                rate = sum(sizes) / CODEC_FRAMES * CODEC_FPS / 1024
+                error = f"{sum(errors) / len(errors):.2f}" if errors else "-"
+                print(f"{f'{width}x{height}':<12}{scene:<8}{name:<14}{rate:>12.1f}{max(sizes) / 1024:>12.1f}"
+                      f"{cpu / CODEC_FRAMES * 1000:>12.1f}{error:>8}")
+
+
+JPEG_FRAMES = 50
+
+
+def bench_jpeg():
+    agent = load_module("client", "client2.1.py")
+    import numpy as np
+    encoders = [name for name, encoder in agent.JPEG_ENCODERS.items() if encoder.available()]
+    missing = [name for name in agent.JPEG_ENCODERS if name not in encoders]
+    if missing:
+        print(f"不可用: {', '.join(missing)}")
+    print(f"质量 50，每项编码 {JPEG_FRAMES} 帧；输入为 RGB 像素数组时省去图像对象转换")
+    print(f"{'分辨率':<12}{'编码方式':<24}{'输入':<8}{'ms/帧':>8}{'KB/帧':>8}")
+    for width, height in FRAME_SIZES:
+        image = make_desktop_image(width, height)
+        pixels = np.asarray(image)
+
+        def run(encode):
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            for _ in range(JPEG_FRAMES):
+                buffer.seek(0)
+                buffer.truncate()
+                encode(buffer)
+            return (time.perf_counter() - start) / JPEG_FRAMES * 1000, buffer.tell() / 1024
+
+        # 改动前的编码方式：每帧额外一遍霍夫曼表优化
+        cost, size = run(lambda buffer: image.save(buffer, format='JPEG', quality=50, optimize=True))
+        print(f"{f'{width}x{height}':<12}{'pillow optimize':<24}{'图像':<8}{cost:>8.2f}{size:>8.1f}")
+        for name in encoders:
+            for subsampling in agent.JPEG_SUBSAMPLINGS:
+                encoder = agent.create_jpeg_encoder(name, subsampling)
+                inputs = [("图像", image)] + ([("数组", pixels)] if encoder.raw_input else [])
+                for label, source in inputs:
+                    cost, size = run(lambda buffer: encoder.write(buffer, source, 50))
+                    print(f"{f'{width}x{height}':<12}{f'{name} {subsampling}':<24}{label:<8}{cost:>8.2f}{size:>8.1f}")
+
+
+STATIC_SECONDS = 10  # 超过 STATIC_IDLE_AFTER，包含降低捕获频率后的阶段
+STATIC_FPS = 10
+
+
+def count_bytes(sock, controller, counter):
+    """接收端：读取完整消息，统计消息数和负载字节数"""
+    reader = controller.MessageReader(sock)
+    try:
+        while True:
+            _, msg_type, _, payload = reader.read_message()
+            counter[0] += 1
+            counter[1] += len(payload)
+            if msg_type in (controller.MSG_IMAGE, controller.MSG_TILES):
+                reader.release_frame(payload)
+    except (EOFError, OSError):
+        pass
+
+
+def bench_static():
+    agent = load_module("client", "client2.1.py")
+    controller = load_module("remocon", "RemoCon2.1.py")
+
+    class FrozenCapture(agent.SyntheticCapture):
+        """完全不变的桌面（连时钟也不走）"""
+
+        def grab(self, display=0):
+            self.frame_index = 0
+            return super().grab(display)
+
+    scenes = [
+        ("静止", lambda: FrozenCapture(scene="static")),
+        ("时钟", lambda: agent.SyntheticCapture(scene="static")),
+        ("滚动", lambda: agent.SyntheticCapture(scene="scroll")),
+    ]
+    static_check = agent.STATIC_CHECK
+    print(f"合成画面 1920x1080，{STATIC_FPS}FPS，运行 {STATIC_SECONDS} 秒；CPU 为被控端进程占用单核的比例")
+    print(f"{'画面':<8}{'静止检测':<10}{'捕获次数':>10}{'编码次数':>10}{'消息数':>8}{'KB/s':>10}{'CPU':>8}")
+    for name, factory in scenes:
+        for enabled in (False, True):
+            agent.STATIC_CHECK = enabled
+            server = make_stream_agent(agent, 1920, 1080, factory())
+            sender, receiver = loopback_pair()
+            counter = [0, 0]
+            thread = threading.Thread(target=count_bytes, args=(receiver, controller, counter), daemon=True)
+            thread.start()
+
+            async def run():
+                _, writer = await asyncio.open_connection(sock=sender)
+                server.add_screen_subscriber(writer, stream_params(1920, 1080, fps=STATIC_FPS))
+                await asyncio.sleep(STATIC_SECONDS)
+                server.stop_screen_stream()
+                await asyncio.sleep(0)
+                writer.transport.abort()
+            # 接收线程也在本进程内，CPU 占用包含接收端读取消息的开销
+            cpu_start = time.process_time()
+            asyncio.run(run())
+            cpu = (time.process_time() - cpu_start) / STATIC_SECONDS
+            thread.join()
+            receiver.close()
+            print(f"{name:<8}{'开' if enabled else '关':<10}{server.pipeline_stats['捕获'].count:>10}"
+                  f"{server.pipeline_stats['编码'].count:>10}{counter[0]:>8}"
+                  f"{counter[1] / 1024 / STATIC_SECONDS:>10.1f}{cpu:>8.0%}")
+    agent.STATIC_CHECK = static_check
+
+
+RECORD_FRAMES = 300
+RECORD_STILL_EVERY = 3  # 每隔几帧重复一次上一帧画面，被控端对没有变化的画面发送心跳
+RECORD_SEEKS = 50
+
+
+def bench_record():
+    agent = load_module("client", "client2.1.py")
+    controller = load_module("remocon", "RemoCon2.1.py")
+    import numpy as np
+    capture = agent.SyntheticCapture(1920, 1080, scene="scroll")
+    server = make_stream_agent(agent, 1920, 1080, capture)
+    layer = agent.StreamLayer((1280, 720, 10, 50, True, agent.CODEC_JPEG, None, 0))
+    directory = tempfile.mkdtemp(prefix="remocon-record-")
+    recorder = controller.ScreenRecorder(directory)
+    # 按被控端发送顺序生成消息：心跳也占用序号，录像不能把心跳后的增量画面当成缺帧丢弃
+    expected = []  # 每条写入录像的画面对应的原画面
+    frame = None
+    heartbeats = 0
+    for index in range(RECORD_FRAMES):
+        if frame is None or index % RECORD_STILL_EVERY:
+            frame = capture.grab()
+        message = server.encode_screen_frame(frame, layer)
+        if message is None:
+            message = agent.encode_heartbeat_message()
+            heartbeats += 1
+        else:
+            expected.append(agent.resize_frame(frame, (layer.width, layer.height)))
+        agent.stamp_frame_header(message, index + 1, time.time(), 0, 0)
+        payload = memoryview(message)[agent.MESSAGE_HEADER.size:]
+        recorder.add(message[1], payload, index / 10)
+    recorder.close()
+    print(f"增量画面 1280x720，{RECORD_FRAMES} 条消息（含 {heartbeats} 个心跳）："
+          f"录制 {recorder.frames} 帧，丢弃 {recorder.dropped} 帧，{recorder.bytes / 1024:.0f} KB")
+    try:
+        if recorder.error is not None:
+            raise SystemExit(f"录像写盘失败: {recorder.error}")
+        if recorder.dropped or recorder.frames != len(expected):
+            raise SystemExit(f"录像缺帧：应录制 {len(expected)} 帧")
+        player = controller.RecordingPlayer(directory)
+        errors = []
+        for number in range(player.count):
+            image = player.frame_at(number)
+            errors.append(float(np.abs(np.asarray(image, dtype=np.int16)
+                                       - np.asarray(expected[number], dtype=np.int16)).mean()))
+        print(f"顺序回放 {player.count} 帧，与原画面的平均像素差最大 {max(errors):.2f}")
+        player.close()
+        # 随机定位：每次都从最近的完整画面重新解码到目标帧
+        player = controller.RecordingPlayer(directory)
+        costs = []
+        for _ in range(RECORD_SEEKS):
+            number = player.find(random.uniform(0, player.duration))
+            player.position = None
+            start = time.perf_counter()
+            player.frame_at(number)
+            costs.append((time.perf_counter() - start) * 1000)
+        player.close()
+        print(f"随机定位 {RECORD_SEEKS} 次：平均 {sum(costs) / len(costs):.1f} ms，最长 {max(costs):.1f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+BENCHMARKS = {
+    "recv": bench_recv,
+    "send": bench_send,
+    "pipeline": bench_pipeline,
+    "capture": bench_capture,
+    "resize": bench_resize,
+    "simulcast": bench_simulcast,
+    "codec": bench_codec,
+    "jpeg": bench_jpeg,
+    "static": bench_static,
+    "record": bench_record,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"未知测试: {name}，可选: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
@@ -1,20 +1,49 @@
-import socket
 import os
 import sys
 import time
 import threading
 import ctypes
 import subprocess
-import winreg
+try:
+    import winreg
+except ImportError:  # 非 Windows 系统（如在 Linux 上运行性能测试）没有注册表
+    winreg = None
 from datetime import datetime
 import psutil
 import tkinter as tk
 from tkinter import messagebox
 import queue
+import asyncio
+import concurrent.futures
 import traceback
 import getpass
-from PIL import ImageGrab, Image  # 用于屏幕捕获
+from PIL import ImageGrab, Image, ImageDraw  # 用于屏幕捕获
 import io
+import random
+import struct
+import abc
+try:
+    import mss  # 可选的快速屏幕捕获（直接读取原始像素缓冲区）
+except ImportError:
+    mss = None
+try:
+    import numpy as np  # 增量传输时比较画面块
+except ImportError:  # 没有 NumPy 时只能发送完整画面
+    np = None
+try:
+    import av  # 可选的 H.264 视频编码（PyAV/libav）
+except ImportError:  # 没有 PyAV 时使用 JPEG 编码
+    av = None
+try:
+    import turbojpeg  # 可选的 libjpeg-turbo 绑定（PyTurboJPEG，需要 libturbojpeg 动态库）
+except ImportError:
+    turbojpeg = None
+try:
+    import simplejpeg  # 可选的 libjpeg-turbo 绑定（安装包自带 libjpeg-turbo）
+except ImportError:
+    simplejpeg = None
+from fractions import Fraction
+import inspect
 
 # 修复 ctypes.wintypes 缺失问题
 if not hasattr(ctypes, 'wintypes'):
@@ -43,8 +72,844 @@ MONITOR_INTERVAL = 2  # 进程监控间隔（秒）
 NORMAL_EXIT_FILE = "normal_exit.tmp"   # 正常退出标记文件
 MONITOR_LOCK_FILE = "monitor_lock.tmp"  # 监控进程锁文件
 MESSAGE_SEPARATOR = "|||__SEP__|||"
-IMAGE_MAGIC_NUMBER = b"IMGB"  # 图像数据开头的魔术数字，用于识别
 MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 最大图像大小限制（10MB）
+RECV_BUFFER_SIZE = 64 * 1024  # 单次接收缓冲区大小
+FILE_CHUNK_SIZE = 64 * 1024  # 文件数据块大小
+
+# 消息帧格式（与 RemoCon2.1.py 保持一致）：
+# 通道(1字节) + 类型(1字节) + 请求ID(4字节) + 负载长度(4字节) + 负载，整数均为大端
+# 回复携带与请求相同的请求ID，主动推送的数据（如屏幕画面）请求ID为0
+MESSAGE_HEADER = struct.Struct("!BBII")
+
+# 逻辑通道：同一连接上的控制、命令输出、屏幕画面和文件数据互不阻塞，回复沿请求所在通道返回
+CHANNEL_CONTROL = 0
+CHANNEL_OUTPUT = 1
+CHANNEL_SCREEN = 2
+CHANNEL_FILE = 3
+
+MSG_COMMAND = 0x01     # 系统命令
+MSG_CONTROL = 0x02     # 控制命令（__START_MONITOR__ 等）
+MSG_TEXT = 0x03        # 文本回复
+MSG_IMAGE = 0x04       # 屏幕图像数据
+MSG_FILE_BEGIN = 0x05  # 文件传输开始（文件名|文件大小）
+MSG_FILE_DATA = 0x06   # 文件数据块
+MSG_FILE_END = 0x07    # 文件传输结束
+MSG_TILES = 0x08       # 屏幕增量画面（仅包含变化的块）
+MAX_MESSAGE_SIZE = MAX_IMAGE_SIZE + 1024  # 单条消息最大长度
+
+# 画面头（与 RemoCon2.1.py 保持一致），位于 MSG_IMAGE / MSG_TILES 负载开头：
+# 版本(1字节) + 编码方式(1字节) + 序号(4字节) + 捕获时间(8字节) + 发送时间(8字节)
+# + 捕获耗时(4字节，微秒) + 编码耗时(4字节，微秒)；时间为被控端时钟的 Unix 时间戳
+FRAME_HEADER = struct.Struct("!BBIddII")
+FRAME_VERSION = 1
+CODEC_NONE = 0  # 心跳：画面没有变化，只有画面头，没有图像数据
+CODEC_JPEG = 1
+CODEC_H264 = 2  # H.264 帧间编码，负载为 Annex B 格式的一帧码流
+CODEC_PNG = 3  # 调色板 PNG，用于文字、表格等颜色少的画面
+CODEC_MIXED = 4  # 增量画面：每块各自选择编码方式，见块头
+
+# 增量画面负载（与 RemoCon2.1.py 保持一致），位于画面头之后：
+# 画面宽(2字节) + 画面高(2字节) + 块数(2字节)，随后每块为 x, y, 宽, 高(各2字节) + 编码方式(1字节)
+# + 数据长度(4字节) + 数据
+TILES_HEADER = struct.Struct("!HHH")
+TILE_HEADER = struct.Struct("!HHHHBI")
+TILE_SIZE = 64  # 比较画面变化的块大小（像素）
+KEYFRAME_INTERVAL = 10  # 增量模式下发送完整画面的间隔（秒）
+DELTA_MAX_RATIO = 0.5  # 变化块超过此比例时直接发送完整画面
+
+# 屏幕流自适应调整：网络或主控端跟不上时依次降低质量、分辨率、帧率，恢复后按相反顺序提升
+MIN_STREAM_QUALITY = 20
+MIN_STREAM_SCALE = 0.5  # 分辨率最低降到设定值的一半
+MIN_STREAM_FPS = 2
+QUALITY_STEP = 10
+SCALE_STEP = 0.125
+ADAPT_DOWN_INTERVAL = 1.0  # 两次降级之间至少间隔（秒），等待上次调整生效
+ADAPT_UP_INTERVAL = 3.0    # 持续通畅多久后才提升一级（秒）
+SEND_BACKLOG_LIMIT = 256 * 1024  # 发送缓冲积压超过此值视为拥塞
+
+# 屏幕捕获后端：auto 在可用的真实捕获方式中选择最快的；synthetic 生成可重复的测试画面，
+# 可用 synthetic:scroll / synthetic:video / synthetic:static 指定场景（用于无桌面环境的性能测试）
+CAPTURE_BACKEND = os.environ.get("REMOCON_CAPTURE", "auto")
+CAPTURE_PROBE_FRAMES = 3  # 自动选择时每种方式试捕获的帧数
+
+# 推流画面的缩放方式，依据 python benchmark.py resize 的结果选择：
+# 1080p 缩到各预设分辨率时 BOX（按面积平均，缩小文字不易产生锯齿）约为 LANCZOS 耗时的三分之一，
+# 也略快于 BILINEAR；经 JPEG 压缩后画质差别不明显
+STREAM_RESAMPLE = Image.BOX
+STREAM_REDUCING_GAP = 2.0  # 先用 reduce 按整数倍缩小到目标的两倍以内，再做插值缩放
+
+# 区域传输：只传输屏幕上的一块区域（框选或某个窗口），先裁剪再缩放，区域不大时按原始像素传输
+MIN_REGION_SIZE = 32  # 区域的最小边长（像素）
+
+# JPEG 编码方式：auto 试编码几帧，选择本机上最快的；也可用 python benchmark.py jpeg
+# 比较各方式的耗时后通过环境变量指定（turbojpeg / simplejpeg / pillow）
+JPEG_ENCODER = os.environ.get("REMOCON_JPEG", "auto")
+JPEG_PROBE_FRAMES = 3
+JPEG_SUBSAMPLING = os.environ.get("REMOCON_JPEG_SUBSAMPLING", "420")  # 色度抽样：444 画质最好，420 最小最快
+JPEG_SUBSAMPLINGS = ("444", "422", "420")
+
+# 按内容选择编码：颜色不超过 PALETTE_MAX_COLORS 种的区域（文字、表格、终端等界面）用调色板 PNG，
+# 比 JPEG 清晰且通常更小；颜色多的区域（照片、视频）仍用 JPEG。设置 REMOCON_CONTENT_CODEC=0 时全部使用 JPEG
+CONTENT_CODEC = os.environ.get("REMOCON_CONTENT_CODEC", "1") != "0"
+PALETTE_MAX_COLORS = 256
+PNG_COMPRESS_LEVEL = 1  # 实时画面优先压缩速度
+
+# H.264 视频编码（需要 PyAV）：只用 CPU，按低延迟设置编码，每帧立即输出、不使用B帧
+H264_ENCODER = "libx264"
+H264_OPTIONS = {"preset": "ultrafast", "tune": "zerolatency"}
+H264_AVAILABLE = av is not None and H264_ENCODER in av.codecs_available
+
+# 屏幕流水线：捕获、编码、发送三段之间的队列长度（满时丢弃最旧的一项）
+PIPELINE_QUEUE_SIZE = 2
+PIPELINE_STATS_INTERVAL = 30  # 记录各阶段耗时统计的间隔（秒）
+DEADLINE_SLACK = 0.1  # 捕获比编码层的截止时间提前不超过其帧间隔的此比例时仍视为到期（捕获时刻有抖动）
+
+# 静止画面检测：捕获后按固定步长取样比较，画面没有变化时不缩放、不编码，只定期发送心跳。
+# 设置 REMOCON_STATIC_CHECK=0 时每帧都编码
+STATIC_CHECK = os.environ.get("REMOCON_STATIC_CHECK", "1") != "0"
+STATIC_CHECK_STRIDE = 4  # 取样间隔（像素），1080p 每帧约 13 万个取样点
+STATIC_REFRESH_INTERVAL = 5  # 画面看似不变时仍每隔若干秒编码一次，补上取样漏掉的细小变化（秒）
+STATIC_IDLE_AFTER = 3  # 画面连续不变超过此时间后降低捕获频率（秒）
+STATIC_IDLE_INTERVAL = 0.5  # 画面静止时的捕获间隔（秒）
+STREAM_HEARTBEAT_INTERVAL = 1  # 没有画面可发送时的心跳间隔（秒）；主控端看不到画面时也只发送心跳
+
+
+def pack_message(channel, msg_type, payload=b"", request_id=0):
+    """按帧格式打包一条消息"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    return MESSAGE_HEADER.pack(channel, msg_type, request_id, len(payload)) + payload
+
+
+class JpegEncoder(abc.ABC):
+    """JPEG 编码方式的基类
+
+    write() 把一幅图像编码后写入输出流。实时画面不使用 optimize：
+    每帧多一遍霍夫曼表优化，耗时增加而体积只小几个百分点。
+    """
+
+    name = None
+    raw_input = False  # 能否直接编码 高x宽x3 的 RGB 像素数组（无需转换为图像对象）
+
+    def __init__(self, subsampling=JPEG_SUBSAMPLING):
+        if subsampling not in JPEG_SUBSAMPLINGS:
+            raise ValueError(f"未知的色度抽样方式: {subsampling}，可选: {', '.join(JPEG_SUBSAMPLINGS)}")
+        self.subsampling = subsampling
+
+    @classmethod
+    def available(cls):
+        return True
+
+    @abc.abstractmethod
+    def write(self, stream, image, quality):
+        """编码 image（PIL 图像，raw_input 为真时也可以是 RGB 像素数组）并写入 stream"""
+
+
+class PillowJpegEncoder(JpegEncoder):
+    """Pillow 编码，总是可用"""
+
+    name = "pillow"
+    SUBSAMPLING = {"444": 0, "422": 1, "420": 2}
+
+    def write(self, stream, image, quality):
+        image.save(stream, format='JPEG', quality=quality, subsampling=self.SUBSAMPLING[self.subsampling])
+
+
+class TurboJpegEncoder(JpegEncoder):
+    """PyTurboJPEG 编码：直接压缩 RGB 像素缓冲区
+
+    压缩结果写入复用的输出缓冲区，不必每帧由库分配、释放内存；
+    TurboJPEG 实例在编码线程中首次使用时创建。
+    """
+
+    name = "turbojpeg"
+    raw_input = True
+
+    def __init__(self, subsampling=JPEG_SUBSAMPLING):
+        super().__init__(subsampling)
+        self.jpeg = None
+        self.output = bytearray()
+        # 较早版本的 encode() 不支持 dst 参数，只能使用库返回的数据
+        self.reuse_output = "dst" in inspect.signature(turbojpeg.TurboJPEG.encode).parameters
+
+    @classmethod
+    def available(cls):
+        if turbojpeg is None or np is None:
+            return False
+        try:
+            turbojpeg.TurboJPEG()
+        except (OSError, RuntimeError):  # 找不到 libturbojpeg 动态库
+            return False
+        return True
+
+    def write(self, stream, image, quality):
+        if self.jpeg is None:
+            self.jpeg = turbojpeg.TurboJPEG()
+        pixels = image if isinstance(image, np.ndarray) else np.asarray(image)
+        subsample = getattr(turbojpeg, f"TJSAMP_{self.subsampling}")
+        if not self.reuse_output:
+            stream.write(self.jpeg.encode(pixels, quality, turbojpeg.TJPF_RGB, subsample))
+            return
+        # 按最坏情况（4:4:4、宏块对齐）预留输出空间，只在画面变大时重新分配
+        height, width = pixels.shape[:2]
+        required = -(-width // 16) * 16 * -(-height // 16) * 16 * 6 + 2048
+        if len(self.output) < required:
+            self.output = bytearray(required)
+        _, size = self.jpeg.encode(pixels, quality, turbojpeg.TJPF_RGB, subsample, dst=self.output)
+        with memoryview(self.output) as view:
+            stream.write(view[:size])
+
+
+class SimpleJpegEncoder(JpegEncoder):
+    """simplejpeg 编码：直接压缩 RGB 像素缓冲区，安装包自带 libjpeg-turbo"""
+
+    name = "simplejpeg"
+    raw_input = True
+
+    @classmethod
+    def available(cls):
+        return simplejpeg is not None and np is not None
+
+    def write(self, stream, image, quality):
+        pixels = image if isinstance(image, np.ndarray) else np.asarray(image)
+        stream.write(simplejpeg.encode_jpeg(pixels, quality, colorspace='RGB',
+                                            colorsubsampling=self.subsampling, fastdct=True))
+
+
+JPEG_ENCODERS = {encoder.name: encoder for encoder in (TurboJpegEncoder, SimpleJpegEncoder, PillowJpegEncoder)}
+
+
+def create_jpeg_encoder(spec, subsampling=JPEG_SUBSAMPLING, log=print):
+    """按名称创建 JPEG 编码方式；auto 时用合成桌面试编码几帧，选择最快的
+
+    名称未知、不可用或色度抽样方式未知时抛出 ValueError。
+    """
+    if spec != "auto":
+        encoder_class = JPEG_ENCODERS.get(spec)
+        if encoder_class is None or not encoder_class.available():
+            raise ValueError(f"JPEG编码方式不可用: {spec}")
+        return encoder_class(subsampling)
+    
+    # 画面多以图像对象交给编码器，试编码也用图像对象，把转换为像素数组的耗时计算在内
+    probe = SyntheticCapture(1280, 720).grab()
+    best, best_time = None, None
+    for encoder_class in JPEG_ENCODERS.values():
+        if not encoder_class.available():
+            continue
+        encoder = encoder_class(subsampling)
+        try:
+            start = time.perf_counter()
+            for _ in range(JPEG_PROBE_FRAMES):
+                encoder.write(io.BytesIO(), probe, 50)
+            elapsed = (time.perf_counter() - start) / JPEG_PROBE_FRAMES
+        except Exception as e:
+            log(f"JPEG编码方式 {encoder.name} 不可用: {str(e)}")
+            continue
+        log(f"JPEG编码方式 {encoder.name}: {elapsed * 1000:.1f}ms/帧")
+        if best is None or elapsed < best_time:
+            best, best_time = encoder, elapsed
+    return best
+
+
+def write_palette_png(stream, image, colors):
+    """把颜色数不超过 256 的图像写为调色板 PNG，调色板取自图像本身的颜色（colors 为 getcolors 的结果）"""
+    palette = Image.new("P", (1, 1))
+    palette.putpalette([channel for _, color in colors for channel in color])
+    image.quantize(palette=palette, dither=Image.Dither.NONE).save(
+        stream, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+
+
+def write_region(stream, image, quality, encoder, pixels=None):
+    """按内容选择编码方式把一块画面写入 stream，返回所用的编码方式
+
+    颜色数用 getcolors 统计，超过上限时立即停止，照片、视频区域几乎不增加耗时。
+    pixels 为 image 的 RGB 像素数组，JPEG 编码方式支持时直接编码数组。
+    """
+    if CONTENT_CODEC:
+        colors = image.getcolors(PALETTE_MAX_COLORS)
+        if colors is not None:
+            write_palette_png(stream, image, colors)
+            return CODEC_PNG
+    encoder.write(stream, pixels if encoder.raw_input and pixels is not None else image, quality)
+    return CODEC_JPEG
+
+
+def encode_image_message(image, quality, channel=CHANNEL_SCREEN, encoder=None, pixels=None):
+    """按内容选择编码方式编码整幅画面，直接写在预留的消息头之后
+
+    返回 (整条消息的 memoryview, 负载长度)。消息头和图像数据位于同一块内存，
+    可以一次写出，无需拼接或分块切片。
+    """
+    encoder = encoder or PillowJpegEncoder()
+    buffer = io.BytesIO()
+    buffer.write(bytes(MESSAGE_HEADER.size + FRAME_HEADER.size))  # 预留消息头和画面头位置
+    codec = write_region(buffer, image, quality, encoder, pixels)
+    payload_length = buffer.tell() - MESSAGE_HEADER.size
+    message = buffer.getbuffer()
+    MESSAGE_HEADER.pack_into(message, 0, channel, MSG_IMAGE, 0, payload_length)
+    # 序号和时间在发送前填写
+    FRAME_HEADER.pack_into(message, MESSAGE_HEADER.size, FRAME_VERSION, codec, 0, 0, 0, 0, 0)
+    return message, payload_length
+
+
+def encode_video_message(data, channel=CHANNEL_SCREEN):
+    """把一帧 H.264 码流与消息头写入同一块内存，返回 (整条消息, 负载长度)"""
+    payload_length = FRAME_HEADER.size + len(data)
+    message = bytearray(MESSAGE_HEADER.size + payload_length)
+    MESSAGE_HEADER.pack_into(message, 0, channel, MSG_IMAGE, 0, payload_length)
+    FRAME_HEADER.pack_into(message, MESSAGE_HEADER.size, FRAME_VERSION, CODEC_H264, 0, 0, 0, 0, 0)
+    message[MESSAGE_HEADER.size + FRAME_HEADER.size:] = data
+    return message, payload_length
+
+
+def encode_heartbeat_message(channel=CHANNEL_SCREEN):
+    """画面没有变化时发送的心跳：只有画面头，让主控端知道画面流仍在正常工作"""
+    message = bytearray(MESSAGE_HEADER.size + FRAME_HEADER.size)
+    MESSAGE_HEADER.pack_into(message, 0, channel, MSG_IMAGE, 0, FRAME_HEADER.size)
+    FRAME_HEADER.pack_into(message, MESSAGE_HEADER.size, FRAME_VERSION, CODEC_NONE, 0, 0, 0, 0, 0)
+    return message
+
+
+def screen_fingerprint(image, stride=STATIC_CHECK_STRIDE):
+    """按步长取样得到画面的缩略数据，两帧取样相同即视为画面没有变化
+
+    最近邻缩小只读取样点的像素，不遍历整幅画面，1080p 约 0.5 毫秒。
+    """
+    width, height = image.size
+    return image.resize((max(1, width // stride), max(1, height // stride)), Image.NEAREST).tobytes()
+
+
+def h264_crf(quality):
+    """把 JPEG 质量（10-80）换算为 x264 的 CRF，质量越高 CRF 越低"""
+    return max(18, min(40, round(42 - quality * 0.3)))
+
+
+class H264Encoder:
+    """一个编码层的 H.264 编码器（只在编码线程中使用）"""
+
+    def __init__(self, width, height, fps, quality):
+        context = av.CodecContext.create(H264_ENCODER, "w")
+        context.width = width
+        context.height = height
+        context.pix_fmt = "yuv420p"
+        context.time_base = Fraction(1, fps)
+        context.framerate = fps
+        context.gop_size = fps * KEYFRAME_INTERVAL  # 与增量传输相同，定期发送完整画面
+        context.options = dict(H264_OPTIONS, crf=str(h264_crf(quality)))
+        self.context = context
+        self.pts = 0
+
+    def encode(self, image, keyframe=False):
+        """编码一帧，返回该帧的码流（可能为空）"""
+        frame = av.VideoFrame.from_image(image)
+        frame.pts = self.pts
+        self.pts += 1
+        if keyframe:
+            frame.pict_type = av.video.frame.PictureType.I
+        return b"".join(bytes(packet) for packet in self.context.encode(frame))
+
+
+def find_dirty_tiles(previous, current, tile_size=TILE_SIZE):
+    """比较两帧画面（形状为 高x宽x通道 的 uint8 数组），返回变化区域和变化块比例
+
+    变化区域为 [(x, y, 宽, 高), ...]，同一行中相邻的变化块合并为一个矩形，减少JPEG头开销。
+    """
+    height, width = current.shape[:2]
+    changed = (previous != current).any(axis=2)
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+    # 补齐到块大小的整数倍后按块归约，得到每个块是否有像素变化
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:height, :width] = changed
+    dirty = padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+    
+    rects = []
+    for row in range(rows):
+        y = row * tile_size
+        h = min(tile_size, height - y)
+        col = 0
+        while col < cols:
+            if not dirty[row, col]:
+                col += 1
+                continue
+            start = col
+            while col < cols and dirty[row, col]:
+                col += 1
+            x = start * tile_size
+            rects.append((x, y, min(col * tile_size, width) - x, h))
+    return rects, dirty.sum() / dirty.size
+
+
+def stamp_frame_header(message, seq, capture_time, capture_seconds, encode_seconds):
+    """发送前填写画面头中的序号、时间戳和各阶段耗时（编码方式已在编码时写入）"""
+    codec = message[MESSAGE_HEADER.size + 1]
+    FRAME_HEADER.pack_into(message, MESSAGE_HEADER.size, FRAME_VERSION, codec, seq, capture_time,
+                           time.time(), int(capture_seconds * 1e6), int(encode_seconds * 1e6))
+
+
+def encode_tiles_message(image, rects, quality, channel=CHANNEL_SCREEN, encoder=None, pixels=None):
+    """把变化区域逐块按内容选择编码方式，与消息头一起写入同一块内存
+
+    pixels 为 image 的 RGB 像素数组，JPEG 编码方式支持时直接编码数组切片。
+    返回 (整条消息的 memoryview, 负载长度)。
+    """
+    encoder = encoder or PillowJpegEncoder()
+    buffer = io.BytesIO()
+    buffer.write(bytes(MESSAGE_HEADER.size))  # 预留消息头位置
+    buffer.write(FRAME_HEADER.pack(FRAME_VERSION, CODEC_MIXED, 0, 0, 0, 0, 0))  # 序号和时间在发送前填写
+    buffer.write(TILES_HEADER.pack(image.width, image.height, len(rects)))
+    for x, y, w, h in rects:
+        tile_offset = buffer.tell()
+        buffer.write(bytes(TILE_HEADER.size))  # 预留块头位置
+        tile_pixels = pixels[y:y + h, x:x + w] if pixels is not None else None
+        codec = write_region(buffer, image.crop((x, y, x + w, y + h)), quality, encoder, tile_pixels)
+        tile_length = buffer.tell() - tile_offset - TILE_HEADER.size
+        with buffer.getbuffer() as view:  # 及时释放视图，之后才能继续写入
+            TILE_HEADER.pack_into(view, tile_offset, x, y, w, h, codec, tile_length)
+    payload_length = buffer.tell() - MESSAGE_HEADER.size
+    message = buffer.getbuffer()
+    MESSAGE_HEADER.pack_into(message, 0, channel, MSG_TILES, 0, payload_length)
+    return message, payload_length
+
+
+class StageStats:
+    """流水线单个阶段的耗时计数"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.dropped = 0  # 下游跟不上而丢弃的输出
+        self.late = 0  # 错过截止时间而跳过的帧
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def summary(self, name):
+        average = self.total / self.count * 1000 if self.count else 0
+        text = f"{name}: {self.count}次, 平均{average:.1f}ms, 最大{self.max * 1000:.1f}ms, 丢弃{self.dropped}"
+        return text + (f", 超时跳过{self.late}" if self.late else "")
+
+
+class StreamRateController:
+    """屏幕流闭环码率控制
+
+    每发送一帧后根据发送耗时和发送缓冲积压判断链路状态，并结合主控端定期回报的
+    丢帧数和解码耗时，在主控端设定的上限内调整JPEG质量、分辨率和帧率。
+    拥塞时立即降级（每秒最多一次），持续通畅后才逐级恢复，避免来回抖动。
+    """
+
+    def __init__(self, width, height, fps, quality):
+        # 主控端设定的参数即为上限
+        self.max_width = width
+        self.max_height = height
+        self.max_fps = fps
+        self.max_quality = quality
+        self.quality = quality
+        self.scale = 1.0
+        self.fps = fps
+        self.remote_congested = False  # 主控端回报丢帧或解码跟不上
+        self.last_change = time.monotonic()
+        self.clear_since = None  # 链路持续通畅的起始时间
+
+    @property
+    def interval(self):
+        return 1.0 / self.fps
+
+    def frame_size(self):
+        """当前发送的画面尺寸（保持宽高为偶数）"""
+        width = max(2, int(self.max_width * self.scale) // 2 * 2)
+        height = max(2, int(self.max_height * self.scale) // 2 * 2)
+        return width, height
+
+    def report_feedback(self, dropped, decode_ms):
+        """记录主控端回报的丢帧数和平均每帧处理耗时（毫秒）"""
+        self.remote_congested = dropped > 0 or decode_ms > self.interval * 1000
+
+    def update(self, send_time, backlog):
+        """每发送一帧后调用，返回参数是否有调整"""
+        now = time.monotonic()
+        interval = self.interval
+        congested = send_time > interval * 0.5 or backlog > SEND_BACKLOG_LIMIT or self.remote_congested
+        if congested:
+            self.clear_since = None
+            if now - self.last_change >= ADAPT_DOWN_INTERVAL:
+                self.remote_congested = False  # 回报已处理，等待下一次回报
+                return self.degrade(now)
+            return False
+        if send_time > interval * 0.2 or backlog:
+            self.clear_since = None  # 未拥塞但也不宽裕，保持现状
+            return False
+        if self.clear_since is None:
+            self.clear_since = now
+        elif now - self.clear_since >= ADAPT_UP_INTERVAL and now - self.last_change >= ADAPT_UP_INTERVAL:
+            self.clear_since = now
+            return self.upgrade(now)
+        return False
+
+    def degrade(self, now):
+        """降低一级：先降质量，再降分辨率，最后降帧率"""
+        if self.quality > MIN_STREAM_QUALITY:
+            self.quality = max(MIN_STREAM_QUALITY, self.quality - QUALITY_STEP)
+        elif self.scale > MIN_STREAM_SCALE:
+            self.scale = max(MIN_STREAM_SCALE, self.scale - SCALE_STEP)
+        elif self.fps > MIN_STREAM_FPS:
+            self.fps = max(MIN_STREAM_FPS, self.fps * 2 // 3)
+        else:
+            return False
+        self.last_change = now
+        return True
+
+    def upgrade(self, now):
+        """提升一级，顺序与降级相反"""
+        if self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps + max(1, self.fps // 2))
+        elif self.scale < 1.0:
+            self.scale = min(1.0, self.scale + SCALE_STEP)
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + QUALITY_STEP)
+        else:
+            return False
+        self.last_change = now
+        return True
+
+
+class StreamLayer:
+    """屏幕流的一个编码层
+
+    自适应调整后分辨率、帧率、质量、传输方式和编码方式都相同的连接共用一个层，
+    每帧只缩放、编码一次；增量传输的比较基准和视频编码器也按层保存。
+    """
+
+    def __init__(self, key):
+        self.width, self.height, self.fps, self.quality, self.delta_mode, self.codec, self.region, self.display = key
+        self.video_encoder = None  # H.264 编码器，第一帧时在编码线程中创建
+        self.previous_frame = None  # 上一次编码的画面（NumPy 数组），用于比较变化
+        self.last_keyframe_time = 0
+        self.force_keyframe = True
+        self.interval = 1.0 / self.fps
+        self.next_deadline = 0  # 下一帧的编码截止时间（单调时钟）
+        self.fingerprint = None  # 上一次编码的画面的取样数据，相同时跳过编码
+        self.last_encode_time = 0  # 上一次实际编码的捕获时间，用于静止画面的定期刷新
+        self.reduced_quality = None  # 画面超过大小限制时实际使用的质量
+
+    def due(self, clock):
+        """按本层帧率的截止时间判断捕获时刻为 clock（单调时钟）的这一帧是否需要编码
+
+        截止时间按固定帧间隔递推而不是从实际编码时刻算起，捕获时刻的抖动不会累积，
+        长期帧率与设定一致；落后超过一帧时跳过错过的帧，不连续补编。
+        """
+        if clock < self.next_deadline - self.interval * DEADLINE_SLACK:
+            return False
+        self.next_deadline += self.interval
+        if self.next_deadline <= clock:
+            self.next_deadline = clock + self.interval
+        return True
+
+
+class ScreenSubscriber:
+    """接收屏幕画面的一个连接，各自有监控参数、码率控制、画面序号和发送队列"""
+
+    def __init__(self, writer, params):
+        self.writer = writer
+        self.messages = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.send_task = None
+        self.frame_seq = 0  # 画面序号，每个连接单独编号
+        self.layer = None  # 上一帧所在编码层
+        self.last_sent_time = 0  # 上一次放入发送队列（画面或心跳）的捕获时间
+        self.visible = True  # 主控端的画面是否可见；不可见时不编码，只发送心跳
+        self.sent_frames = 0  # 上次统计以来发送的画面数（不含心跳），用于统计实际帧率
+        self.apply_params(params)
+
+    def apply_params(self, params):
+        """应用监控参数，并以新设定为上限重新开始自适应调整"""
+        self.params = params
+        self.delta_mode = params["delta"]
+        self.codec = params["codec"]
+        self.region = params["region"]
+        self.display = params["display"]
+        self.max_delay = params["delay"]  # 等待发送的画面超过此时间且已有更新的画面时跳过
+        self.force_keyframe = True
+        self.rate_controller = StreamRateController(params["width"], params["height"], params["fps"], params["quality"])
+
+    def layer_key(self):
+        """自适应调整后当前应使用的编码层"""
+        rate = self.rate_controller
+        width, height = rate.frame_size()
+        return width, height, rate.fps, rate.quality, self.delta_mode, self.codec, self.region, self.display
+
+
+def parse_region(text):
+    """解析画面区域参数 "x,y,宽,高"（占整个屏幕的比例），full 或空表示整个屏幕，格式无效时抛出 ValueError"""
+    if text in ("", "full"):
+        return None
+    try:
+        x, y, w, h = (float(value) for value in text.split(","))
+    except ValueError:
+        raise ValueError(f"画面区域格式错误: {text}") from None
+    if not (0 <= x < 1 and 0 <= y < 1 and w > 0 and h > 0):
+        raise ValueError(f"画面区域无效: {text}")
+    return x, y, min(w, 1 - x), min(h, 1 - y)
+
+
+def region_box(size, region):
+    """把画面区域换算为 (左, 上, 右, 下) 像素框，用于裁剪尺寸为 size 的画面"""
+    width, height = size
+    x, y, w, h = region
+    left, top = int(x * width), int(y * height)
+    return left, top, min(width, left + max(1, round(w * width))), min(height, top + max(1, round(h * height)))
+
+
+def resize_frame(image, size, resample=STREAM_RESAMPLE, reducing_gap=STREAM_REDUCING_GAP):
+    """把画面缩放到 size：尺寸相同时不处理，整数倍缩小时用 reduce（按块平均），其余按指定方式插值"""
+    if image.size == tuple(size):
+        return image
+    width, height = image.size
+    factor = width // size[0]
+    if factor > 1 and width == size[0] * factor and height == size[1] * factor:
+        return image.reduce(factor)
+    return image.resize(size, resample, reducing_gap=reducing_gap)
+
+
+class CaptureBackend(abc.ABC):
+    """屏幕捕获后端接口：grab(display) 返回一个显示器的一帧 RGB 画面（PIL Image），供缩放、编码、发送流水线使用
+
+    grab() 始终在同一个捕获线程中调用；displays() 可在任意线程中调用。
+    """
+
+    name = ""
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def screen_size(self):
+        """返回主显示器画面的 (宽, 高)"""
+        return self.grab().size
+
+    def displays(self):
+        """返回各显示器的 (左, 上, 宽, 高)，第一个为主显示器；只能捕获主显示器的后端只返回一项"""
+        return [(0, 0) + self.screen_size()]
+
+    @abc.abstractmethod
+    def grab(self, display=0):
+        """捕获第 display 个显示器的一帧画面"""
+
+    def close(self):
+        pass
+
+
+class ImageGrabCapture(CaptureBackend):
+    """PIL.ImageGrab 捕获（Windows 下为 GDI BitBlt）"""
+
+    name = "imagegrab"
+
+    def grab(self, display=0):
+        if display != 0:
+            raise ValueError("ImageGrab 只能捕获主显示器")
+        return ImageGrab.grab()
+
+
+class MssCapture(CaptureBackend):
+    """mss 捕获：直接读取 BGRA 原始缓冲区，通常比 ImageGrab 快
+
+    mss 实例不能跨线程使用，因此在捕获线程中首次调用 grab() 时才创建；displays() 发现显示器布局
+    变化（插拔显示器）后，捕获线程在下一次 grab() 时按新布局重建实例。
+    """
+
+    name = "mss"
+
+    def __init__(self):
+        self.sct = None
+        self.monitors = None  # 按显示器编号排列的 mss 显示器列表
+        self.layout_changed = False
+
+    @classmethod
+    def available(cls):
+        return mss is not None
+
+    @staticmethod
+    def ordered_monitors(sct):
+        """各显示器按编号排列：原点在 (0, 0) 的主显示器排第一，其余保持 mss 的顺序
+
+        mss 不保证 monitors[1] 是主显示器，而显示器 0 的分辨率和窗口、区域坐标都按主显示器计算。
+        displays() 和 grab() 都按这个顺序编号。
+        """
+        # monitors[0] 是所有显示器拼成的整个虚拟屏幕，不是单个显示器
+        return sorted(sct.monitors[1:], key=lambda monitor: (monitor["left"], monitor["top"]) != (0, 0))
+
+    def displays(self):
+        # 用临时实例读取显示器布局，不影响捕获线程中的实例；显示器插拔后再次调用即得到新布局
+        with mss.mss() as sct:
+            monitors = self.ordered_monitors(sct)
+        if self.monitors is not None and monitors != self.monitors:
+            self.layout_changed = True
+        return [(monitor["left"], monitor["top"], monitor["width"], monitor["height"]) for monitor in monitors]
+
+    def grab(self, display=0):
+        # mss 实例缓存创建时的显示器布局，布局变化或编号超出范围时重建一次
+        if self.sct is None or self.layout_changed or display >= len(self.monitors):
+            self.close()
+            self.layout_changed = False
+            self.sct = mss.mss()
+            self.monitors = self.ordered_monitors(self.sct)
+        if display >= len(self.monitors):
+            raise ValueError(f"显示器{display + 1}不存在")
+        shot = self.sct.grab(self.monitors[display])
+        return Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")
+
+    def close(self):
+        if self.sct is not None:
+            self.sct.close()
+            self.sct = None
+
+
+class SyntheticCapture(CaptureBackend):
+    """确定性的合成画面，相同参数每次生成完全相同的帧序列
+
+    场景: static 静止桌面（只有时钟变化）、scroll 滚动文本、video 窗口内播放噪声视频。
+    displays 大于 1 时模拟横向排列的多个相同尺寸的显示器，各显示器标有编号。
+    """
+
+    name = "synthetic"
+    SCENES = ("static", "scroll", "video")
+
+    def __init__(self, width=1920, height=1080, scene="scroll", seed=0, displays=1):
+        if scene not in self.SCENES:
+            raise ValueError(f"未知的合成场景: {scene}")
+        self.width = width
+        self.height = height
+        self.display_count = displays
+        self.scene = scene
+        self.seed = seed
+        self.frame_index = 0
+        rng = random.Random(seed)
+        
+        # 桌面背景和几个窗口
+        self.desktop = Image.new('RGB', (width, height), (0, 90, 160))
+        draw = ImageDraw.Draw(self.desktop)
+        for _ in range(5):
+            x, y = rng.randrange(width // 2), rng.randrange(height // 2)
+            w, h = rng.randrange(width // 4, width // 2), rng.randrange(height // 4, height // 2)
+            draw.rectangle([x, y, x + w, y + h], fill=(240, 240, 240), outline=(60, 60, 60))
+            draw.rectangle([x, y, x + w, y + 24], fill=(30, 30, 120))
+        draw.rectangle([0, height - 40, width, height], fill=(32, 32, 32))  # 任务栏
+        
+        # 滚动文本窗口的内容比窗口高，按帧移动可见部分
+        self.text_box = (width // 8, height // 8, width // 8 * 5, height // 8 * 7)
+        box_width = self.text_box[2] - self.text_box[0]
+        box_height = self.text_box[3] - self.text_box[1]
+        self.text_page = Image.new('RGB', (box_width, box_height * 4), (255, 255, 255))
+        draw = ImageDraw.Draw(self.text_page)
+        for line_y in range(4, box_height * 4 - 16, 16):
+            line = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz     0123456789") for _ in range(box_width // 7))
+            draw.text((6, line_y), line, fill=(0, 0, 0))
+        
+        # 视频窗口
+        self.video_box = (width // 2, height // 4, width // 2 + width // 3, height // 4 + height // 3)
+
+    def screen_size(self):
+        return self.width, self.height
+
+    def displays(self):
+        return [(self.width * display, 0, self.width, self.height) for display in range(self.display_count)]
+
+    def grab(self, display=0):
+        if not 0 <= display < self.display_count:
+            raise ValueError(f"显示器编号无效: {display}")
+        index = self.frame_index
+        self.frame_index += 1
+        frame = self.desktop.copy()
+        if self.scene == "scroll":
+            x0, y0, x1, y1 = self.text_box
+            offset = index * 16 % (self.text_page.height - (y1 - y0))
+            frame.paste(self.text_page.crop((0, offset, x1 - x0, offset + y1 - y0)), (x0, y0))
+        elif self.scene == "video":
+            x0, y0, x1, y1 = self.video_box
+            # 以低分辨率噪声放大，近似视频画面的块状变化
+            noise_size = ((x1 - x0) // 8, (y1 - y0) // 8)
+            noise = random.Random(self.seed * 100003 + index).randbytes(noise_size[0] * noise_size[1] * 3)
+            frame.paste(Image.frombytes('RGB', noise_size, noise).resize((x1 - x0, y1 - y0), Image.BILINEAR), (x0, y0))
+        # 任务栏时钟，每秒（按 10 FPS 计）变化一次
+        draw = ImageDraw.Draw(frame)
+        draw.text((self.width - 80, self.height - 28), f"12:{index // 10 % 60:02d}", fill=(255, 255, 255))
+        if display:
+            draw.text((8, self.height - 28), f"显示器 {display + 1}", fill=(255, 255, 255))
+        return frame
+
+
+CAPTURE_BACKENDS = {backend.name: backend for backend in (MssCapture, ImageGrabCapture, SyntheticCapture)}
+
+
+def create_capture_backend(spec, log=print):
+    """按名称创建捕获后端；auto 时试捕获几帧，选择最快的真实捕获方式"""
+    name, _, option = spec.partition(":")
+    if name == SyntheticCapture.name:
+        return SyntheticCapture(scene=option or "scroll")
+    if name != "auto":
+        backend_class = CAPTURE_BACKENDS.get(name)
+        if backend_class is None or not backend_class.available():
+            raise ValueError(f"屏幕捕获方式不可用: {spec}")
+        return backend_class()
+    
+    best, best_time = None, None
+    for backend_class in (MssCapture, ImageGrabCapture):
+        if not backend_class.available():
+            continue
+        backend = backend_class()
+        try:
+            start = time.perf_counter()
+            for _ in range(CAPTURE_PROBE_FRAMES):
+                backend.grab()
+            elapsed = (time.perf_counter() - start) / CAPTURE_PROBE_FRAMES
+        except Exception as e:
+            log(f"屏幕捕获方式 {backend.name} 不可用: {str(e)}")
+            backend.close()
+            continue
+        log(f"屏幕捕获方式 {backend.name}: {elapsed * 1000:.1f}ms/帧")
+        if best is None or elapsed < best_time:
+            if best is not None:
+                best.close()
+            best, best_time = backend, elapsed
+        else:
+            backend.close()
+    if best is None:
+        log("没有可用的屏幕捕获方式，使用合成画面")
+        return SyntheticCapture()
+    # mss 实例绑定创建它的线程，试捕获后重建，由捕获线程重新创建
+    best.close()
+    return best
+
+
+class MessageParser:
+    """增量消息解析器，处理半包（一条消息分多次到达）和粘包（一次收到多条消息）"""
+
+    def __init__(self, max_size=MAX_MESSAGE_SIZE):
+        self.buffer = bytearray()
+        self.max_size = max_size
+
+    def feed(self, data):
+        """追加收到的数据，返回已完整的消息列表 [(通道, 类型, 请求ID, 负载), ...]"""
+        self.buffer += data
+        messages = []
+        offset = 0
+        header_size = MESSAGE_HEADER.size
+        while len(self.buffer) - offset >= header_size:
+            channel, msg_type, request_id, length = MESSAGE_HEADER.unpack_from(self.buffer, offset)
+            if length > self.max_size:
+                raise ValueError(f"消息长度超出限制: {length} > {self.max_size}")
+            end = offset + header_size + length
+            if len(self.buffer) < end:
+                break
+            messages.append((channel, msg_type, request_id, bytes(self.buffer[offset + header_size:end])))
+            offset = end
+        # 一次性丢弃已解析的数据，避免逐条移动缓冲区
+        if offset:
+            del self.buffer[:offset]
+        return messages
+
 
 class ClientServer:
     def __init__(self):
@@ -53,17 +918,40 @@ class ClientServer:
         self.lock = threading.Lock()
         self.input_locked = False
         self.internet_disabled = False
-        self.server_socket = None
-        self.client_socket = None
+        self.server = None
+        self.client_writers = set()  # 当前所有连接
+        self.background_tasks = set()
+        self.file_transfers = {}  # 正在进行的文件接收，按 (连接, 请求ID) 区分
+        # 阻塞操作（子进程、Windows API）与屏幕捕获分别使用独立线程池，长命令不影响画面
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self.capture_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # 画面编码单独一个线程，与捕获并行；单线程保证增量画面按顺序比较
+        self.encode_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
         
         # 屏幕监控相关变量
         self.monitoring = False
-        self.monitor_thread = None
-        self.screen_width = 1280  # 默认宽度设为HD分辨率
-        self.screen_height = 720   # 默认高度设为HD分辨率
-        self.fps = 10  # 降低默认FPS以提高稳定性
-        self.quality = 50
-        self.delay = 0.5
+        self.monitor_task = None  # 所有连接共用的捕获、编码任务
+        self.subscribers = {}  # 接收屏幕画面的连接 -> ScreenSubscriber
+        self.layers = {}  # 当前有连接使用的编码层
+        self.pipeline_stats = {}  # 屏幕流水线各阶段的耗时统计
+        self.capture_wakeup = None  # 提前结束捕获等待的事件，在屏幕流水线启动时创建
+        
+        # 选择屏幕捕获方式
+        try:
+            self.capture_backend = create_capture_backend(CAPTURE_BACKEND, self.log)
+        except ValueError as e:
+            self.log(f"{str(e)}，改为自动选择")
+            self.capture_backend = create_capture_backend("auto", self.log)
+        self.log(f"屏幕捕获方式: {self.capture_backend.name}")
+        self.displays = self.get_displays()
+        
+        # 选择JPEG编码方式
+        try:
+            self.jpeg_encoder = create_jpeg_encoder(JPEG_ENCODER, JPEG_SUBSAMPLING, self.log)
+        except ValueError as e:
+            self.log(f"{str(e)}，改为自动选择")
+            self.jpeg_encoder = create_jpeg_encoder("auto", "420", self.log)
+        self.log(f"JPEG编码方式: {self.jpeg_encoder.name}, 色度抽样 {self.jpeg_encoder.subsampling}")
         
         # 获取屏幕实际分辨率和缩放比例
         self.screen_info = self.get_screen_resolution()
@@ -92,9 +980,25 @@ class ClientServer:
         self.hide_window()
         self.set_autostart()
         self.start_monitor_process()
-        self.start_server()
         self.main_loop()
     
+    def get_displays(self):
+        """读取各显示器的位置和大小，失败时只使用主显示器"""
+        try:
+            displays = self.capture_backend.displays()
+            self.log("检测到显示器: " + ", ".join(
+                f"{index + 1}: {width}x{height}+{left}+{top}" for index, (left, top, width, height) in enumerate(displays)))
+            return displays
+        except Exception as e:
+            self.log(f"获取显示器布局失败: {str(e)}，只使用主显示器")
+            return [(0, 0) + self.capture_backend.screen_size()]
+    
+    def display_size(self, display):
+        """某个显示器的分辨率上限：主显示器沿用检测到的实际分辨率，其余按显示器布局"""
+        if display == 0:
+            return self.max_width, self.max_height
+        return self.displays[display][2:]
+    
     def get_screen_resolution(self):
         """获取实际屏幕分辨率和缩放比例，解决高DPI显示问题"""
         try:
@@ -120,8 +1024,14 @@ class ClientServer:
             
             return (width, height, scale_factor)
         except Exception as e:
-            self.log(f"获取屏幕分辨率失败: {str(e)}，使用默认值 1920x1080")
-            return (1920, 1080, 1.0)
+            # 非 Windows 系统上以捕获画面的尺寸为准
+            try:
+                width, height = self.capture_backend.screen_size()
+                self.log(f"获取屏幕分辨率失败: {str(e)}，使用捕获画面尺寸 {width}x{height}")
+                return (width, height, 1.0)
+            except Exception:
+                self.log(f"获取屏幕分辨率失败: {str(e)}，使用默认值 1920x1080")
+                return (1920, 1080, 1.0)
     
     def get_desktop_path(self):
         """获取当前用户的桌面路径"""
@@ -355,16 +1265,19 @@ if __name__ == "__main__":
         self.normal_exit = True
         self.running = False
         self.monitoring = False  # 停止监控
+        self.executor.shutdown(wait=False)
+        self.capture_executor.shutdown(wait=False)
+        self.encode_executor.shutdown(wait=False)
         with open(NORMAL_EXIT_FILE, "w") as f:
             f.write("1")
-        if self.client_socket:
+        for writer in list(self.client_writers):
             try:
-                self.client_socket.close()
+                writer.close()
             except:
                 pass
-        if self.server_socket:
+        if self.server:
             try:
-                self.server_socket.close()
+                self.server.close()
             except:
                 pass
         # 清理临时文件
@@ -377,257 +1290,766 @@ if __name__ == "__main__":
         self.log("程序正常退出")
         sys.exit(0)
     
-    def start_server(self):
+    async def start_server(self):
         """启动服务器监听连接"""
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            # 设置套接字选项，允许端口重用
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((SERVER_IP, SERVER_PORT))
-            self.server_socket.listen(5)
-            self.server_socket.settimeout(1)
+            # reuse_address 允许端口重用
+            self.server = await asyncio.start_server(
+                self.handle_client, SERVER_IP, SERVER_PORT, reuse_address=True
+            )
             self.log(f"服务器启动，监听 {SERVER_IP}:{SERVER_PORT}")
+            return True
         except Exception as e:
             self.log(f"服务器启动失败: {str(e)}")
-            self.stop()
+            return False
+    
+    async def run_blocking(self, func, *args):
+        """在线程池中执行阻塞操作（子进程、Windows API 等），不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
     
-    def handle_client(self, client_socket):
-        """处理客户端命令"""
-        self.client_socket = client_socket
+    def spawn(self, coro):
+        """创建后台任务并保持引用，防止任务被提前回收"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+    
+    async def send_message(self, writer, channel, msg_type, payload=b"", request_id=0):
+        """发送一条完整消息，发送缓冲区满时等待（背压）"""
+        # 事件循环单线程执行，一次 write 写入整条消息，不会与其他消息交错
+        writer.write(pack_message(channel, msg_type, payload, request_id))
+        await writer.drain()
+    
+    async def send_text(self, writer, channel, request_id, text):
+        """在指定通道上回复文本，携带对应请求的ID"""
+        await self.send_message(writer, channel, MSG_TEXT, text, request_id)
+    
+    async def handle_client(self, reader, writer):
+        """处理客户端连接（每个连接一个协程）"""
+        parser = MessageParser()
+        self.client_writers.add(writer)
         try:
-            client_addr = client_socket.getpeername()
+            client_addr = writer.get_extra_info('peername')
             self.log(f"新客户端连接: {client_addr}")
             
             while self.running:
-                # 设置接收超时，防止永久阻塞
-                client_socket.settimeout(5)
                 try:
-                    data = client_socket.recv(4096).decode('utf-8', errors='ignore')
-                except socket.timeout:
-                    # 超时不关闭连接，继续等待
-                    continue
+                    data = await reader.read(RECV_BUFFER_SIZE)
                 except Exception as e:
                     self.log(f"接收数据错误: {str(e)}")
                     break
                     
                 if not data:
                     break
-                    
-                self.log(f"收到命令: {data} (长度: {len(data)})")
                 
-                # 屏幕监控命令处理
-                if data.startswith("__START_MONITOR__" + MESSAGE_SEPARATOR):
-                    try:
-                        parts = data.split(MESSAGE_SEPARATOR)
-                        if len(parts) < 6:
-                            client_socket.sendall("屏幕监控命令格式错误".encode('utf-8'))
-                            continue
-                            
-                        # 解析监控参数并验证
-                        try:
-                            req_width = int(parts[1])
-                            req_height = int(parts[2])
-                            req_fps = int(parts[3])
-                            req_quality = int(parts[4])
-                            req_delay = float(parts[5])
-                        except ValueError as e:
-                            error_msg = f"监控参数解析错误: {str(e)}"
-                            self.log(error_msg)
-                            client_socket.sendall(error_msg.encode('utf-8'))
-                            continue
-                            
-                        # 限制分辨率不超过实际屏幕分辨率
-                        self.screen_width = min(req_width, self.max_width)
-                        self.screen_height = min(req_height, self.max_height)
-                        
-                        # 确保宽高比合理（防止畸形分辨率）
-                        aspect_ratio = self.screen_width / self.screen_height
-                        if aspect_ratio < 1.2 or aspect_ratio > 2.5:
-                            self.log(f"检测到不合理的宽高比 {aspect_ratio:.2f}，使用默认HD分辨率")
-                            self.screen_width, self.screen_height = 1280, 720
-                        
-                        # 限制FPS范围
-                        self.fps = max(1, min(req_fps, 15))  # 限制最大FPS为15，提高稳定性
-                        
-                        # 限制质量范围
-                        self.quality = max(10, min(req_quality, 80))
-                        
-                        # 限制延迟范围
-                        self.delay = max(0.2, min(req_delay, 2.0))
-                        
-                        # 启动监控线程
-                        self.monitoring = True
-                        if self.monitor_thread is None or not self.monitor_thread.is_alive():
-                            self.monitor_thread = threading.Thread(target=self.capture_and_send_screen, daemon=True)
-                            self.monitor_thread.start()
-                        
-                        # 发送实际使用的参数（可能经过调整）
-                        response = f"开始屏幕监控 - 已调整参数: {self.screen_width}x{self.screen_height}, FPS: {self.fps}, 质量: {self.quality}, 延迟: {self.delay}s"
-                        client_socket.sendall(response.encode('utf-8'))
-                        
-                    except Exception as e:
-                        error_msg = f"处理屏幕监控命令失败: {str(e)}"
-                        self.log(error_msg)
-                        client_socket.sendall(error_msg.encode('utf-8'))
-                
-                elif data == "__STOP_MONITOR__":
-                    self.monitoring = False
-                    client_socket.sendall("已停止屏幕监控".encode('utf-8'))
-                
-                # 弹窗命令处理
-                elif data.startswith("__POPUP_MESSAGE__" + MESSAGE_SEPARATOR):
-                    try:
-                        separator_pos = data.find(MESSAGE_SEPARATOR)
-                        if separator_pos == -1:
-                            client_socket.sendall("弹窗消息格式错误: 未找到分隔符".encode('utf-8'))
-                            continue
-                            
-                        msg = data[separator_pos + len(MESSAGE_SEPARATOR):]
-                        
-                        if not msg.strip():
-                            msg = "收到空消息内容"
-                            self.log("检测到空消息内容，使用默认文本")
-                        
-                        if self.ui_initialized:
-                            self.msg_queue.put(msg)
-                            client_socket.sendall(f"弹窗消息已发送，内容长度: {len(msg)} 字符".encode('utf-8'))
-                        else:
-                            error_msg = "弹窗功能不可用，UI初始化失败"
-                            self.log(error_msg)
-                            client_socket.sendall(error_msg.encode('utf-8'))
-                            
-                    except Exception as e:
-                        error_msg = f"处理弹窗消息失败: {str(e)}"
-                        self.log(error_msg)
-                        client_socket.sendall(error_msg.encode('utf-8'))
-                
-                elif data == "__EXIT__":
-                    client_socket.sendall("收到退出命令，程序即将关闭".encode('utf-8'))
-                    # 给服务器一点时间接收消息
-                    time.sleep(1)
-                    self.stop()
+                # 一次接收可能包含多条消息，也可能只是一条消息的一部分
+                try:
+                    messages = parser.feed(data)
+                except ValueError as e:
+                    self.log(f"消息格式错误，断开连接: {str(e)}")
+                    break
                 
-                elif data == "__LOCK_INPUT__":
-                    res = self.lock_input_devices()
-                    client_socket.sendall(res.encode('utf-8'))
-                elif data == "__UNLOCK_INPUT__":
-                    res = self.unlock_input_devices()
-                    client_socket.sendall(res.encode('utf-8'))
-                elif data == "__disable_INTERNET__":
-                    res = self.disable_internet()
-                    client_socket.sendall(res.encode('utf-8'))
-                elif data == "__enable_INTERNET__":
-                    res = self.enable_internet()
-                    client_socket.sendall(res.encode('utf-8'))
-                elif data.startswith("__SEND_FILE__"):
-                    try:
-                        _, file_name, file_size = data.split("|")
-                        res = self.receive_file(client_socket, file_name, int(file_size))
-                        client_socket.sendall(res.encode('utf-8'))
-                    except Exception as e:
-                        error_msg = f"解析文件传输命令失败: {str(e)}"
-                        self.log(error_msg)
-                        client_socket.sendall(error_msg.encode('utf-8'))
-                else:
-                    res = self.execute_command(data)
-                    client_socket.sendall(res.encode('utf-8'))
+                for channel, msg_type, request_id, payload in messages:
+                    await self.dispatch_message(writer, channel, msg_type, request_id, payload)
         except Exception as e:
             self.log(f"客户端处理错误: {str(e)}\n{traceback.format_exc()}")
         finally:
-            self.monitoring = False  # 确保监控停止
+            # 确保该连接的屏幕监控停止
+            self.remove_screen_subscriber(writer)
+            for key in [key for key in self.file_transfers if key[0] is writer]:
+                self.abort_file_receive(*key)
+            self.client_writers.discard(writer)
             try:
-                client_socket.close()
-            except:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
                 pass
-            self.client_socket = None
             self.log("客户端连接已关闭")
     
-    def capture_and_send_screen(self):
-        """捕获屏幕并发送（优化版，提高稳定性）"""
-        self.log(f"开始屏幕捕获 - {self.screen_width}x{self.screen_height}, {self.fps}FPS")
+    async def dispatch_message(self, writer, channel, msg_type, request_id, payload):
+        """按消息类型分发处理，回复沿原通道返回并携带原请求ID"""
+        if msg_type == MSG_FILE_DATA:
+            # 文件数据块不解码，直接写入
+            error_msg = self.write_file_chunk(writer, request_id, payload)
+            if error_msg:
+                await self.send_text(writer, CHANNEL_FILE, request_id, error_msg)
+            return
+        
+        data = payload.decode('utf-8', errors='ignore')
+        if msg_type == MSG_COMMAND:
+            self.log(f"收到命令 #{request_id}: {data} (长度: {len(data)})")
+            # 命令在后台任务中并发执行，结果按请求ID返回，不阻塞后续请求
+            self.spawn(self.run_command(writer, channel, request_id, data))
+        elif msg_type == MSG_CONTROL:
+            if not data.startswith(("__STREAM_FEEDBACK__", "__TIME_SYNC__")):  # 定期发送的命令不写入日志
+                self.log(f"收到控制命令 #{request_id}: {data[:100]} (长度: {len(data)})")
+            await self.handle_control_command(writer, channel, request_id, data)
+        elif msg_type == MSG_FILE_BEGIN:
+            error_msg = self.begin_file_receive(writer, request_id, data)
+            if error_msg:
+                await self.send_text(writer, CHANNEL_FILE, request_id, error_msg)
+        elif msg_type == MSG_FILE_END:
+            res = self.finish_file_receive(writer, request_id)
+            await self.send_text(writer, CHANNEL_FILE, request_id, res)
+        else:
+            self.log(f"未知消息类型: {msg_type}，已忽略")
+    
+    async def run_command(self, writer, channel, request_id, cmd):
+        """执行系统命令并回复结果"""
+        res = await self.run_blocking(self.execute_command, cmd)
         try:
-            interval = 1.0 / self.fps  # 计算帧间隔时间
-            last_send_time = 0
-            
-            while self.monitoring and self.client_socket:
-                # 控制发送频率
-                current_time = time.time()
-                if current_time - last_send_time < interval:
-                    # 等待到下一帧的时间
-                    sleep_time = max(0, interval - (current_time - last_send_time))
-                    time.sleep(sleep_time)
-                    continue
+            await self.send_text(writer, channel, request_id, res)
+        except Exception as e:
+            self.log(f"发送命令结果失败: {str(e)}")
+    
+    async def handle_control_command(self, writer, channel, request_id, data):
+        """处理控制命令"""
+        # 屏幕监控命令处理
+        if data.startswith("__START_MONITOR__" + MESSAGE_SEPARATOR):
+            try:
+                parts = data.split(MESSAGE_SEPARATOR)
+                if len(parts) < 6:
+                    await self.send_text(writer, channel, request_id, "屏幕监控命令格式错误")
+                    return
+                    
+                # 解析监控参数并验证
+                try:
+                    params = self.parse_monitor_params(parts)
+                except ValueError as e:
+                    error_msg = f"监控参数解析错误: {str(e)}"
+                    self.log(error_msg)
+                    await self.send_text(writer, channel, request_id, error_msg)
+                    return
                 
-                last_send_time = current_time
-                start_time = current_time
+                # 画面发送到发起监控的连接，多个连接共用一次屏幕捕获
+                self.add_screen_subscriber(writer, params)
                 
-                try:
-                    # 捕获屏幕，考虑缩放比例
-                    screenshot = ImageGrab.grab()
-                    
-                    # 调整大小
-                    screenshot = screenshot.resize(
-                        (self.screen_width, self.screen_height), 
-                        Image.LANCZOS  # 使用高质量缩放算法
-                    )
-                    
-                    # 保存到内存缓冲区
-                    img_buffer = io.BytesIO()
-                    screenshot.save(img_buffer, format='JPEG', quality=self.quality, optimize=True)
-                    img_buffer.seek(0)
-                    img_data = img_buffer.getvalue()
-                    img_buffer.close()
-                    
-                    # 检查图像大小，如果超过限制则降低质量并重试
-                    if len(img_data) > MAX_IMAGE_SIZE:
-                        self.log(f"图像大小超过限制 ({len(img_data)} > {MAX_IMAGE_SIZE})，降低质量重试")
-                        # 降低质量并重试
-                        new_quality = max(10, self.quality - 10)
-                        img_buffer = io.BytesIO()
-                        screenshot.save(img_buffer, format='JPEG', quality=new_quality, optimize=True)
-                        img_buffer.seek(0)
-                        img_data = img_buffer.getvalue()
-                        img_buffer.close()
-                        self.quality = new_quality  # 更新质量设置
+                # 发送实际使用的参数（可能经过调整）
+                response = f"开始屏幕监控 - 已调整参数: {self.describe_monitor_params(params)}"
+                await self.send_text(writer, channel, request_id, response)
+                
+            except Exception as e:
+                error_msg = f"处理屏幕监控命令失败: {str(e)}"
+                self.log(error_msg)
+                await self.send_text(writer, channel, request_id, error_msg)
+        
+        elif data.startswith("__UPDATE_MONITOR__" + MESSAGE_SEPARATOR):
+            # 监控过程中更新参数，不中断画面；参数格式与 __START_MONITOR__ 相同
+            parts = data.split(MESSAGE_SEPARATOR)
+            subscriber = self.subscribers.get(writer)
+            if subscriber is None:
+                await self.send_text(writer, channel, request_id, "屏幕监控未运行，无法更新参数")
+                return
+            if len(parts) < 6:
+                await self.send_text(writer, channel, request_id, "屏幕监控命令格式错误")
+                return
+            try:
+                params = self.parse_monitor_params(parts)
+            except ValueError as e:
+                await self.send_text(writer, channel, request_id, f"监控参数解析错误: {str(e)}")
+                return
+            # 编码层按各连接的参数在每帧开始时分组，正在编码的帧不受影响
+            subscriber.apply_params(params)
+            self.wake_capture()  # 新参数的完整画面立即发送，不等静止画面的捕获间隔
+            self.log(f"屏幕监控参数已更新: {self.describe_monitor_params(params)}")
+            await self.send_text(writer, channel, request_id, f"已更新屏幕监控参数: {self.describe_monitor_params(params)}")
+        
+        elif data.startswith("__STREAM_FEEDBACK__" + MESSAGE_SEPARATOR):
+            # 主控端定期回报的丢帧数和解码耗时，无需回复
+            try:
+                _, dropped, decode_ms = data.split(MESSAGE_SEPARATOR)[:3]
+                subscriber = self.subscribers.get(writer)
+                if subscriber is not None:
+                    subscriber.rate_controller.report_feedback(int(dropped), float(decode_ms))
+            except ValueError:
+                self.log(f"画面回报格式错误: {data[:100]}")
+        
+        elif data == "__TIME_SYNC__":
+            # 主控端估计两端时钟偏差，回复本机当前时间
+            await self.send_text(writer, channel, request_id, f"{time.time():.6f}")
+        
+        elif data == "__REQUEST_KEYFRAME__":
+            # 主控端丢帧后请求完整画面，无需回复
+            subscriber = self.subscribers.get(writer)
+            if subscriber is not None:
+                subscriber.force_keyframe = True
+                self.wake_capture()
+        
+        elif data == "__SCREEN_INFO__":
+            # 各显示器的位置和大小（每行 左,上,宽,高，第一行为主显示器），显示器插拔后重新读取
+            self.displays = await self.run_blocking(self.get_displays)
+            await self.send_text(writer, channel, request_id, "\n".join(
+                ",".join(str(value) for value in display) for display in self.displays))
+        
+        elif data == "__LIST_WINDOWS__":
+            # 主控端选择只传输某个窗口时，列出可见的顶层窗口及其位置
+            try:
+                windows = await self.run_blocking(self.list_windows)
+                response = "\n".join(f"{','.join(f'{value:.5f}' for value in region)}{MESSAGE_SEPARATOR}{title}"
+                                     for region, title in windows)
+            except Exception as e:
+                response = f"获取窗口列表失败: {str(e)}"
+            await self.send_text(writer, channel, request_id, response)
+        
+        elif data.startswith("__STREAM_VISIBILITY__" + MESSAGE_SEPARATOR):
+            # 主控端监控窗口最小化、被遮挡或移出可见区域时为 0，重新可见时为 1，无需回复
+            visible = data.split(MESSAGE_SEPARATOR)[1]
+            if visible not in ("0", "1"):
+                self.log(f"画面可见状态格式错误: {data[:100]}")
+                return
+            self.set_subscriber_visible(writer, visible == "1")
+        
+        elif data == "__STOP_MONITOR__":
+            # 只停止发往该连接的画面，其他连接不受影响
+            self.remove_screen_subscriber(writer)
+            await self.send_text(writer, channel, request_id, "已停止屏幕监控")
+        
+        # 弹窗命令处理
+        elif data.startswith("__POPUP_MESSAGE__" + MESSAGE_SEPARATOR):
+            try:
+                msg = data[len("__POPUP_MESSAGE__" + MESSAGE_SEPARATOR):]
+                
+                if not msg.strip():
+                    msg = "收到空消息内容"
+                    self.log("检测到空消息内容，使用默认文本")
+                
+                if self.ui_initialized:
+                    self.msg_queue.put(msg)
+                    await self.send_text(writer, channel, request_id, f"弹窗消息已发送，内容长度: {len(msg)} 字符")
+                else:
+                    error_msg = "弹窗功能不可用，UI初始化失败"
+                    self.log(error_msg)
+                    await self.send_text(writer, channel, request_id, error_msg)
                     
-                    # 发送数据：魔术数字 + 数据长度 + 图像数据
+            except Exception as e:
+                error_msg = f"处理弹窗消息失败: {str(e)}"
+                self.log(error_msg)
+                await self.send_text(writer, channel, request_id, error_msg)
+        
+        elif data == "__EXIT__":
+            # drain 返回后数据已交给系统发送缓冲区，关闭连接前会发送完毕
+            await self.send_text(writer, channel, request_id, "收到退出命令，程序即将关闭")
+            self.stop()
+        
+        # Windows 相关操作可能阻塞（netsh 等），放到线程池执行
+        elif data == "__LOCK_INPUT__":
+            await self.send_text(writer, channel, request_id, await self.run_blocking(self.lock_input_devices))
+        elif data == "__UNLOCK_INPUT__":
+            await self.send_text(writer, channel, request_id, await self.run_blocking(self.unlock_input_devices))
+        elif data == "__disable_INTERNET__":
+            await self.send_text(writer, channel, request_id, await self.run_blocking(self.disable_internet))
+        elif data == "__enable_INTERNET__":
+            await self.send_text(writer, channel, request_id, await self.run_blocking(self.enable_internet))
+        else:
+            await self.send_text(writer, channel, request_id, f"未知控制命令: {data[:100]}")
+    
+    def parse_monitor_params(self, parts):
+        """解析屏幕监控参数并限制在允许范围内，参数无效时抛出 ValueError"""
+        req_width = int(parts[1])
+        req_height = int(parts[2])
+        req_fps = int(parts[3])
+        req_quality = int(parts[4])
+        req_delay = float(parts[5])
+        if req_width <= 0 or req_height <= 0:
+            raise ValueError(f"分辨率无效: {req_width}x{req_height}")
+        
+        # 可选的第10个参数选择显示器（0 为主显示器），分辨率按该显示器限制
+        display = int(parts[9]) if len(parts) > 9 else 0
+        if not 0 <= display < len(self.displays):
+            raise ValueError(f"显示器编号无效: {display}")
+        max_width, max_height = self.display_size(display)
+        
+        # 可选的第9个参数只传输屏幕上的一块区域：按区域的原始像素大小传输，超过请求的分辨率时等比缩小
+        region = parse_region(parts[8]) if len(parts) > 8 else None
+        if region is not None:
+            # 区域过小时以中心为准扩大到最小边长
+            x, y, w, h = region
+            min_w = min(1.0, MIN_REGION_SIZE / max_width)
+            min_h = min(1.0, MIN_REGION_SIZE / max_height)
+            if w < min_w:
+                x, w = min(max(0.0, x + (w - min_w) / 2), 1 - min_w), min_w
+            if h < min_h:
+                y, h = min(max(0.0, y + (h - min_h) / 2), 1 - min_h), min_h
+            region = (x, y, w, h)
+            region_width = w * max_width
+            region_height = h * max_height
+            scale = min(1.0, req_width / region_width, req_height / region_height)
+            width = max(2, int(region_width * scale) // 2 * 2)
+            height = max(2, int(region_height * scale) // 2 * 2)
+        else:
+            # 限制分辨率不超过实际屏幕分辨率
+            width = min(req_width, max_width)
+            height = min(req_height, max_height)
+            
+            # 确保宽高比合理（防止畸形分辨率）；可选的第11个参数为 1 时尺寸按主控端的显示区域计算，
+            # 细长的窗口也是合理的尺寸，不做限制
+            viewport = len(parts) > 10 and parts[10] == "1"
+            aspect_ratio = width / height
+            if not viewport and (aspect_ratio < 1.2 or aspect_ratio > 2.5):
+                self.log(f"检测到不合理的宽高比 {aspect_ratio:.2f}，使用默认HD分辨率")
+                width, height = 1280, 720
+        
+        # 可选的第7个参数开启增量传输，需要 NumPy 比较画面
+        delta_requested = len(parts) > 6 and parts[6] == "1"
+        # 可选的第8个参数选择编码方式，H.264 需要 PyAV，视频编码本身只传输变化，不再使用增量传输
+        h264_requested = len(parts) > 7 and parts[7] == "h264"
+        h264 = h264_requested and H264_AVAILABLE
+        return {
+            "width": width,
+            "height": height,
+            "fps": max(1, min(req_fps, 15)),  # 限制最大FPS为15，提高稳定性
+            "quality": max(10, min(req_quality, 80)),
+            "delay": max(0.2, min(req_delay, 2.0)),
+            "delta_requested": delta_requested,
+            "delta": delta_requested and np is not None and not h264,
+            "h264_requested": h264_requested,
+            "codec": CODEC_H264 if h264 else CODEC_JPEG,
+            "region": region,
+            "display": display,
+        }
+    
+    def describe_monitor_params(self, params):
+        """生成回复主控端的参数说明"""
+        text = (f"{params['width']}x{params['height']}, FPS: {params['fps']}, "
+                f"质量: {params['quality']}, 延迟: {params['delay']}s")
+        if params["codec"] == CODEC_H264:
+            text += ", H.264视频编码"
+        elif params["h264_requested"]:
+            text += ", 未安装PyAV，使用JPEG编码"
+        if params["display"]:
+            text += f", 显示器{params['display'] + 1}"
+        if params["region"] is not None:
+            left, top, right, bottom = region_box(self.display_size(params["display"]), params["region"])
+            text += f", 区域 {right - left}x{bottom - top}+{left}+{top}"
+        if params["delta"]:
+            text += ", 增量传输"
+        elif params["delta_requested"] and params["codec"] != CODEC_H264:
+            text += ", 未安装NumPy，使用完整画面传输"
+        return text
+    
+    def add_screen_subscriber(self, writer, params):
+        """开始向一个连接发送屏幕画面，同一连接再次开始时按新参数重新开始"""
+        subscriber = self.subscribers.get(writer)
+        if subscriber is None:
+            subscriber = ScreenSubscriber(writer, params)
+            self.subscribers[writer] = subscriber
+            subscriber.send_task = self.spawn(self.send_stage(subscriber))
+        else:
+            subscriber.apply_params(params)
+        self.wake_capture()
+        
+        # 第一个连接开始时启动捕获和编码，之后的连接共用
+        if self.monitor_task is None or self.monitor_task.done():
+            self.monitoring = True
+            self.pipeline_stats = {stage: StageStats() for stage in ("捕获", "编码", "发送")}
+            self.stats_since = time.monotonic()
+            self.monitor_task = self.spawn(self.capture_and_send_screen())
+    
+    def remove_screen_subscriber(self, writer):
+        """停止向一个连接发送屏幕画面，没有连接时停止捕获"""
+        subscriber = self.subscribers.pop(writer, None)
+        if subscriber is None:
+            return
+        if subscriber.send_task and not subscriber.send_task.done():
+            subscriber.send_task.cancel()
+        if not self.subscribers:
+            self.stop_screen_stream()
+    
+    def list_windows(self):
+        """列出主显示器上可见的顶层窗口（其他显示器上的窗口位置无法换算为主显示器画面上的区域），返回 [(画面区域, 标题), ...]，区域为占整个屏幕的比例"""
+        user32 = ctypes.windll.user32
+        # 窗口坐标与 GetSystemMetrics 同为缩放后的逻辑坐标，换算为比例后与 DPI 缩放无关
+        screen_width = user32.GetSystemMetrics(0)  # SM_CXSCREEN
+        screen_height = user32.GetSystemMetrics(1)  # SM_CYSCREEN
+        windows = []
+        
+        def add_window(hwnd, _):
+            if not user32.IsWindowVisible(hwnd) or user32.IsIconic(hwnd):
+                return True
+            length = user32.GetWindowTextLengthW(hwnd)
+            if length == 0:
+                return True
+            title = ctypes.create_unicode_buffer(length + 1)
+            user32.GetWindowTextW(hwnd, title, length + 1)
+            rect = (ctypes.c_long * 4)()  # RECT: 左, 上, 右, 下
+            user32.GetWindowRect(hwnd, rect)
+            left, top = max(0, rect[0]), max(0, rect[1])
+            right, bottom = min(screen_width, rect[2]), min(screen_height, rect[3])
+            if right - left >= MIN_REGION_SIZE and bottom - top >= MIN_REGION_SIZE:
+                windows.append(((left / screen_width, top / screen_height,
+                                 (right - left) / screen_width, (bottom - top) / screen_height), title.value))
+            return True
+        
+        callback = ctypes.WINFUNCTYPE(ctypes.c_bool, ctypes.c_void_p, ctypes.c_void_p)(add_window)
+        user32.EnumWindows(callback, 0)
+        return windows
+    
+    def wake_capture(self):
+        """有连接需要画面时立即捕获，不等待静止画面或无人观看时的较长间隔"""
+        if self.capture_wakeup is not None:
+            self.capture_wakeup.set()
+    
+    def set_subscriber_visible(self, writer, visible):
+        """主控端画面可见状态变化：不可见时暂停该连接的编码，恢复时立即发送完整画面"""
+        subscriber = self.subscribers.get(writer)
+        if subscriber is None or subscriber.visible == visible:
+            return
+        subscriber.visible = visible
+        if visible:
+            subscriber.force_keyframe = True
+            self.wake_capture()
+    
+    def stop_screen_stream(self):
+        """停止屏幕监控任务"""
+        self.monitoring = False
+        if self.monitor_task and not self.monitor_task.done():
+            self.monitor_task.cancel()
+        self.monitor_task = None
+        for subscriber in self.subscribers.values():
+            if subscriber.send_task and not subscriber.send_task.done():
+                subscriber.send_task.cancel()
+        self.subscribers.clear()
+        self.layers.clear()
+    
+    def encode_screen_frame(self, screenshot, layer):
+        """按编码层缩放并编码一帧屏幕画面，返回可直接发送的整条消息（在编码线程中执行）
+
+        增量模式下只编码变化的画面块；画面没有变化时返回 None。
+        """
+        quality = layer.quality
+        
+        # 区域传输时先裁剪，只缩放、编码区域内的像素
+        if layer.region is not None:
+            screenshot = screenshot.crop(region_box(screenshot.size, layer.region))
+        
+        # 调整大小（自适应调整可能低于设定的分辨率）
+        screenshot = resize_frame(screenshot, (layer.width, layer.height))
+        
+        if layer.codec == CODEC_H264:
+            # 视频编码器自行参考前几帧，只编码变化；画面静止时输出的码流只有十几个字节
+            if layer.video_encoder is None:
+                layer.video_encoder = H264Encoder(layer.width, layer.height, layer.fps, quality)
+            data = layer.video_encoder.encode(screenshot, layer.force_keyframe)
+            layer.force_keyframe = False
+            if not data:
+                return None
+            return encode_video_message(data)[0]
+        
+        current = None  # 增量模式下已有的像素数组，JPEG 编码时不必再转换
+        if layer.delta_mode:
+            current = np.asarray(screenshot)
+            now = time.time()
+            previous = layer.previous_frame
+            keyframe_due = (layer.force_keyframe or previous is None or previous.shape != current.shape
+                            or now - layer.last_keyframe_time >= KEYFRAME_INTERVAL)
+            if not keyframe_due:
+                rects, ratio = find_dirty_tiles(previous, current)
+                layer.previous_frame = current
+                if not rects:
+                    return None
+                if ratio <= DELTA_MAX_RATIO:
+                    message, payload_size = encode_tiles_message(screenshot, rects, quality,
+                                                                 encoder=self.jpeg_encoder, pixels=current)
+                    if payload_size <= MAX_IMAGE_SIZE:
+                        return message
+            layer.previous_frame = current
+            layer.last_keyframe_time = now
+            layer.force_keyframe = False
+        
+        # 编码为带消息头的完整消息
+        message, img_size = encode_image_message(screenshot, quality, encoder=self.jpeg_encoder, pixels=current)
+        
+        # 检查图像大小，如果超过限制则降低质量并重试
+        if img_size > MAX_IMAGE_SIZE:
+            self.log(f"图像大小超过限制 ({img_size} > {MAX_IMAGE_SIZE})，降低质量重试")
+            # 降低质量并重试，之后由自适应调整决定是否恢复
+            new_quality = max(10, quality - 10)
+            message, img_size = encode_image_message(screenshot, new_quality, encoder=self.jpeg_encoder,
+                                                     pixels=current)
+            layer.reduced_quality = new_quality
+        
+        return message
+    
+    def put_latest(self, stage_queue, item, stage):
+        """放入流水线队列，队列满时丢弃最旧的一项并计入该阶段的丢弃数，返回被丢弃的项"""
+        dropped = None
+        if stage_queue.full():
+            dropped = stage_queue.get_nowait()
+            self.pipeline_stats[stage].dropped += 1
+        stage_queue.put_nowait(item)
+        return dropped
+    
+    def grab_screens(self, displays):
+        """捕获各显示器的画面并取样（在捕获线程中执行）
+
+        返回 ({显示器: (画面, 取样数据)}, {显示器: 错误信息})，不检测静止画面时取样数据为 None。
+        一个显示器捕获失败（例如已被拔出）不影响其他显示器。
+        """
+        shots = {}
+        errors = {}
+        for display in displays:
+            try:
+                screenshot = self.capture_backend.grab(display)
+            except Exception as e:
+                errors[display] = str(e)
+                continue
+            shots[display] = (screenshot, screen_fingerprint(screenshot) if STATIC_CHECK else None)
+        return shots, errors
+    
+    async def capture_stage(self, frames):
+        """流水线第一段：按帧间隔捕获有连接观看的各个显示器，原始画面放入待编码队列
+
+        按单调时钟的绝对截止时间定时：下一帧的截止时间在上一帧的截止时间上加一个帧间隔，
+        捕获耗时和唤醒误差不会累积成漂移；捕获耗时超过帧间隔时跳过错过的帧，立即捕获下一帧，不补帧。
+        """
+        loop = asyncio.get_running_loop()
+        stats = self.pipeline_stats["捕获"]
+        last_fingerprints = {}
+        last_errors = {}
+        last_change = time.monotonic()
+        deadline = time.monotonic()
+        while self.monitoring:
+            start_clock = time.monotonic()
+            start_time = time.time()  # 写入画面头，主控端换算时钟偏差后计算端到端延迟
+            visible = [subscriber for subscriber in self.subscribers.values() if subscriber.visible]
+            if not visible:
+                # 没有主控端能看到画面：暂停捕获，只让编码段按间隔给各连接发送心跳
+                self.put_latest(frames, (start_time, start_clock, 0, {}), "捕获")
+                await self.wait_capture(STREAM_HEARTBEAT_INTERVAL)
+                deadline = time.monotonic()
+                continue
+            # 按帧率最高的连接捕获，帧间隔随自适应调整变化
+            interval = min(subscriber.rate_controller.interval for subscriber in visible)
+            # 画面静止一段时间后降低捕获频率；有连接等待完整画面时照常捕获
+            if (start_clock - last_change >= STATIC_IDLE_AFTER
+                    and not any(subscriber.force_keyframe for subscriber in visible)):
+                interval = max(interval, STATIC_IDLE_INTERVAL)
+            # 只捕获有连接观看的显示器，不捕获、不缩放整个虚拟屏幕
+            displays = sorted({subscriber.display for subscriber in visible})
+            try:
+                shots, errors = await loop.run_in_executor(self.capture_executor, self.grab_screens, displays)
+            except Exception as e:
+                shots, errors = {}, {None: str(e)}
+            # 同一错误只记录一次；捕获失败的显示器不放入画面，观看它的连接只收到心跳
+            for display, error in errors.items():
+                if last_errors.get(display) != error:
+                    self.log(f"屏幕捕获错误{'' if display is None else f'（显示器{display + 1}）'}: {error}")
+            last_errors = errors
+            if not shots:
+                # 短暂延迟后重试
+                await asyncio.sleep(0.5)
+                deadline = time.monotonic()
+                continue
+            capture_seconds = time.monotonic() - start_clock
+            stats.record(capture_seconds)
+            fingerprints = {display: fingerprint for display, (_, fingerprint) in shots.items()}
+            if None in fingerprints.values() or fingerprints != last_fingerprints:
+                last_change = start_clock
+            last_fingerprints = fingerprints
+            # 编码跟不上时丢弃最旧的画面，只编码最新的
+            self.put_latest(frames, (start_time, start_clock, capture_seconds, shots), "捕获")
+            
+            # 等待到下一帧的截止时间
+            deadline += interval
+            now = time.monotonic()
+            if deadline < now:
+                stats.late += int((now - deadline) / interval)  # 只统计整个错过的帧，稍晚开始的一帧不算跳过
+                deadline = now
+            if await self.wait_capture(deadline - now):
+                deadline = time.monotonic()  # 提前唤醒时立即捕获，从此刻重新计时
+    
+    async def wait_capture(self, delay):
+        """等待到下一次捕获；有连接开始、恢复可见或请求完整画面时提前结束，返回是否被提前唤醒"""
+        woken = self.capture_wakeup.is_set()
+        if delay > 0 and not woken:
+            try:
+                await asyncio.wait_for(self.capture_wakeup.wait(), delay)
+                woken = True
+            except asyncio.TimeoutError:
+                pass
+        self.capture_wakeup.clear()
+        return woken
+    
+    async def encode_stage(self, frames):
+        """流水线第二段：每个编码层缩放、编码一次，编好的消息放入该层各连接的发送队列"""
+        loop = asyncio.get_running_loop()
+        stats = self.pipeline_stats["编码"]
+        while True:
+            capture_time, capture_clock, capture_seconds, shots = await frames.get()
+            
+            # 按各连接当前的参数分组，相同的共用一次编码；没有连接使用的层不再编码
+            groups = {}
+            for subscriber in self.subscribers.values():
+                if subscriber.display not in shots or not subscriber.visible:
+                    # 看不到画面的连接不参与编码，只按间隔发送心跳
+                    if capture_time - subscriber.last_sent_time >= STREAM_HEARTBEAT_INTERVAL:
+                        self.queue_frame(subscriber, encode_heartbeat_message(), capture_time, capture_seconds, 0)
+                    continue
+                key = subscriber.layer_key()
+                if key != subscriber.layer:
+                    # 换到另一层后没有该层的增量基准，先发送完整画面
+                    subscriber.layer = key
+                    subscriber.force_keyframe = True
+                groups.setdefault(key, []).append(subscriber)
+            self.layers = {key: self.layers.get(key) or StreamLayer(key) for key in groups}
+            
+            for key, subscribers in groups.items():
+                layer = self.layers[key]
+                screenshot, fingerprint = shots[layer.display]
+                if not layer.due(capture_clock):
+                    continue
+                keyframe = any(subscriber.force_keyframe for subscriber in subscribers)
+                if keyframe:
+                    layer.force_keyframe = True
+                
+                # 取样与本层上次编码的画面相同时不缩放、不编码，只定期刷新一次
+                message = None
+                encode_seconds = 0
+                if (fingerprint is None or fingerprint != layer.fingerprint or keyframe
+                        or capture_time - layer.last_encode_time >= STATIC_REFRESH_INTERVAL):
+                    layer.fingerprint = fingerprint
+                    layer.last_encode_time = capture_time
+                    start_time = time.time()
                     try:
-                        # 魔术数字用于识别图像数据
-                        self.client_socket.sendall(IMAGE_MAGIC_NUMBER)
-                        # 数据长度（4字节）
-                        data_length = len(img_data).to_bytes(4, byteorder='big')
-                        self.client_socket.sendall(data_length)
-                        # 图像数据
-                        sent = 0
-                        while sent < len(img_data) and self.monitoring and self.client_socket:
-                            chunk_size = min(4096, len(img_data) - sent)
-                            self.client_socket.sendall(img_data[sent:sent+chunk_size])
-                            sent += chunk_size
-                        
-                        # 验证是否发送完整
-                        if sent != len(img_data):
-                            self.log(f"图像数据发送不完整，预期 {len(img_data)} 字节，实际发送 {sent} 字节")
+                        message = await loop.run_in_executor(self.encode_executor, self.encode_screen_frame,
+                                                             screenshot, layer)
                     except Exception as e:
-                        self.log(f"发送图像数据失败: {str(e)}")
-                        break
-                    
-                    # 计算耗时，确保不会超过预期的帧间隔
-                    elapsed = time.time() - start_time
-                    if elapsed > interval * 2:  # 如果耗时超过预期的两倍
-                        self.log(f"警告: 屏幕捕获和发送耗时过长: {elapsed:.2f}秒，超过帧间隔 {interval:.2f}秒的两倍")
+                        self.log(f"屏幕编码错误: {str(e)}")
+                        continue
+                    encode_seconds = time.time() - start_time
+                    stats.record(encode_seconds)
                     
-                except Exception as e:
-                    self.log(f"屏幕捕获或发送错误: {str(e)}")
-                    # 短暂延迟后重试
-                    time.sleep(0.5)
-                    if not self.client_socket or not self.monitoring:
-                        break
-            
-            self.log("屏幕监控已停止")
+                    if layer.reduced_quality is not None:
+                        for subscriber in subscribers:
+                            rate = subscriber.rate_controller
+                            rate.quality = min(rate.quality, layer.reduced_quality)
+                        layer.reduced_quality = None
+                
+                for index, subscriber in enumerate(subscribers):
+                    if message is None:
+                        # 画面没有变化（增量模式下也可能是编码后没有变化块），只按间隔发送心跳
+                        if capture_time - subscriber.last_sent_time < STREAM_HEARTBEAT_INTERVAL:
+                            continue
+                        data = encode_heartbeat_message()
+                    else:
+                        subscriber.force_keyframe = False
+                        # 发送前按连接填写画面头，同一层的其他连接各用一份副本
+                        data = message if index == 0 else bytearray(message)
+                    self.queue_frame(subscriber, data, capture_time, capture_seconds, encode_seconds)
+    
+    def queue_frame(self, subscriber, data, capture_time, capture_seconds, encode_seconds):
+        """把一条画面消息（或心跳）放入连接的发送队列"""
+        subscriber.last_sent_time = capture_time
+        # 序号按编码顺序分配，主控端据此统计丢失的帧（包括这里丢弃的）
+        subscriber.frame_seq += 1
+        frame_info = (subscriber.frame_seq, capture_time, capture_seconds, encode_seconds)
+        
+        # 发送跟不上时丢弃最旧的消息。增量模式下丢掉任何一帧（包括完整画面，其后的增量画面以它为基准）
+        # 或丢掉视频帧后，主控端缺少基准，下一帧改发完整画面；只有心跳可以直接丢弃
+        dropped = self.put_latest(subscriber.messages, (frame_info, data), "编码")
+        if dropped is not None:
+            dropped_codec = dropped[1][MESSAGE_HEADER.size + 1]
+            if dropped_codec == CODEC_H264 or (dropped_codec != CODEC_NONE and subscriber.delta_mode):
+                subscriber.force_keyframe = True
+    
+    async def send_stage(self, subscriber):
+        """流水线第三段：把编码好的消息写入一个连接，受该连接的网络背压控制"""
+        writer = subscriber.writer
+        try:
+            while True:
+                frame_info, message = await subscriber.messages.get()
+                capture_time = frame_info[1]
+                rate = subscriber.rate_controller
+                codec = message[MESSAGE_HEADER.size + 1]
+                
+                # 已有更新的画面在排队、这一帧又超过了设定的延迟上限：跳过它，延迟不再越积越大
+                # （增量模式下排队的增量画面以这一帧为基准，视频帧依赖前一帧，都不能跳过）
+                if (not subscriber.messages.empty() and time.time() - capture_time > subscriber.max_delay
+                        and message[1] == MSG_IMAGE and codec in (CODEC_JPEG, CODEC_PNG)
+                        and not subscriber.delta_mode):
+                    self.pipeline_stats["发送"].dropped += 1
+                    continue
+                
+                # 消息头与图像数据在同一块内存中，一次写入：无分块切片，系统调用次数最少；
+                # 写入是同步的，停止监控（取消任务）只会发生在帧与帧之间，不会留下半帧
+                send_start = time.time()
+                stamp_frame_header(message, *frame_info)
+                writer.write(message)
+                # 网络跟不上时在此等待，而不是在内存中堆积帧；慢的连接不影响其他连接
+                await writer.drain()
+                send_time = time.time() - send_start
+                self.pipeline_stats["发送"].record(send_time)
+                if codec != CODEC_NONE:
+                    subscriber.sent_frames += 1
+                
+                # 根据发送耗时和发送缓冲积压调整该连接后续画面的质量、分辨率和帧率
+                if rate.update(send_time, writer.transport.get_write_buffer_size()):
+                    width, height = rate.frame_size()
+                    self.log(f"自适应调整: 质量 {rate.quality}, 分辨率 {width}x{height}, FPS {rate.fps}")
+                
+                # 从捕获到发送完成的总耗时；流水线中一帧依次经过三段，正常情况下不超过三个帧间隔
+                interval = rate.interval
+                elapsed = time.time() - capture_time
+                if elapsed > interval * 3:
+                    self.log(f"警告: 屏幕捕获到发送耗时过长: {elapsed:.2f}秒，超过帧间隔 {interval:.2f}秒的三倍")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log(f"屏幕画面发送失败: {str(e)}")
+            self.remove_screen_subscriber(writer)
+    
+    def log_pipeline_stats(self):
+        """记录流水线各阶段的耗时统计，以及各连接上次统计以来的实际帧率与目标帧率"""
+        now = time.monotonic()
+        elapsed = max(now - self.stats_since, 1e-6)
+        self.stats_since = now
+        rates = []
+        for subscriber in self.subscribers.values():
+            rates.append(f"{subscriber.sent_frames / elapsed:.1f}/{subscriber.rate_controller.fps}")
+            subscriber.sent_frames = 0
+        self.log("屏幕流水线统计 - " + "; ".join(
+            stats.summary(stage) for stage, stats in self.pipeline_stats.items())
+            + f"; 连接{len(self.subscribers)}个(可见{sum(s.visible for s in self.subscribers.values())}个)"
+            + f", 编码层{len(self.layers)}个; 实际/目标FPS(画面静止时不发送): {', '.join(rates)}")
+    
+    async def capture_and_send_screen(self):
+        """捕获屏幕并发送到所有监控连接
+
+        捕获、编码、发送分为三段流水线并发执行，段间用丢弃最旧项的小队列连接：
+        捕获第 N+1 帧的同时编码第 N 帧、发送第 N-1 帧，帧率取决于最慢的一段而不是各段之和。
+        所有连接共用一次捕获；参数相同的连接共用一次编码，每个连接有自己的发送段。
+        """
+        self.log(f"开始屏幕捕获 - {self.capture_backend.name}")
+        frames = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.capture_wakeup = asyncio.Event()
+        stages = [
+            asyncio.ensure_future(self.capture_stage(frames)),
+            asyncio.ensure_future(self.encode_stage(frames)),
+        ]
+        last_report = time.time()
+        try:
+            while self.monitoring and self.subscribers:
+                done, _ = await asyncio.wait(stages, timeout=1.0, return_when=asyncio.FIRST_COMPLETED)
+                if done:
+                    # 捕获或编码段异常退出，整条流水线停止
+                    for task in done:
+                        if task.exception():
+                            self.log(f"屏幕流水线出错: {str(task.exception())}")
+                    break
+                if time.time() - last_report >= PIPELINE_STATS_INTERVAL:
+                    self.log_pipeline_stats()
+                    last_report = time.time()
             
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
-            self.log(f"屏幕监控线程错误: {str(e)}\n{traceback.format_exc()}")
-            self.monitoring = False
+            self.log(f"屏幕监控任务错误: {str(e)}\n{traceback.format_exc()}")
+        finally:
+            for task in stages:
+                task.cancel()
+            self.log_pipeline_stats()
+            self.log("屏幕监控已停止")
     
     def execute_command(self, cmd):
         """执行系统命令"""
@@ -764,9 +2186,13 @@ if __name__ == "__main__":
             self.log(f"获取网络适配器失败: {str(e)}")
             return ["Ethernet", "Wi-Fi"]
     
-    def receive_file(self, client_socket, file_name, file_size):
-        """接收文件并保存到桌面"""
+    def begin_file_receive(self, writer, request_id, header):
+        """开始接收文件，文件保存到桌面；失败时返回错误信息"""
+        self.abort_file_receive(writer, request_id)
         try:
+            file_name, file_size = header.rsplit("|", 1)
+            file_size = int(file_size)
+            
             # 确保桌面目录存在
             if not os.path.exists(self.desktop_path):
                 os.makedirs(self.desktop_path)
@@ -782,28 +2208,56 @@ if __name__ == "__main__":
                 save_path = os.path.join(self.desktop_path, f"{original_name}_{counter}{extension}")
                 counter += 1
             
-            # 设置接收超时
-            client_socket.settimeout(30)  # 30秒超时
+            self.file_transfers[(writer, request_id)] = {
+                'file': open(save_path, 'wb'),
+                'name': file_name,
+                'path': save_path,
+                'size': file_size,
+                'received': 0,
+                'start_time': time.time()
+            }
+            self.log(f"开始接收文件: {file_name}, 大小: {file_size} 字节")
+            return None
+        except Exception as e:
+            error_msg = f"解析文件传输命令失败: {str(e)}"
+            self.log(error_msg)
+            return error_msg
+    
+    def write_file_chunk(self, writer, request_id, chunk):
+        """写入一个文件数据块；失败时返回错误信息"""
+        transfer = self.file_transfers.get((writer, request_id))
+        if not transfer:
+            return None  # 文件打开失败时，后续数据块直接丢弃
+        
+        try:
+            # 检查是否超时（5分钟）
+            if time.time() - transfer['start_time'] > 300:
+                raise Exception("文件接收超时（5分钟）")
+            
+            transfer['file'].write(chunk)
+            previous = transfer['received']
+            transfer['received'] += len(chunk)
             
-            with open(save_path, 'wb') as f:
-                received = 0
-                start_time = time.time()
-                
-                while received < file_size and self.running:
-                    # 检查是否超时（5分钟）
-                    if time.time() - start_time > 300:
-                        raise Exception("文件接收超时（5分钟）")
-                        
-                    chunk_size = min(4096, file_size - received)
-                    data = client_socket.recv(chunk_size)
-                    if not data:
-                        break
-                    f.write(data)
-                    received += len(data)
-                    
-                    # 每接收1MB输出一次进度
-                    if received % (1024 * 1024) == 0:
-                        self.log(f"文件接收进度: {received}/{file_size} 字节 ({received/file_size*100:.1f}%)")
+            # 每接收1MB输出一次进度
+            if transfer['received'] // (1024 * 1024) > previous // (1024 * 1024):
+                self.log(f"文件接收进度: {transfer['received']}/{transfer['size']} 字节 ({transfer['received']/max(1, transfer['size'])*100:.1f}%)")
+            return None
+        except Exception as e:
+            error_msg = f"接收文件失败: {str(e)}"
+            self.log(error_msg)
+            self.abort_file_receive(writer, request_id)
+            return error_msg
+    
+    def finish_file_receive(self, writer, request_id):
+        """完成文件接收并校验大小"""
+        transfer = self.file_transfers.pop((writer, request_id), None)
+        if not transfer:
+            return "文件接收失败: 没有正在进行的文件传输"
+        
+        try:
+            transfer['file'].close()
+            file_name, save_path = transfer['name'], transfer['path']
+            file_size, received = transfer['size'], transfer['received']
             
             if received == file_size:
                 self.log(f"文件接收完成: {save_path}, 大小: {file_size} 字节")
@@ -818,25 +2272,30 @@ if __name__ == "__main__":
             self.log(error_msg)
             return error_msg
     
+    def abort_file_receive(self, writer, request_id):
+        """中止未完成的文件接收并删除不完整文件"""
+        transfer = self.file_transfers.pop((writer, request_id), None)
+        if not transfer:
+            return
+        try:
+            transfer['file'].close()
+            if os.path.exists(transfer['path']):
+                os.remove(transfer['path'])
+            self.log(f"文件接收已中止: {transfer['name']}")
+        except Exception as e:
+            self.log(f"清理不完整文件失败: {str(e)}")
+    
+    async def serve(self):
+        """事件循环入口：连接到达即由 handle_client 协程处理，空闲时不占用CPU"""
+        if not await self.start_server():
+            return
+        async with self.server:
+            await self.server.serve_forever()
+    
     def main_loop(self):
-        """主循环，处理新连接"""
+        """主循环，运行事件循环处理所有连接"""
         try:
-            while self.running:
-                try:
-                    client_socket, addr = self.server_socket.accept()
-                    self.log(f"接受新连接: {addr}")
-                    client_thread = threading.Thread(target=self.handle_client, args=(client_socket,))
-                    client_thread.daemon = True
-                    client_thread.start()
-                except socket.timeout:
-                    # 超时是正常的，继续等待新连接
-                    continue
-                except Exception as e:
-                    self.log(f"接受连接失败: {str(e)}")
-                    time.sleep(1)
-                
-                # 短暂延迟，减少CPU占用
-                time.sleep(0.1)
+            asyncio.run(self.serve())
         except Exception as e:
             self.log(f"主循环错误: {str(e)}\n{traceback.format_exc()}")
             time.sleep(1)